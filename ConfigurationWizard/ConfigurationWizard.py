@@ -31,6 +31,7 @@ import configparser
 import tkinter.messagebox
 import threading
 import queue
+import struct
 import string
 import re
 from time import sleep, asctime, time
@@ -294,6 +295,19 @@ class ConfigurationWizard:
         UDPSendSocket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
         UDPSendSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
+        multicastGroup = self._multicastGroup()
+        if multicastGroup:
+            try:
+                UDPSendSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL,
+                                         self.config.getint('UDP', 'multicast_ttl', fallback=1))
+                UDPSendSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP,
+                                         1 if self.config.getboolean('UDP', 'multicast_loopback', fallback=True) else 0)
+                interface = self.config.get('UDP', 'multicast_interface', fallback="")
+                if interface:
+                    UDPSendSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+            except (socket.error, ValueError):
+                self.logger.exception("tUDPSend: Failed to setup multicast")
+
         sendPort = int(self.config.get('UDP', 'send_port'))
 
         self.tUDPSendStarted.set()
@@ -308,7 +322,15 @@ class ConfigurationWizard:
                 pass
             else:
                 self.logger.debug("tUDPSend: Got json to send: {}".format(message))
-                if self.config.getboolean('UDP', 'use_local_only'):
+                if multicastGroup:
+                    try:
+                        UDPSendSocket.sendto(message.encode(), (multicastGroup, sendPort))
+                        self.logger.debug("tUDPSend: Put message out via UDP multicast")
+                    except socket.error as msg:
+                        self.logger.warn("tUDPSend: Failed to send via UDP multicast. Error code : {} Message: {}".format(msg.errno, msg.strerror))
+                    else:
+                        self.qJSONDebug.put([message, "TX"])
+                elif self.config.getboolean('UDP', 'use_local_only'):
                     try:
                         UDPSendSocket.sendto(message.encode(), ('127.0.0.255', sendPort))
                         self.logger.debug("tUDPSend: Put message out via UDP to local only")
@@ -345,6 +367,13 @@ class ConfigurationWizard:
             self.logger.exception("tUDPSend: Failed to close socket")
         return
 
+    def _multicastGroup(self):
+        """ Multicast group the Message Bridge is using or None when it broadcasts
+        """
+        if self.config.getboolean('UDP', 'multicast', fallback=False):
+            return self.config.get('UDP', 'multicast_group', fallback="239.255.50.140")
+        return None
+
     # MARK: - UDP listen
     def _initUDPListenThread(self):
         """ Start the UDP Listen thread and queues
@@ -383,6 +412,14 @@ class ConfigurationWizard:
         except socket.error:
             self.logger.exception("tUDPListen: Failed to bind port")
             return
+        multicastGroup = self._multicastGroup()
+        if multicastGroup:
+            interface = self.config.get('UDP', 'multicast_interface', fallback="") or "0.0.0.0"
+            try:
+                UDPListenSocket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                                           struct.pack('4s4s', socket.inet_aton(multicastGroup), socket.inet_aton(interface)))
+            except (socket.error, ValueError):
+                self.logger.exception("tUDPListen: Failed to join multicast group {}".format(multicastGroup))
         UDPListenSocket.setblocking(0)
 
         self.tUDPListenStarted.set()
@@ -1111,8 +1148,10 @@ class ConfigurationWizard:
 
             self.progressWindow.title("Working")
 
+            self.progressText = tk.StringVar()
+            self.progressText.set("Communicating with device please wait")
             tk.Label(self.progressWindow,
-                     text="Communicating with device please wait").pack()
+                     textvariable=self.progressText).pack()
 
             self.progressBar = tkinter.ttk.Progressbar(self.progressWindow,
                                                orient="horizontal", length=200,
@@ -1127,6 +1166,24 @@ class ConfigurationWizard:
             self.progressBar.grid(row=7, column=1, columnspan=4)
             self.progressBar.start()
 
+    def _updateProgress(self, reply):
+        """ Show how many of the settings the device has answered so far,
+            from a PROGRESS DeviceConfigurationRequest reply
+        """
+        self.logger.debug("Progress {} of {}".format(reply.get('answered'), reply.get('total')))
+        if not reply.get('total'):
+            return
+        try:
+            self.progressBar.stop()
+            self.progressBar.config(mode="determinate", maximum=reply['total'],
+                                    value=reply.get('answered', 0))
+            if self._currentFrame != "pressFrame":
+                self.progressText.set("Communicating with device, {} of {} settings".format(
+                                                    reply.get('answered', 0), reply['total']))
+        except tk.TclError:
+            # progress window already closed
+            pass
+
     # MARK: - Display helpers
     def _checkMessageBoxFlagUpdate(self):
         if self._checkMessageBoxFlag:
@@ -1817,6 +1874,13 @@ class ConfigurationWizard:
                     }
                 }
 
+        # settings the Message Bridge has seen from this device recently
+        # don't need to be asked for again while it is in CONFIGME
+        cacheOk = self.config.getint('DCR', 'cache_max_age', fallback=0)
+        if cacheOk and self.device['devID'] != "??":
+            dcr['data']['devID'] = self.device['devID']
+            dcr['data']['cacheOk'] = cacheOk
+
         self._lastDCR.append(dcr)
         self._sendRequest(dcr)
 
@@ -1881,17 +1945,22 @@ class ConfigurationWizard:
                         else:
                             if 'id' in jsonin:
                                 self._messageBridges[network]['data']['id'] = jsonin['data']['id']
-                            if 'result' in jsonin:
+                            if 'result' in jsonin['data']:
                                 results = jsonin['data']['result']
                                 if not 'result' in self._messageBridges[network]['data']:
                                     self._messageBridges[network]['data']['result'] = results
                                 else:
                                     if 'PANID' in results:
                                         self._messageBridges[network]['data']['result']['PANID'] = results['PANID']
-                                    if 'encryptionState' in results:
+                                    if 'encryptionSet' in results:
                                         self._messageBridges[network]['data']['result']['encryptionSet'] = results['encryptionSet']
                                     if 'deviceStore' in results:
-                                        self._messageBridges[network]['data']['result']['deviceStore'] = results['deviceStore']
+                                        # large device stores are split over several replies, the first one replaces
+                                        # what we had and the rest add to it
+                                        if jsonin['data'].get('sequence', 0) == 0 or not 'deviceStore' in self._messageBridges[network]['data']['result']:
+                                            self._messageBridges[network]['data']['result']['deviceStore'] = results['deviceStore']
+                                        else:
+                                            self._messageBridges[network]['data']['result']['deviceStore'].update(results['deviceStore'])
         else:
             # new entry store the whole packet
             jsonin['conflict'] = False
@@ -1918,6 +1987,8 @@ class ConfigurationWizard:
 
     def _sendRequest(self, dcr):
         self.logger.debug("Sending Request to Message Bridge")
+        # ask for a PROGRESS reply as each setting is answered
+        dcr['data']['progress'] = 1
         self._displayProgress()
         self._starttime = time()
         self.fWaitingForReply.set()
@@ -1948,6 +2019,12 @@ class ConfigurationWizard:
                     # added this to cope with receiving multiple replies
                     # e.g. if there are multiple network interfaces active
                     self.master.after(500, self._replyCheck)
+                elif json['data'].get('state') == "PROGRESS":
+                    # the device is still answering, show how far it has got
+                    # and restart the wait for the final reply
+                    self._updateProgress(json['data'])
+                    self._starttime = time()
+                    self.master.after(100, self._replyCheck)
                 else:
                     self.logger.debug("reply is expected ID: {}".format(json['data']['id']))
                     # close wait diag and return reply
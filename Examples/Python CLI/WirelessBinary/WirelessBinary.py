@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" WirelessBinary encoder and decoder
+    Compact binary alternative to WirelessMessage JSON on the UDP ports,
+    see Documentation/ExampleBinaryMessages.txt
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+from collections import namedtuple
+import struct
+import zlib
+
+class WirelessBinary():
+    """ One or more records back to back in a datagram, each record is a
+        17 byte header in network byte order followed by the payload
+
+            magic       2 bytes  b'WB'
+            version     1 byte   1
+            type        1 byte   Received or Send
+            networkID   2 bytes  networkID() of the network name, 0 for ALL
+            timestamp   8 bytes  monotonic nanoseconds on the sending host
+            id          2 bytes  device ID, ASCII
+            length      1 byte   payload length
+            payload     length bytes, the Language of Things message without
+                        the leading 'a', the ID and the '-' padding
+    """
+
+    magic = b'WB'
+    version = 1
+
+    Received = 1    # heard from a device, sent by a Message Bridge
+    Send = 2        # to be sent to a device, sent to a Message Bridge
+
+    AllNetworks = 0
+
+    Record = namedtuple('Record', ['type', 'networkID', 'timestamp', 'id', 'data'])
+
+    _header = struct.Struct('!2sBBHQ2sB')
+    headerSize = _header.size
+
+    @classmethod
+    def networkID(cls, network):
+        """ 16 bit ID for a network name, "ALL" is AllNetworks
+        """
+        if network == "ALL":
+            return cls.AllNetworks
+        return (zlib.crc32(network.encode()) & 0xFFFF) or 1
+
+    @classmethod
+    def encode(cls, type, networkID, timestamp, id, data):
+        """ A single record as bytes, records can be joined into one datagram
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        if len(data) > 255:
+            raise ValueError("Payload too long: {}".format(len(data)))
+        return cls._header.pack(cls.magic, cls.version, type, networkID, timestamp, id.encode(), len(data)) + data
+
+    @classmethod
+    def decode(cls, datagram):
+        """ All the records in a datagram
+            Raises ValueError if the datagram is not valid
+        """
+        records = []
+        offset = 0
+        size = len(datagram)
+        while offset < size:
+            if size - offset < cls.headerSize:
+                raise ValueError("Truncated header at {}".format(offset))
+            (magic, version, type, networkID, timestamp, id, length) = cls._header.unpack_from(datagram, offset)
+            if magic != cls.magic or version != cls.version:
+                raise ValueError("Not a version {} WirelessBinary record".format(cls.version))
+            offset += cls.headerSize
+            if size - offset < length:
+                raise ValueError("Truncated payload at {}".format(offset))
+            data = bytes(datagram[offset:offset + length])
+            offset += length
+            records.append(cls.Record(type, networkID, timestamp, id.decode('ascii', 'replace'), data.decode('ascii', 'replace')))
+        return records
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Binary UDP listener
+
+    listen for binary wire format broadcasts on port 50143
+    ([Binary] enabled = True in the Message Bridge config)
+    and print each message
+
+    usage
+    $ python binaryUDPListen.py
+    or
+    $ ./binaryUDPListen.py
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import sys
+import socket
+import struct
+from WirelessBinary import WirelessBinary
+
+FROM_PORT = 50143
+MULTICAST_GROUP = None     # eg '239.255.50.140' when the Message Bridge has [UDP] multicast = True
+
+sock = socket.socket(socket.AF_INET, # Internet
+              socket.SOCK_DGRAM) # UDP
+
+sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+if sys.platform == 'darwin':
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+sock.bind(('', FROM_PORT))
+if MULTICAST_GROUP:
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                    struct.pack('4s4s', socket.inet_aton(MULTICAST_GROUP), socket.inet_aton('0.0.0.0')))
+
+while True:
+    data, addr = sock.recvfrom(1024*8)
+    try:
+        records = WirelessBinary.decode(data)
+    except ValueError as error:
+        print(("Invalid datagram from {}: {}".format(addr[0], error)))
+        continue
+    for record in records:
+        if record.type == WirelessBinary.Received:
+            print(("Device: {} Data: {} Network: {} Time: {:.3f}".format(record.id, record.data, record.networkID, record.timestamp / 1e9)))
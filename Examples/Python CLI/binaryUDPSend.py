@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Binary UDP send
+
+    send two commands to device MA in the binary wire format on port 50144
+    ([Binary] enabled = True in the Message Bridge config)
+
+    usage
+    $ python binaryUDPSend.py
+    or
+    $ ./binaryUDPSend.py
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import sys
+import socket
+from time import monotonic
+from WirelessBinary import WirelessBinary
+
+TO_PORT = 50144
+
+sock = socket.socket(socket.AF_INET, # Internet
+                     socket.SOCK_DGRAM) # UDP
+
+sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+if sys.platform == 'darwin':
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+network = WirelessBinary.networkID("ALL")   # or WirelessBinary.networkID("Serial")
+now = int(monotonic() * 1e9)
+# two records in one datagram, this will result in two message going out via the radio
+# aMAHELLO---- and aMATEMP-----
+data = (WirelessBinary.encode(WirelessBinary.Send, network, now, "MA", "HELLO") +
+        WirelessBinary.encode(WirelessBinary.Send, network, now, "MA", "TEMP"))
+
+try:
+    sock.sendto(data, ('<broadcast>', TO_PORT))
+except socket.error as msg:
+    try:
+        sock.sendto(data, ('127.0.0.255', TO_PORT))
+    except socket.error as msg:
+        print(("Failed to send, Error code : {} Message: {}".format(msg.errno, msg.strerror)))
+    else:
+        print(("Sent: {}".format(data.hex())))
+else:
+    print(("Sent: {}".format(data.hex())))
+
+sock.close()
@@ -32,10 +32,12 @@ import sys
 from time import time, sleep
 import os
 import socket
+import struct
 import json
 
 FROM_PORT = 50140
 TO_PORT = 50141
+MULTICAST_GROUP = None     # eg '239.255.50.140' when the Message Bridge has [UDP] multicast = True
 
 sock = socket.socket(socket.AF_INET, # Internet
               socket.SOCK_DGRAM) # UDP
@@ -46,20 +48,30 @@ if sys.platform == 'darwin':
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
 sock.bind(('', FROM_PORT))
+if MULTICAST_GROUP:
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                    struct.pack('4s4s', socket.inet_aton(MULTICAST_GROUP), socket.inet_aton('0.0.0.0')))
 lasttime = time()
 
 while True:
     data, addr = sock.recvfrom(1024*8)
     pydata = json.loads(data.decode())
-    if pydata['type'] == 'WirelessMessage':
-        if len(sys.argv) == 3:
-            if pydata['network'] != sys.argv[2]:
-                continue
+    if pydata['type'] == 'WirelessMessageBatch':
+        # several messages in one packet, each is a WirelessMessage without type and network
+        messages = pydata['messages']
+    elif pydata['type'] == 'WirelessMessage':
+        messages = [pydata]
+    else:
+        continue
+    if len(sys.argv) == 3:
+        if pydata['network'] != sys.argv[2]:
+            continue
+    for message in messages:
         if len(sys.argv) >= 2:
-            if pydata['id'] == sys.argv[1]:
+            if message['id'] == sys.argv[1]:
                 now = time()
                 timediff = now - lasttime
                 lasttime = now
-                print(("Device: {} Data: {} Time: {} Network: {} Timesince: {}".format(pydata['id'], pydata['data'][0], pydata['timestamp'], pydata['network'], timediff)))
+                print(("Device: {} Data: {} Time: {} Network: {} Timesince: {}".format(message['id'], message['data'][0], message['timestamp'], pydata['network'], timediff)))
         else:
-            print(("Device: {} Data: {}".format(pydata['id'], pydata['data'][0])))
+            print(("Device: {} Data: {}".format(message['id'], message['data'][0])))
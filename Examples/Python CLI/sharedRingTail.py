@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Shared ring tail
+
+    tail the Message Bridge shared memory ring ([SharedRing] enabled = True
+    in the Message Bridge config) and print each message, messages that were
+    overwritten before they could be read are reported as lost
+
+    usage
+    $ python sharedRingTail.py
+    or
+    $ ./sharedRingTail.py /dev/shm/MessageBridge.ring
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import sys
+from time import monotonic
+from SharedRing import SharedRingReader
+
+RING_PATH = sys.argv[1] if len(sys.argv) > 1 else "/dev/shm/MessageBridge.ring"
+
+ring = SharedRingReader(RING_PATH)
+print(("Tailing {} for network {}".format(RING_PATH, ring.network)))
+
+lost = 0
+try:
+    while True:
+        if not ring.wait():
+            continue
+        for record in ring.read():
+            print(("Device: {} Data: {} Sequence: {} Age: {:.3f}ms".format(record.id, record.data, record.sequence,
+                                                                          (monotonic() * 1e9 - record.timestamp) / 1e6)))
+        if ring.lost != lost:
+            print(("Lost {} messages".format(ring.lost - lost)))
+            lost = ring.lost
+except KeyboardInterrupt:
+    ring.close()
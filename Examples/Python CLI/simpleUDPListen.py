@@ -23,9 +23,11 @@ import sys
 from time import time, sleep
 import os
 import socket
+import struct
 
 FROM_PORT = 50140
 TO_PORT = 50141
+MULTICAST_GROUP = None     # eg '239.255.50.140' when the Message Bridge has [UDP] multicast = True
 
 sock = socket.socket(socket.AF_INET, # Internet
               socket.SOCK_DGRAM) # UDP
@@ -36,6 +38,9 @@ if sys.platform == 'darwin':
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
 sock.bind(('', FROM_PORT))
+if MULTICAST_GROUP:
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                    struct.pack('4s4s', socket.inet_aton(MULTICAST_GROUP), socket.inet_aton('0.0.0.0')))
 
 while True:
     data, addr = sock.recvfrom(1024)
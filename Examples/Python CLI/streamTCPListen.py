@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Stream TCP listener
+
+    connect to the Message Bridge stream endpoint ([Stream] enabled = True)
+    and print the WirelessMessages for the given device IDs (all devices if
+    none are given), one JSON message arrives per line
+
+    usage
+    $ python streamTCPListen.py
+    or
+    $ ./streamTCPListen.py MA MB
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import sys
+import socket
+import json
+
+HOST = "127.0.0.1"
+PORT = 50145
+
+sock = socket.create_connection((HOST, PORT))
+
+subscribe = {
+    'type': "Subscribe",
+    'network': "ALL",
+    'data': {
+        'format': "batch",
+        'filter': {'type': ["WirelessMessage"]}
+    }
+}
+if len(sys.argv) > 1:
+    subscribe['data']['filter']['id'] = sys.argv[1:]
+sock.sendall(json.dumps(subscribe).encode() + b'\n')
+
+try:
+    for line in sock.makefile('rb'):
+        pydata = json.loads(line.decode())
+        if pydata['type'] == 'Subscribe':
+            print(("{} to {}".format(pydata['state'], pydata['network'])))
+        elif pydata['type'] == 'WirelessMessageBatch':
+            for message in pydata['messages']:
+                print(("Device: {} Data: {}".format(message['id'], message['data'][0])))
+        elif pydata['type'] == 'WirelessMessage':
+            print(("Device: {} Data: {}".format(pydata['id'], pydata['data'][0])))
+except KeyboardInterrupt:
+    pass
+sock.close()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Subscribing UDP listener
+
+    ask the Message Bridges on port 50141 to unicast WirelessMessages for the
+    given device IDs to us (all devices if none are given) and print them,
+    the subscription is renewed before its lease runs out
+
+    usage
+    $ python subscribeUDPListen.py
+    or
+    $ ./subscribeUDPListen.py MA MB
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import sys
+from time import time
+import socket
+import json
+
+TO_PORT = 50141
+LEASE = 60
+
+sock = socket.socket(socket.AF_INET, # Internet
+                     socket.SOCK_DGRAM) # UDP
+
+sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+sock.bind(('', 0))      # any free port, the Message Bridge replies to it
+sock.settimeout(1)
+
+subscribe = {
+    'type': "Subscribe",
+    'network': "ALL",
+    'data': {
+        'ttl': LEASE,
+        'filter': {'type': ["WirelessMessage"]}
+    }
+}
+if len(sys.argv) > 1:
+    subscribe['data']['filter']['id'] = sys.argv[1:]
+
+def sendSubscribe(ttl):
+    subscribe['data']['ttl'] = ttl
+    data = json.dumps(subscribe).encode()
+    try:
+        sock.sendto(data, ('<broadcast>', TO_PORT))
+    except socket.error:
+        sock.sendto(data, ('127.0.0.255', TO_PORT))
+
+renew = 0
+try:
+    while True:
+        if time() >= renew:
+            sendSubscribe(LEASE)
+            renew = time() + LEASE / 2
+        try:
+            data, addr = sock.recvfrom(1024*8)
+        except socket.timeout:
+            continue
+        pydata = json.loads(data.decode())
+        if pydata['type'] == 'Subscribe':
+            print(("{} from {} ({}) for {} seconds".format(pydata['state'], pydata['network'], addr[0], pydata['data'].get('ttl'))))
+        elif pydata['type'] == 'WirelessMessageBatch':
+            for message in pydata['messages']:
+                print(("Device: {} Data: {}".format(message['id'], message['data'][0])))
+        elif pydata['type'] == 'WirelessMessage':
+            print(("Device: {} Data: {}".format(pydata['id'], pydata['data'][0])))
+except KeyboardInterrupt:
+    sendSubscribe(0)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Unix datagram listener
+
+    subscribe on the Message Bridge unix datagram socket ([Unix] datagram_path)
+    and print the WirelessMessages for the given device IDs (all devices if
+    none are given), for clients on the same host as the Message Bridge
+
+    usage
+    $ python unixDatagramListen.py
+    or
+    $ ./unixDatagramListen.py MA MB
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import sys
+import os
+from time import time
+import socket
+import json
+
+BRIDGE_PATH = "/tmp/MessageBridge.sock"
+CLIENT_PATH = "/tmp/unixDatagramListen.{}.sock".format(os.getpid())
+LEASE = 60
+
+sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+sock.bind(CLIENT_PATH)      # the Message Bridge sends to the path we are bound to
+sock.settimeout(1)
+
+subscribe = {
+    'type': "Subscribe",
+    'network': "ALL",
+    'data': {
+        'ttl': LEASE,
+        'filter': {'type': ["WirelessMessage"]}
+    }
+}
+if len(sys.argv) > 1:
+    subscribe['data']['filter']['id'] = sys.argv[1:]
+
+def sendSubscribe(ttl):
+    subscribe['data']['ttl'] = ttl
+    sock.sendto(json.dumps(subscribe).encode(), BRIDGE_PATH)
+
+renew = 0
+try:
+    while True:
+        if time() >= renew:
+            sendSubscribe(LEASE)
+            renew = time() + LEASE / 2
+        try:
+            data = sock.recv(1024*64)
+        except socket.timeout:
+            continue
+        pydata = json.loads(data.decode())
+        if pydata['type'] == 'Subscribe':
+            print(("{} from {} for {} seconds".format(pydata['state'], pydata['network'], pydata['data'].get('ttl'))))
+        elif pydata['type'] == 'WirelessMessageBatch':
+            for message in pydata['messages']:
+                print(("Device: {} Data: {}".format(message['id'], message['data'][0])))
+        elif pydata['type'] == 'WirelessMessage':
+            print(("Device: {} Data: {}".format(pydata['id'], pydata['data'][0])))
+except KeyboardInterrupt:
+    sendSubscribe(0)
+finally:
+    sock.close()
+    os.unlink(CLIENT_PATH)
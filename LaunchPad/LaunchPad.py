@@ -40,6 +40,7 @@ from distutils import dir_util
 import stat
 import socket
 import select
+import struct
 import logging
 from Tabs import *
 import ScrolledText
@@ -922,6 +923,13 @@ class LaunchPad:
 
             self.master.after(1000, self.checkUDPThreads)
 
+    def _multicastGroup(self):
+        """ Multicast group the Message Bridge is using or None when it broadcasts
+        """
+        if self.config.getboolean('UDP', 'multicast'):
+            return self.config.get('UDP', 'multicast_group')
+        return None
+
     def _UDPListenThread(self):
         """ UDP Listen Thread
         """
@@ -942,6 +950,15 @@ class LaunchPad:
         except socket.error:
             self.logger.error("tUDPListen: Failed to bind port, Exiting")
 
+        multicastGroup = self._multicastGroup()
+        if multicastGroup:
+            interface = self.config.get('UDP', 'multicast_interface') or "0.0.0.0"
+            try:
+                UDPListenSocket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                                           struct.pack('4s4s', socket.inet_aton(multicastGroup), socket.inet_aton(interface)))
+            except (socket.error, ValueError):
+                self.logger.error("tUDPListen: Failed to join multicast group {}".format(multicastGroup))
+
         UDPListenSocket.setblocking(0)
 
         self.logger.debug("tUDPListen: listening")
@@ -1045,6 +1062,19 @@ class LaunchPad:
         UDPSendSocket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
         UDPSendSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
+        multicastGroup = self._multicastGroup()
+        if multicastGroup:
+            try:
+                UDPSendSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL,
+                                         self.config.getint('UDP', 'multicast_ttl'))
+                UDPSendSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP,
+                                         1 if self.config.getboolean('UDP', 'multicast_loopback') else 0)
+                if self.config.get('UDP', 'multicast_interface'):
+                    UDPSendSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                                             socket.inet_aton(self.config.get('UDP', 'multicast_interface')))
+            except (socket.error, ValueError):
+                self.logger.error("tUDPSend: Failed to setup multicast")
+
         sendPort = int(self.config.get('UDP', 'send_port'))
 
         while not self.tUDPSendStop.is_set():
@@ -1057,6 +1087,14 @@ class LaunchPad:
                 pass
             else:
                 self.logger.debug("tUDPSend: Got json to send: {}".format(message))
+                if multicastGroup:
+                    try:
+                        UDPSendSocket.sendto(message, (multicastGroup, sendPort))
+                        self.logger.debug("tUDPSend: Put message out via UDP multicast")
+                    except socket.error as msg:
+                        self.logger.warn("tUDPSend: Failed to send via UDP multicast. Error code : {} Message: {}".format(msg[0], msg[1]))
+                    self.qUDPSend.task_done()
+                    continue
                 try:
                     UDPSendSocket.sendto(message, ('<broadcast>', sendPort))
                     self.logger.debug("tUDPSend: Put message out via UDP")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Bounded Queue Class
+    queue.Queue with an overflow policy and drop accounting
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+from time import monotonic
+import queue
+
+class BoundedQueue(queue.Queue):
+    """ A queue.Queue that applies an overflow policy when it is full
+
+        The policy is applied on put() and put_nowait() alike
+            drop_oldest  the oldest item is thrown away to make room, put never fails
+            drop_newest  the new item is thrown away and queue.Full is raised
+            block        wait up to timeout seconds for room, then as drop_newest,
+                         put(block=False) and put_nowait() never wait
+        Dropped items and the highest depth seen are counted for reporting
+        notify, if given, is called after every successful put so a consumer
+        can block on something other than the queue itself
+    """
+
+    DropOldest = "drop_oldest"
+    DropNewest = "drop_newest"
+    Block = "block"
+    policies = (DropOldest, DropNewest, Block)
+
+    def __init__(self, maxsize=0, policy=DropNewest, timeout=1, notify=None):
+        if policy not in self.policies:
+            raise ValueError("Invalid queue policy: {}".format(policy))
+        queue.Queue.__init__(self, maxsize)
+        self.policy = policy
+        self.timeout = timeout
+        self.notify = notify
+        self.drops = 0
+        self.highWater = 0
+
+    def put(self, item, block=True, timeout=None):
+        with self.not_full:
+            if not self._putPolicy(item, block, timeout):
+                raise queue.Full
+        if self.notify:
+            self.notify()
+
+    def putMany(self, items):
+        """ Put each of items applying the policy, taking the lock and calling
+            notify once for the lot
+            Returns the number of items put, the rest were dropped
+        """
+        count = 0
+        with self.not_full:
+            for item in items:
+                if self._putPolicy(item):
+                    count += 1
+        if count and self.notify:
+            self.notify()
+        return count
+
+    def _putPolicy(self, item, block=True, timeout=None):
+        """ Put one item with not_full held, block and timeout only apply
+            to the block policy, timeout None uses the queue's own
+            Returns False if the item was dropped
+        """
+        if self.maxsize > 0 and self._qsize() >= self.maxsize:
+            if self.policy == self.DropOldest:
+                self._get()
+                # the dropped item will never be marked done
+                self.unfinished_tasks -= 1
+                self.drops += 1
+            elif self.policy == self.DropNewest or not block:
+                self.drops += 1
+                return False
+            else:
+                endtime = monotonic() + (self.timeout if timeout is None else timeout)
+                while self._qsize() >= self.maxsize:
+                    remaining = endtime - monotonic()
+                    if remaining <= 0.0:
+                        self.drops += 1
+                        return False
+                    self.not_full.wait(remaining)
+        self._put(item)
+        self.unfinished_tasks += 1
+        if self._qsize() > self.highWater:
+            self.highWater = self._qsize()
+        self.not_empty.notify()
+        return True
+
+    def stats(self):
+        """ Current depth, limits and drop counts as a dict
+        """
+        with self.mutex:
+            return {'size': self._qsize(),
+                    'maxsize': self.maxsize,
+                    'policy': self.policy,
+                    'drops': self.drops,
+                    'highWater': self.highWater
+                    }
@@ -0,0 +1,3 @@
+from .BoundedQueue import BoundedQueue
+
+__ALL__ = ['BoundedQueue']
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" DCR Cache Class
+    Last known replies from each device to DeviceConfigurationRequest queries
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+from time import time
+import threading
+
+class DCRCache():
+    """ Replies by device ID, each with the time it was heard, and the
+        device type the replies came from
+
+        A request with cacheOk can take replies younger than cacheOk seconds
+        from here instead of asking the device. The replies are only good
+        for a device of the same type, a cache entry for a different type
+        is left alone.
+
+        The dict is kept in least recently updated order so the oldest
+        device goes first once maxDevices is reached.
+
+        Thread safe, updated and read by the DCR thread, reported by the
+        main thread.
+    """
+
+    def __init__(self, maxDevices=2048, exclude=()):
+        self._maxDevices = maxDevices
+        self._exclude = set(exclude)
+        self._devices = {}      # id: {'devType': , 'replies': {command: (reply, time)}}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._devices)
+
+    def cacheable(self, command):
+        return command not in self._exclude
+
+    def update(self, _id, devType, replies, now=None):
+        """ Store the {command: reply} heard from device _id
+        """
+        if now is None:
+            now = time()
+        with self._lock:
+            device = self._devices.pop(_id, None)
+            if device is None or (devType and device['devType'] and device['devType'] != devType):
+                # new device or a different device now has this ID
+                if self._maxDevices and len(self._devices) >= self._maxDevices:
+                    del self._devices[next(iter(self._devices))]
+                device = {'devType': devType, 'replies': {}}
+            elif devType:
+                device['devType'] = devType
+            for (command, reply) in replies.items():
+                if self.cacheable(command):
+                    device['replies'][command] = (reply, now)
+            self._devices[_id] = device
+
+    def forget(self, _id):
+        """ Drop everything known about _id, after a reset
+        """
+        with self._lock:
+            self._devices.pop(_id, None)
+
+    def lookup(self, _id, devType, commands, maxAge, now=None):
+        """ Cached replies for commands from device _id no older than maxAge
+            seconds, devType None matches any type
+            Returns {command: (reply, age)} for the commands it has
+        """
+        if now is None:
+            now = time()
+        with self._lock:
+            device = self._devices.get(_id)
+            if device is None or (devType is not None and device['devType'] != devType):
+                return {}
+            found = {}
+            for command in commands:
+                if command in device['replies']:
+                    (reply, heard) = device['replies'][command]
+                    if now - heard <= maxAge:
+                        found[command] = (reply, now - heard)
+            return found
+
+    def report(self, now=None):
+        """ The cache as a dict of device ID to devType and the replies with
+            their ages in seconds, suitable for JSON
+        """
+        if now is None:
+            now = time()
+        with self._lock:
+            return {_id: {'devType': device['devType'],
+                          'replies': {command: {'reply': reply, 'age': round(now - heard, 1)}
+                                      for (command, (reply, heard)) in device['replies'].items()}
+                          }
+                    for (_id, device) in self._devices.items()}
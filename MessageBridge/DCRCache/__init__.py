@@ -0,0 +1,3 @@
+from .DCRCache import DCRCache
+
+__ALL__ = ['DCRCache']
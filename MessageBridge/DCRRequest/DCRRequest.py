@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Device Configuration Request Class
+    State for one in flight DeviceConfigurationRequest
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+from time import monotonic
+from itertools import count
+
+class DCRRequest():
+    """ One DeviceConfigurationRequest being worked on
+
+        The DCR thread owns the request json, replies, timeout and the
+        progress message sequence.
+        The serial thread owns the query position and retry count while
+        it is talking to a device in CONFIGME mode for this request.
+        cancelled is set by the DCR thread once the request has been
+        answered so the serial thread can drop it.
+    """
+
+    _keys = count(1)
+
+    def __init__(self, request, toQuery, timeout):
+        self.key = next(self._keys)
+        self.request = request
+        self.id = request['data'].get('id', None)
+        self.devType = request['data'].get('devType', None)
+        self.toQuery = toQuery
+        self.timeout = timeout
+        self.started = monotonic()
+        self.deadline = self.started + timeout
+        self.cancelled = False
+        # send a progress message as each reply comes in
+        self.progress = bool(request['data'].get('progress', False))
+        self.sequence = 0
+
+        # serial thread state
+        self.position = 0
+        self.retryCount = 0
+
+    def __repr__(self):
+        return "DCRRequest(key={}, id={}, devType={})".format(self.key, self.id, self.devType)
+
+    def target(self):
+        """ What the request is addressed to, a new request for the same
+            target replaces one still in flight
+        """
+        return (self.id, self.devType)
+
+    def touch(self):
+        """ Restart the timeout, called on each reply from the device
+        """
+        self.deadline = monotonic() + self.timeout
+
+    def matchesDevType(self, devType):
+        """ True if a device reporting devType can answer this request
+        """
+        return self.devType is None or self.devType == devType
+
+    def current(self):
+        """ The toQuery entry currently being asked
+        """
+        return self.toQuery[self.position]
+
+    def finished(self):
+        return self.position >= len(self.toQuery)
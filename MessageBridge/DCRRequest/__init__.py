@@ -0,0 +1,3 @@
+from .DCRRequest import DCRRequest
+
+__ALL__ = ['DCRRequest']
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Deduplicator Class
+    Drops repeats of a Language of Things message heard again within a short
+    window, as devices send each reading more than once
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+from collections import deque
+from time import monotonic
+import threading
+
+class Deduplicator():
+    """ Remembers each (id, payload) seen in the last window seconds
+
+        seen() says if a message is a repeat of one let through less than
+        window seconds ago. The window runs from the first copy so a device
+        that keeps sending the same reading still gets one through every
+        window seconds.
+
+        Entries are kept in a dict for the lookup and in a deque in the order
+        they were added, so expiring the old ones only ever looks at the front
+        of the deque and the cost per message stays the same however many
+        devices there are.
+
+        Thread safe, seen() is called by the serial thread and report() by
+        the main thread.
+    """
+
+    def __init__(self, window=0):
+        self.window = window
+        self.passed = 0
+        self.suppressed = 0
+        self._seen = {}             # (id, payload): time let through
+        self._order = deque()       # (time, (id, payload)) oldest first
+        self._suppressed = {}       # id: duplicates dropped
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._seen)
+
+    def seen(self, _id, payload, now=None):
+        """ Check a message against the window
+            Returns True if it is a duplicate and should be dropped
+        """
+        if now is None:
+            now = monotonic()
+        with self._lock:
+            if self.window <= 0:
+                self.passed += 1
+                return False
+            self._expire(now)
+            key = (_id, payload)
+            if key in self._seen:
+                self.suppressed += 1
+                self._suppressed[_id] = self._suppressed.get(_id, 0) + 1
+                return True
+            self._seen[key] = now
+            self._order.append((now, key))
+            self.passed += 1
+            return False
+
+    def _expire(self, now):
+        """ Forget the entries older than window, with the lock held
+        """
+        order = self._order
+        cutoff = now - self.window
+        while order and order[0][0] <= cutoff:
+            del self._seen[order.popleft()[1]]
+
+    def report(self):
+        """ Duplicates dropped in total and per device as a dict
+        """
+        with self._lock:
+            return {'window': self.window,
+                    'passed': self.passed,
+                    'suppressed': self.suppressed,
+                    'devices': dict(self._suppressed)
+                    }
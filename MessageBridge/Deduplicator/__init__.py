@@ -0,0 +1,3 @@
+from .Deduplicator import Deduplicator
+
+__ALL__ = ['Deduplicator']
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Device Store Classes
+    Bounded per device history of received Language of Things messages
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import os
+import json
+import threading
+
+class DeviceRecord():
+    """ What we know about one device ID
+
+        The last historyLength messages are kept in a fixed size ring of
+        (timestamp, data) pairs, index points at the next slot to write
+    """
+    __slots__ = ('firstSeen', 'lastSeen', 'count', 'history', 'index', 'version')
+
+    def __init__(self, historyLength, firstSeen):
+        self.firstSeen = firstSeen
+        self.lastSeen = firstSeen
+        self.count = 0
+        self.history = [None] * historyLength
+        self.index = 0
+        self.version = 0
+
+    def add(self, timestamp, data, version):
+        self.history[self.index] = (timestamp, data)
+        self.index = (self.index + 1) % len(self.history)
+        self.lastSeen = timestamp
+        self.count += 1
+        self.version = version
+
+    def last(self):
+        """ The most recent (timestamp, data)
+        """
+        return self.history[self.index - 1]
+
+    def readings(self):
+        """ The stored (timestamp, data) pairs oldest first
+        """
+        return [entry for entry in self.history[self.index:] + self.history[:self.index] if entry]
+
+    def report(self, history=False):
+        (timestamp, data) = self.last()
+        result = {'data': data,
+                  'timestamp': timestamp,
+                  'firstSeen': self.firstSeen,
+                  'count': self.count
+                  }
+        if history:
+            result['history'] = [{'data': d, 'timestamp': t} for (t, d) in self.readings()]
+        return result
+
+class DeviceStore():
+    """ The last few messages seen from every device
+
+        Written to by the serial thread and read by the main thread so all
+        access is under a lock. Can be saved to and loaded from a JSON file
+        so a restarted Message Bridge can answer deviceStore requests
+        straight away. When full the device heard from least recently is
+        dropped to make room.
+        Every update bumps version and tags the device with it so clients
+        can ask for just the devices that changed since a version they hold.
+    """
+
+    def __init__(self, historyLength=10, maxDevices=2048):
+        self._historyLength = max(1, historyLength)
+        self._maxDevices = maxDevices
+        self._devices = {}
+        self._lock = threading.Lock()
+        self.changed = False
+        self.version = 0
+
+    def __len__(self):
+        return len(self._devices)
+
+    def update(self, _id, data, timestamp):
+        """ Record a message from device _id
+        """
+        with self._lock:
+            # the dict is kept in least recently heard order
+            record = self._devices.pop(_id, None)
+            if record is None:
+                if self._maxDevices and len(self._devices) >= self._maxDevices:
+                    del self._devices[next(iter(self._devices))]
+                record = DeviceRecord(self._historyLength, timestamp)
+            self._devices[_id] = record
+            self.version += 1
+            record.add(timestamp, data, self.version)
+            self.changed = True
+
+    def report(self, history=False, since=None, offset=0, limit=None):
+        """ The store as a dict of device ID to its last message, suitable for JSON
+            since, only devices changed after this store version
+            offset and limit, page through the matching devices in ID order
+            Returns (version, total matching devices, dict)
+        """
+        with self._lock:
+            if since is not None and since > self.version:
+                # version from before a restart without a snapshot, send everything
+                since = None
+            ids = sorted(_id for (_id, record) in self._devices.items()
+                         if since is None or record.version > since)
+            total = len(ids)
+            ids = ids[offset:offset + limit] if limit else ids[offset:]
+            return (self.version, total, {_id: self._devices[_id].report(history) for _id in ids})
+
+    def save(self, path):
+        """ Write the store to path, via a temporary file so a crash part way
+            through never leaves a broken snapshot
+        """
+        with self._lock:
+            snapshot = {'historyLength': self._historyLength,
+                        'version': self.version,
+                        'devices': {_id: {'firstSeen': record.firstSeen,
+                                          'count': record.count,
+                                          'version': record.version,
+                                          'history': record.readings()
+                                          }
+                                    for (_id, record) in self._devices.items()}
+                        }
+            self.changed = False
+        temp = path + ".tmp"
+        with open(temp, 'w') as snapshotFile:
+            json.dump(snapshot, snapshotFile)
+        os.replace(temp, path)
+
+    def load(self, path):
+        """ Read a snapshot written by save(), returns the number of devices loaded
+            Raises ValueError if the file is not a valid snapshot, the store
+            is left as it was
+        """
+        with open(path, 'r') as snapshotFile:
+            snapshot = json.load(snapshotFile)
+        try:
+            version = int(snapshot.get('version', 0))
+            devices = {}
+            for (_id, stored) in snapshot.get('devices', {}).items():
+                history = stored.get('history', [])
+                if not isinstance(history, list):
+                    raise TypeError("history for {} is not a list".format(_id))
+                if not history:
+                    continue
+                record = DeviceRecord(self._historyLength, stored.get('firstSeen', history[0][0]))
+                for (timestamp, data) in history[-self._historyLength:]:
+                    record.add(timestamp, data, int(stored.get('version', version)))
+                record.count = int(stored.get('count', len(history)))
+                devices[_id] = record
+        except (AttributeError, TypeError, KeyError, IndexError, ValueError) as error:
+            raise ValueError("Invalid device store snapshot {}: {}".format(path, error))
+        with self._lock:
+            self._devices = devices
+            self.version = version
+            self.changed = False
+            return len(self._devices)
@@ -0,0 +1,3 @@
+from .DeviceStore import DeviceStore, DeviceRecord
+
+__ALL__ = ['DeviceStore', 'DeviceRecord']
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Language of Things framing Class
+    Chunked framing helper for the Message Bridge serial thread
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+from time import monotonic
+
+class LLAPFramer():
+    """ Turn chunks of raw serial bytes into complete 12 byte Language of Things messages
+
+        Bytes are fed in as they are read from the port, a partial message is
+        kept between calls so a message can span several reads.
+        Framing rules are the same as the old byte at a time reader
+            an 'a' always (re)starts a message
+            bytes 1-2 must be in validID, bytes 3-11 must be in validData
+            any other byte discards the current message
+    """
+
+    frameLength = 12
+    _start = ord('a')
+
+    def __init__(self, validID, validData):
+        # lookup tables, one for the per byte state machine and a delete
+        # string for bytes.translate to check a whole message in one go
+        self._idTable = bytearray(256)
+        self._dataTable = bytearray(256)
+        for char in validID:
+            self._idTable[ord(char)] = 1
+        for char in validData:
+            self._dataTable[ord(char)] = 1
+        self._idBytes = validID.encode('ascii')
+        self._dataBytes = validData.encode('ascii')
+
+        self._frame = bytearray(self.frameLength)
+        self._count = 0
+        self._lastByteTime = 0
+
+        self.frames = 0
+        self.rejected = 0
+
+    def reset(self):
+        """ Drop any partial message
+        """
+        self._count = 0
+
+    def pending(self):
+        """ True if part of a message is waiting for more bytes
+        """
+        return self._count != 0
+
+    def expire(self, timeout):
+        """ Drop a partial message if no byte has arrived for timeout seconds
+            Returns True if a message was dropped
+        """
+        if self._count and (monotonic() - self._lastByteTime) > timeout:
+            self._count = 0
+            self.rejected += 1
+            return True
+        return False
+
+    def feed(self, data):
+        """ Process a chunk of bytes
+            Returns a list of complete messages as str
+        """
+        frames = []
+        data = bytes(data)
+        length = len(data)
+        index = 0
+        if length:
+            self._lastByteTime = monotonic()
+
+        while index < length:
+            if not self._count:
+                # hunting for the start of a message
+                start = data.find(b'a', index)
+                if start < 0:
+                    break
+                end = start + self.frameLength
+                # fast path, whole message is in this chunk and valid
+                if (end <= length and
+                    not data[start+1:start+3].translate(None, self._idBytes) and
+                    not data[start+3:end].translate(None, self._dataBytes)):
+                    frames.append(data[start:end].decode('ascii'))
+                    index = end
+                    continue
+                self._frame[0] = self._start
+                self._count = 1
+                index = start + 1
+                continue
+
+            # slow path, part way through a message
+            byte = data[index]
+            index += 1
+            if byte == self._start:
+                # start again
+                self._count = 1
+            elif (self._idTable[byte] if self._count < 3 else self._dataTable[byte]):
+                self._frame[self._count] = byte
+                self._count += 1
+                if self._count == self.frameLength:
+                    frames.append(self._frame.decode('ascii'))
+                    self._count = 0
+            else:
+                # invalid character, drop the message
+                self._count = 0
+                self.rejected += 1
+
+        self.frames += len(frames)
+        return frames
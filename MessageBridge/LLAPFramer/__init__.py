@@ -0,0 +1,3 @@
+from .LLAPFramer import LLAPFramer
+
+__ALL__ = ['LLAPFramer']
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Mailbox Class
+    Holds Language of Things messages for sleeping devices until they wake
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+from collections import deque
+from time import time
+import json
+import os
+import threading
+
+class Mailbox():
+    """ One queue of waiting messages per device ID
+
+        Each entry is a dict
+            send     the message payload to send
+            on       list of payloads from the device that let it go
+            expires  time() after which it is thrown away, None for never
+            ref      optional, passed back in the status so a client can match it up
+
+        add() takes a chain of messages as sent with a sendOn, the first goes
+        when the device sends one of the sendOn payloads ("WAKE" stands for
+        any of wakeTriggers), each one after that when the device echoes the
+        one before or wakes up again. A device in CONFIGME sends as ?? so
+        CONFIGME can never let a message go.
+
+        Only the oldest entry for a device can go so checking a received
+        message is a dict lookup and a set test however much is waiting.
+
+        Thread safe, messages are added by the UDP and MQTT threads, taken by
+        the serial thread and expired and saved by the main thread.
+    """
+
+    Wake = "WAKE"
+
+    def __init__(self, maxDepth=10, ttl=86400, wakeTriggers=("AWAKE", "STARTED")):
+        self.maxDepth = max(1, maxDepth)
+        self.ttl = ttl
+        self.wakeTriggers = list(wakeTriggers)
+        self.changed = False
+        self._boxes = {}            # id: deque of entries, oldest first
+        self._nextExpiry = None     # soonest expires of any entry
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(box) for box in list(self._boxes.values()))
+
+    def add(self, _id, commands, on, ttl=None, ref=None, now=None):
+        """ Queue a chain of commands for device _id
+            Returns the list of entries added, empty if the device's mailbox
+            did not have room for all of them
+        """
+        if now is None:
+            now = time()
+        if ttl is None:
+            ttl = self.ttl
+        if isinstance(on, str):
+            on = [on]
+        triggers = []
+        for trigger in on:
+            if trigger == self.Wake:
+                triggers.extend(self.wakeTriggers)
+            else:
+                triggers.append(trigger)
+        expires = now + ttl if ttl > 0 else None
+
+        entries = []
+        on = triggers
+        for command in commands:
+            entry = {'send': command, 'on': on, 'expires': expires}
+            if ref is not None:
+                entry['ref'] = ref
+            entries.append(entry)
+            # the next one goes on the echo of this one
+            on = triggers + [command] if command not in triggers else triggers
+
+        with self._lock:
+            box = self._boxes.get(_id)
+            if box is None:
+                box = self._boxes[_id] = deque()
+            if len(box) + len(entries) > self.maxDepth:
+                if not box:
+                    del self._boxes[_id]
+                return []
+            for entry in entries:
+                entry['_on'] = set(entry['on'])
+                box.append(entry)
+            if expires is not None and (self._nextExpiry is None or expires < self._nextExpiry):
+                self._nextExpiry = expires
+            self.changed = True
+        return entries
+
+    def match(self, _id, payload, now=None):
+        """ Check a message received from device _id
+            Returns (entry to send or None, list of entries that expired)
+            the entry stays in the mailbox until taken()
+        """
+        if _id not in self._boxes:
+            return (None, [])
+        if now is None:
+            now = time()
+        expired = []
+        with self._lock:
+            # look again with the lock held, expire() may have dropped the
+            # box and add() made a new one since the check above
+            box = self._boxes.get(_id)
+            if not box:
+                return (None, [])
+            while box and box[0]['expires'] is not None and box[0]['expires'] <= now:
+                expired.append(box.popleft())
+                self.changed = True
+            if not box:
+                del self._boxes[_id]
+                return (None, expired)
+            if payload in box[0]['_on']:
+                return (box[0], expired)
+        return (None, expired)
+
+    def taken(self, _id, entry):
+        """ Remove an entry match() returned once it has been sent
+        """
+        with self._lock:
+            box = self._boxes.get(_id)
+            if box and box[0] is entry:
+                box.popleft()
+                if not box:
+                    del self._boxes[_id]
+                self.changed = True
+
+    def expire(self, now=None):
+        """ Throw away every entry past its expiry
+            Returns a list of (id, entry) that expired
+        """
+        if now is None:
+            now = time()
+        if self._nextExpiry is None or now < self._nextExpiry:
+            return []
+        expired = []
+        with self._lock:
+            self._nextExpiry = None
+            for _id in list(self._boxes):
+                box = self._boxes[_id]
+                for entry in list(box):
+                    if entry['expires'] is None:
+                        continue
+                    if entry['expires'] <= now:
+                        box.remove(entry)
+                        expired.append((_id, entry))
+                    elif self._nextExpiry is None or entry['expires'] < self._nextExpiry:
+                        self._nextExpiry = entry['expires']
+                if not box:
+                    del self._boxes[_id]
+            if expired:
+                self.changed = True
+        return expired
+
+    def report(self):
+        """ The waiting entries as a dict of device ID to list, suitable for JSON
+        """
+        with self._lock:
+            return {_id: [self._public(entry) for entry in box]
+                    for (_id, box) in self._boxes.items()}
+
+    def _public(self, entry):
+        return {key: value for (key, value) in entry.items() if not key.startswith('_')}
+
+    def save(self, path):
+        """ Write the mailbox to path, via a temporary file so a crash part way
+            through never leaves a broken file
+        """
+        with self._lock:
+            snapshot = {'devices': {_id: [self._public(entry) for entry in box]
+                                    for (_id, box) in self._boxes.items()}
+                        }
+            self.changed = False
+        temp = path + ".tmp"
+        with open(temp, 'w') as mailboxFile:
+            json.dump(snapshot, mailboxFile)
+        os.replace(temp, path)
+
+    def load(self, path):
+        """ Read a file written by save(), returns the number of entries loaded
+        """
+        with open(path, 'r') as mailboxFile:
+            snapshot = json.load(mailboxFile)
+        with self._lock:
+            self._boxes = {}
+            self._nextExpiry = None
+            count = 0
+            for (_id, entries) in snapshot.get('devices', {}).items():
+                box = deque()
+                for entry in entries:
+                    if 'send' not in entry or 'on' not in entry:
+                        continue
+                    entry.setdefault('expires', None)
+                    entry['_on'] = set(entry['on'])
+                    box.append(entry)
+                    if entry['expires'] is not None and (self._nextExpiry is None or entry['expires'] < self._nextExpiry):
+                        self._nextExpiry = entry['expires']
+                if box:
+                    self._boxes[_id] = box
+                    count += len(box)
+            self.changed = False
+            return count
@@ -0,0 +1,3 @@
+from .Mailbox import Mailbox
+
+__ALL__ = ['Mailbox']
@@ -21,26 +21,48 @@
 
 """
 import sys
-from time import time, sleep, gmtime, strftime
+from time import time, sleep, gmtime, strftime, monotonic
 import os
 import signal
 import errno
+import stat
 import queue
 import argparse
 import configparser
 import serial
 import threading
+import asyncio
 import socket
 import select
+import struct
+import heapq
+from collections import deque
 import json
 import logging
 import LogHandler
 import AT
+import LLAPFramer
+import WirelessMessage
+import WirelessBinary
+import BoundedQueue
+import Metrics
+import DCRRequest
+import DCRCache
+import DeviceStore
+import SubscriberRegistry
+import StreamClient
+import SharedRing
+import TXScheduler
+import Deduplicator
+import Mailbox
+import http.server
 import re
 import paho.mqtt.client as mqtt
 if sys.platform == 'win32':
     pass
 else:
+    import fcntl
+    import grp
     from daemon import DaemonContext, pidlockfile
     import lockfile
 
@@ -98,19 +120,21 @@ class MessageBridge():
     _SerialFailCount = 0
     _SerialFailCountLimit = 3
     _serialTimeout = 1     # serial port time out setting
+    _serialReadSize = 4096  # most bytes to drain from the serial port in one read
     _UDPListenTimeout = 5   # timeout for UDP listen
+    _UDPListenBufferSize = 65536    # largest datagram the UDP listener will read
+    _UDPListenBatchMax = 256    # most datagrams the UDP listener reads per wakeup
+    _serialSelectTimeout = 5    # longest the serial thread will block waiting for the port or a wakeup
+    _asyncDrainMax = 256    # most messages an event loop callback takes off a queue before letting others run
+    _MQTTRetryTime = 5      # seconds between MQTT connection attempts in the asyncio runtime
     _ATLHRetriesCount = 3
 
     _version = 0.18
 
-    _sendOnIDs = []
-    _sendOnRequests = {}
+    _mailbox = None
+    _dcrCache = None            # last known DCR replies per device when [DCR] cache_enabled
+    _mailboxPersist = False
 
-    _currentDCR = False
-    devType = None
-    _SerialDTYSync = False
-    _DCRStartTime = 0
-    _DCRCurrentTimeout = 0
 
     _panID = 0
     _encryption = False
@@ -119,12 +143,25 @@ class MessageBridge():
     _validID = "ABCDEFGHIJKLMNOPQRSTUVWXYZ-#@?\\*"
     _validData = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 !\"#$%&'()*+,-.:;<=>?@[\\\/]^_`{|}~"
     _encryptionCommandMatch = re.compile('^EN[1-6]')
+    _DCRActionCommands = ("CYCLE", "SLEEP", "REBOOT", "LLAPRESET")     # change the device without a value, never cached
 
     _state = ""
     Running = "Running"
     Error = "Error"
 
-    _deviceStore = {}
+    _deviceStore = None
+    _deviceStoreSaved = 0
+    _deviceStoreSnapshot = False
+    _mqttEnabled = False
+    _binaryEnabled = False
+    _multicastGroup = None      # [UDP] multicast_group when multicast is on
+    _streamEnabled = False
+    _sharedRingEnabled = False
+    _sharedRing = None
+    _unixSendSocket = None      # unbound AF_UNIX datagram socket used to send to unix subscribers
+    _streamClients = set()
+    _runtime = "threads"
+    _asyncLoop = None           # event loop when [Run] runtime is asyncio
 
     _ActionHelp = """
 start = Starts as a background daemon/service
@@ -153,6 +190,10 @@ is running then run in the current terminal
                               }
 
         self.tMainStop = threading.Event()
+        self._queues = {}
+        self.metrics = Metrics.Metrics()
+        self._mThreadRestarts = {}
+        self._metricsServer = None
         self.qMessageBridge = queue.Queue()
         self.qSendOn = queue.Queue()
         # setup initial Logging
@@ -360,6 +401,28 @@ is running then run in the current terminal
             self._network = self.config.get('Serial', 'network')
 
             self._initLogging()         # setup the logging options
+            self._mqttEnabled = self.config.getboolean('MQTT', 'enabled')
+            self._binaryEnabled = self.config.getboolean('Binary', 'enabled', fallback=False)
+            self._sharedRingEnabled = self.config.getboolean('SharedRing', 'enabled', fallback=False)
+            self._streamEnabled = (self.config.getboolean('Stream', 'enabled', fallback=False) or
+                                   bool(self.config.get('Unix', 'stream_path', fallback="")))
+            if self.config.getboolean('UDP', 'multicast', fallback=False):
+                self._multicastGroup = self.config.get('UDP', 'multicast_group', fallback="239.255.50.140")
+            self._runtime = self.config.get('Run', 'runtime', fallback="threads")
+            if self._runtime not in ("threads", "asyncio"):
+                self.logger.error("Unknown runtime {}, using threads".format(self._runtime))
+                self._runtime = "threads"
+            elif self._runtime == "asyncio" and sys.platform == 'win32':
+                # no add_reader() for a serial port on windows
+                self.logger.error("The asyncio runtime is not supported on windows, using threads")
+                self._runtime = "threads"
+            self._initMetrics()         # setup the pipeline metrics
+            self._initDeviceStore()     # setup and reload the device store
+            self._initMailbox()         # setup and reload the mailbox for sleeping devices
+            if self._runtime == "asyncio":
+                self._runAsyncio()
+                self.logger.debug("Exiting")
+                return
             self.tMainStop.wait(1)
             self._initSerialThread()    # start the serial port thread
             self.tMainStop.wait(1)
@@ -368,6 +431,12 @@ is running then run in the current terminal
             self._initUDPListenThread() # start the UDP listener
             if self.config.getboolean('MQTT', 'enabled'):
                 self._initMQTTThread()      # start the MQTT client
+            if self._binaryEnabled:
+                self._initBinaryThreads()   # start the binary wire format sender and listener
+            if self._streamEnabled:
+                self._initStreamThread()    # start the TCP, WebSocket and unix stream endpoint
+            if self._sharedRingEnabled:
+                self._initSharedRingThread()    # start the shared memory ring writer
 
             self._state = self.Running
             # main thread looks after the Message Bridge status for us
@@ -377,6 +446,7 @@ is running then run in the current terminal
                     self.logger.error("tMain: DCR thread stopped")
                     self._state = self.Error
                     self.tMainStop.wait(1)
+                    self._countThreadRestart('tDCR')
                     self._startDCR()
                     self.tMainStop.wait(1)
                     if self.tDCR.is_alive():
@@ -386,6 +456,7 @@ is running then run in the current terminal
                     self.logger.error("tMain: UDPSend thread stopped")
                     self._state = self.Error
                     self.tMainStop.wait(1)
+                    self._countThreadRestart('tUDPSend')
                     self._startUDPSend()
                     self.tMainStop.wait(1)
                     if self.tUDPSend.is_alive():
@@ -395,6 +466,7 @@ is running then run in the current terminal
                     self.logger.error("tMain: Serial thread stopped, wait 1 before trying to re-establish ")
                     self._state = self.Error
                     self.tMainStop.wait(1)
+                    self._countThreadRestart('tSerial')
                     self._startSerial()
                     self.tMainStop.wait(1)
                     if self.tSerial.is_alive():
@@ -409,6 +481,7 @@ is running then run in the current terminal
                     self.logger.error("tMain: UDPListen thread stopped")
                     self._state = self.Error
                     self.tMainStop.wait(1)
+                    self._countThreadRestart('tUDPListen')
                     self._startUDPListen()
                     self.tMainStop.wait(1)
                     if self.tUDPListen.is_alive():
@@ -418,40 +491,15 @@ is running then run in the current terminal
                     self.logger.error("tMain: MQTT thread stopped")
                     self._state = self.Error
                     self.tMainStop.wait(1)
+                    self._countThreadRestart('tMQTT')
                     self._startMQTT()
                     self.tMainStop.wait(1)
                     if self.tMQTT.is_alive():
                         self._state = self.Running
 
-                #check if the serial have done the encryption on the radio
-                if self.fRadioEncryptionDone.is_set():
-                    self.fRadioEncryptionDone.clear()
-                    self.logger.debug("tMain: Processing Reply Encryption message")
-                    if not self.qReplyEncryption.empty():
-                        try:
-                            message = self.qReplyEncryption.get_nowait()
-                        except queue.Empty():
-                            pass
-                        else:
-                            message['timestamp'] = strftime("%d %b %Y %H:%M:%S +0000", gmtime())
-                            message['data']['result'] = self._setRadioEncryption
-                            try:
-                                self.qUDPSend.put(json.dumps(message))
-                            except queue.Full:
-                                self.logger.debug("tMain: Failed to put {} on qUDPSend as it's full".format(message))
-                            else:
-                                self.logger.debug("tMain: Put {} on qUDPSend".format(message))
-                        self.qReplyEncryption.task_done()
+                self._MainCheckOutputThreads()
 
-                # process any "MessageBridge" messages
-                if not self.qMessageBridge.empty():
-                    self.logger.debug("tMain: Processing MessageBridge JSON message")
-                    try:
-                        jsonMessage = self.qMessageBridge.get_nowait()
-                    except queue.Empty():
-                        pass
-                    else:
-                        self._processMessageBridgeMessage(jsonMessage)
+                self._MainHousekeeping()
 
                 # flash led's if GPIO debug
                 self.tMainStop.wait(0.5)
@@ -462,6 +510,401 @@ is running then run in the current terminal
 
         self.logger.debug("Exiting")
 
+    def _MainCheckOutputThreads(self):
+        """ Restart any of the optional output threads that have stopped
+        """
+        if self._binaryEnabled and not self.tBinarySend.is_alive():
+            self.logger.error("tMain: BinarySend thread stopped")
+            self._state = self.Error
+            self.tMainStop.wait(1)
+            self._countThreadRestart('tBinarySend')
+            self._startBinarySend()
+            self.tMainStop.wait(1)
+            if self.tBinarySend.is_alive():
+                self._state = self.Running
+
+        if self._binaryEnabled and not self.tBinaryListen.is_alive():
+            self.logger.error("tMain: BinaryListen thread stopped")
+            self._state = self.Error
+            self.tMainStop.wait(1)
+            self._countThreadRestart('tBinaryListen')
+            self._startBinaryListen()
+            self.tMainStop.wait(1)
+            if self.tBinaryListen.is_alive():
+                self._state = self.Running
+
+        if self._sharedRingEnabled and not self.tSharedRing.is_alive():
+            self.logger.error("tMain: SharedRing thread stopped")
+            self._state = self.Error
+            self.tMainStop.wait(1)
+            self._countThreadRestart('tSharedRing')
+            self._startSharedRing()
+            self.tMainStop.wait(1)
+            if self.tSharedRing.is_alive():
+                self._state = self.Running
+
+        if self._streamEnabled and not self.tStream.is_alive():
+            self.logger.error("tMain: Stream thread stopped")
+            self._state = self.Error
+            self.tMainStop.wait(1)
+            self._countThreadRestart('tStream')
+            self._startStream()
+            self.tMainStop.wait(1)
+            if self.tStream.is_alive():
+                self._state = self.Running
+
+    def _MainHousekeeping(self):
+        """ Work the main thread does every time round, reply to a radio
+            encryption change, answer MessageBridge requests and save the
+            device store
+        """
+        #check if the serial have done the encryption on the radio
+        if self.fRadioEncryptionDone.is_set():
+            self.fRadioEncryptionDone.clear()
+            self.logger.debug("tMain: Processing Reply Encryption message")
+            if not self.qReplyEncryption.empty():
+                try:
+                    message = self.qReplyEncryption.get_nowait()
+                except queue.Empty():
+                    pass
+                else:
+                    message['timestamp'] = strftime("%d %b %Y %H:%M:%S +0000", gmtime())
+                    message['data']['result'] = self._setRadioEncryption
+                    try:
+                        self.qUDPSend.put(json.dumps(message))
+                    except queue.Full:
+                        self.logger.debug("tMain: Failed to put {} on qUDPSend as it's full".format(message))
+                    else:
+                        self.logger.debug("tMain: Put {} on qUDPSend".format(message))
+                self.qReplyEncryption.task_done()
+
+        # process any "MessageBridge" messages
+        while not self.qMessageBridge.empty():
+            self.logger.debug("tMain: Processing MessageBridge JSON message")
+            try:
+                jsonMessage = self.qMessageBridge.get_nowait()
+            except queue.Empty:
+                break
+            else:
+                self._processMessageBridgeMessage(jsonMessage)
+
+        # throw away mailbox messages nobody woke up for and save any change
+        for (_id, entry) in self._mailbox.expire():
+            self._mailboxStatus(_id, entry, "Expired")
+        if self._mailboxPersist and self._mailbox.changed:
+            self._saveMailbox()
+
+        # save the device store every so often
+        if (self._deviceStoreSnapshot and self._deviceStore.changed and
+            monotonic() - self._deviceStoreSaved > self._deviceStoreInterval):
+            self._saveDeviceStore()
+
+    def _countThreadRestart(self, name):
+        """ Count a thread being restarted by the main thread
+        """
+        if name not in self._mThreadRestarts:
+            self._mThreadRestarts[name] = self.metrics.counter('thread_restarts', "Threads restarted after they stopped", ('thread', name))
+        self._mThreadRestarts[name].inc()
+
+    def _runAsyncio(self):
+        """ Run the serial port, UDP, DCR and MQTT on one asyncio event loop
+            in the main thread rather than a thread each, [Run] runtime = asyncio
+
+            The same internal queues are used but a put schedules the code
+            that takes from the queue on the loop instead of waking a thread,
+            so nothing polls. Timeouts (DCR, batch windows and partial serial
+            messages) are loop timers. The Binary, Stream and SharedRing
+            outputs, the metrics HTTP server and radio encryption changes,
+            which talk AT to the radio and block for seconds, still get a
+            thread each.
+        """
+        self.logger.info("Running on an asyncio event loop")
+        self._asyncLoop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._asyncLoop)
+        self._asyncLoop.set_exception_handler(self._AsyncException)
+        self._asyncThread = threading.get_ident()
+        self._asyncScheduled = set()
+        self._asyncTimers = {}
+        try:
+            self._AsyncInitSerial()
+            self._AsyncInitDCR()
+            self._AsyncInitUDPSend()
+            self._AsyncInitUDPListen()
+            if self._mqttEnabled:
+                self._AsyncInitMQTT()
+            if self._binaryEnabled:
+                self._initBinaryThreads()   # start the binary wire format sender and listener
+            if self._streamEnabled:
+                self._initStreamThread()    # start the TCP, WebSocket and unix stream endpoint
+            if self._sharedRingEnabled:
+                self._initSharedRingThread()    # start the shared memory ring writer
+
+            self._state = self.Running
+            self._asyncLoop.call_soon(self._AsyncMain)
+            self._asyncLoop.run_forever()
+        finally:
+            self._AsyncClose()
+
+    def _AsyncMain(self):
+        """ What the main thread loop does, run every half a second
+        """
+        if self.tMainStop.is_set():
+            self._asyncLoop.stop()
+            return
+        self._MainCheckOutputThreads()
+        self._MainHousekeeping()
+        if self._mqttEnabled:
+            self._mqttClient.loop_misc()
+        self._asyncLoop.call_later(0.5, self._AsyncMain)
+
+    def _AsyncSchedule(self, callback):
+        """ Run callback on the event loop soon, once however many times it
+            is asked for before it runs, safe to call from any thread
+        """
+        if callback in self._asyncScheduled:
+            return
+        self._asyncScheduled.add(callback)
+        try:
+            if threading.get_ident() == self._asyncThread:
+                self._asyncLoop.call_soon(self._AsyncRun, callback)
+            else:
+                self._asyncLoop.call_soon_threadsafe(self._AsyncRun, callback)
+        except RuntimeError:
+            # loop has been closed while shutting down
+            pass
+
+    def _AsyncRun(self, callback):
+        self._asyncScheduled.discard(callback)
+        callback()
+
+    def _AsyncTimer(self, name, delay, callback):
+        """ Call callback after delay seconds replacing the timer of the same
+            name, a delay of None just cancels it
+        """
+        timer = self._asyncTimers.pop(name, None)
+        if timer is not None:
+            timer.cancel()
+        if delay is not None:
+            self._asyncTimers[name] = self._asyncLoop.call_later(delay, self._AsyncTimerFired, name, callback)
+
+    def _AsyncTimerFired(self, name, callback):
+        self._asyncTimers.pop(name, None)
+        callback()
+
+    def _AsyncException(self, loop, context):
+        """ An exception escaped a callback, log it and carry on as the
+            main thread would restart a thread that had died
+        """
+        self.logger.error("tMain: {}".format(context.get('message')), exc_info=context.get('exception'))
+        self._countThreadRestart('asyncio')
+
+    def _AsyncInitSerial(self):
+        self.logger.info("Serial port init")
+        self._initSerial()
+        self._serialWakeupPipe = None
+        # the AT helper waits on this while it talks to the radio
+        self.tSerialStop = threading.Event()
+        self._SerialDCRPending = []     # requests waiting for a CONFIGME device
+        self._SerialDCRActive = None    # request being asked of the current CONFIGME device
+        self._SerialDTYWait = False     # waiting on a DTY reply to pick or confirm a request
+        self._asyncSerialBusy = False   # radio is in AT mode for an encryption change
+        self._AsyncSerialOpen()
+
+    def _AsyncSerialOpen(self):
+        self._SerialOpen()
+        self._asyncLoop.add_reader(self._serial.fileno(), self._AsyncSerialRead)
+        self._AsyncSchedule(self._AsyncSerialWork)
+
+    def _AsyncSerialClose(self):
+        if self._serial.isOpen():
+            self._asyncLoop.remove_reader(self._serial.fileno())
+            self._serial.close()
+        self._AsyncTimer('serialExpire', None, None)
+
+    def _AsyncSerialRead(self):
+        """ The serial port has data
+        """
+        try:
+            self._SerialReadIncomingLanguageOfThings()
+        except IOError:
+            # the port has gone, reopen it as the main thread would restart tSerial
+            self.logger.exception("tSerial: IOError on serial port")
+            self._AsyncSerialClose()
+            self._countThreadRestart('tSerial')
+            self._AsyncTimer('serialOpen', 1, self._AsyncSerialOpen)
+            return
+        if self._framer.pending() and 'serialExpire' not in self._asyncTimers:
+            self._AsyncTimer('serialExpire', self._serialTimeout, self._AsyncSerialExpire)
+
+    def _AsyncSerialExpire(self):
+        """ A partial message that has stopped arriving is dropped as the old reader timed out on it
+        """
+        if self._framer.expire(self._serialTimeout):
+            self._mSerialRxRejects.inc()
+            self.logger.debug("tSerial: Dropped partial message after timeout")
+        elif self._framer.pending():
+            self._AsyncTimer('serialExpire', self._serialTimeout, self._AsyncSerialExpire)
+
+    def _AsyncSerialWork(self):
+        """ Send what is waiting on qSerialOut or start a radio encryption change
+        """
+        if self._asyncSerialBusy or not self._serial.isOpen():
+            # picked up once the port is back
+            return
+        if self.fSetRadioEncryption.is_set():
+            self.logger.debug("tSerial: fSetRadioEncryption set")
+            self.fRadioEncryptionDone.clear()
+            self._asyncSerialBusy = True
+            self._asyncLoop.remove_reader(self._serial.fileno())
+            done = self._asyncLoop.run_in_executor(None, self.SetRadioEncryption)
+            done.add_done_callback(self._AsyncSerialEncryptionDone)
+            return
+        self._SerialUpdateDCRPending()
+        self._SerialSendQueued()
+
+    def _AsyncSerialEncryptionDone(self, done):
+        if not done.cancelled() and done.exception() is not None:
+            self.logger.error("tSerial: SetRadioEncryption failed", exc_info=done.exception())
+        self._framer.reset()
+        self._asyncSerialBusy = False
+        self.fRadioEncryptionDone.set() #informs the main loop that has some encryption result to send
+        if self._serial.isOpen():
+            self._asyncLoop.add_reader(self._serial.fileno(), self._AsyncSerialRead)
+        self._AsyncSchedule(self._AsyncSerialWork)
+        self._AsyncSchedule(self._MainHousekeeping)
+
+    def _AsyncInitDCR(self):
+        self.logger.info("DCR init")
+        self._initDCR(lambda: self._AsyncSchedule(self._AsyncDCR))
+        self.tDCRStop = threading.Event()
+
+    def _AsyncDCR(self):
+        """ New requests, replies from the serial port or a timeout is due
+        """
+        self._DCRProcessQueues()
+        self._AsyncTimer('dcr', self._DCRCheckTimeouts(), self._AsyncDCR)
+
+    def _AsyncInitUDPSend(self):
+        self.logger.info("UDP Send init")
+        self._initUDPSend(lambda: self._AsyncSchedule(self._AsyncUDPSend))
+        self._asyncUDPSendSocket = self._UDPOpenSendSocket()
+        self._asyncUDPSendSocket.setblocking(0)
+        self._asyncUDPSendPort = int(self.config.get('UDP', 'send_port'))
+        self._asyncUDPBatch = self._UDPMakeBatch()
+
+    def _AsyncUDPSend(self):
+        """ Send what is waiting on qUDPSend and any batch that is due
+        """
+        batch = self._asyncUDPBatch
+        for count in range(self._asyncDrainMax):
+            try:
+                message = self.qUDPSend.get_nowait()
+            except queue.Empty:
+                break
+            self._UDPSendQueued(self._asyncUDPSendSocket, batch, message, self._asyncUDPSendPort)
+            self.qUDPSend.task_done()
+        else:
+            # let everything else have a go before carrying on
+            self._AsyncSchedule(self._AsyncUDPSend)
+        if batch.due():
+            self._UDPSendBatch(self._asyncUDPSendSocket, batch.take(), self._asyncUDPSendPort)
+        self._AsyncTimer('udpBatch', batch.timeout(0) if batch else None, self._AsyncUDPSend)
+
+    def _AsyncInitUDPListen(self):
+        self.logger.info("UDP Listen init")
+        self._asyncListenSockets = self._UDPOpenListenSockets()
+        self._asyncListenBuffer = bytearray(self._UDPListenBufferSize)
+        for (sock, counter) in self._asyncListenSockets.items():
+            self._asyncLoop.add_reader(sock, self._AsyncUDPRead, sock, counter)
+        self.logger.info("tUDPListen: listening")
+
+    def _AsyncUDPRead(self, sock, counter):
+        self._UDPListenRead(sock, self._asyncListenBuffer, counter)
+        if not self.qMessageBridge.empty():
+            self._AsyncSchedule(self._MainHousekeeping)
+
+    def _AsyncInitMQTT(self):
+        """ Drive the paho client from the event loop through its socket
+            callbacks instead of loop_start()
+        """
+        self.logger.info("MQTT init")
+        self.qMQTTSend = self._makeQueue('mqtt_send', lambda: self._AsyncSchedule(self._AsyncMQTTSend))
+        self._asyncMQTTTopic = "{}/listen".format(self.config.get('MQTT', 'base_topic').rstrip('/'))
+        self._asyncMQTTBatch = WirelessMessage.WirelessMessageBatch(self.config.getfloat('MQTT', 'batch_window', fallback=0),
+                                                                    self.config.getint('MQTT', 'batch_size', fallback=100))
+
+        self._mqttClient = mqtt.Client()
+        self._mqttClient.on_connect = self._MQTT_on_connect
+        self._mqttClient.on_message = self._MQTT_on_message
+        self._mqttClient.on_disconnect = self._AsyncMQTTDisconnect
+        self._mqttClient.on_socket_open = lambda client, userdata, sock: self._asyncLoop.add_reader(sock, client.loop_read)
+        self._mqttClient.on_socket_close = lambda client, userdata, sock: self._asyncLoop.remove_reader(sock)
+        self._mqttClient.on_socket_register_write = lambda client, userdata, sock: self._asyncLoop.add_writer(sock, client.loop_write)
+        self._mqttClient.on_socket_unregister_write = lambda client, userdata, sock: self._asyncLoop.remove_writer(sock)
+        self._AsyncMQTTConnect()
+
+    def _AsyncMQTTConnect(self):
+        try:
+            self._mqttClient.connect(self.config.get('MQTT', 'host'), self.config.getint('MQTT', 'port'), 60)
+        except (socket.error, OSError) as error:
+            self.logger.error("tMQTT: Failed to connect, retrying in {} seconds: {}".format(self._MQTTRetryTime, error))
+            self._AsyncTimer('mqttConnect', self._MQTTRetryTime, self._AsyncMQTTConnect)
+
+    def _AsyncMQTTDisconnect(self, client, userdata, rc):
+        if rc != 0 and not self.tMainStop.is_set():
+            self.logger.warn("tMQTT: Lost connection, reconnecting in {} seconds".format(self._MQTTRetryTime))
+            self._AsyncTimer('mqttConnect', self._MQTTRetryTime, self._AsyncMQTTConnect)
+
+    def _AsyncMQTTSend(self):
+        """ Publish what is waiting on qMQTTSend and any batch that is due
+        """
+        batch = self._asyncMQTTBatch
+        for count in range(self._asyncDrainMax):
+            try:
+                message = self.qMQTTSend.get_nowait()
+            except queue.Empty:
+                break
+            self._MQTTPublishQueued(self._asyncMQTTTopic, batch, message)
+            self.qMQTTSend.task_done()
+        else:
+            self._AsyncSchedule(self._AsyncMQTTSend)
+        if batch.due():
+            self._MQTTPublishBatch(self._asyncMQTTTopic, batch.take())
+        self._AsyncTimer('mqttBatch', batch.timeout(0) if batch else None, self._AsyncMQTTSend)
+
+    def _AsyncClose(self):
+        """ Send what is left and close everything the event loop looked after
+        """
+        self.logger.info("Stopping the asyncio event loop")
+        for timer in list(self._asyncTimers.values()):
+            timer.cancel()
+        self._asyncTimers = {}
+        try:
+            if getattr(self, '_asyncUDPSendSocket', None) is not None:
+                if self._asyncUDPBatch:
+                    self._UDPSendBatch(self._asyncUDPSendSocket, self._asyncUDPBatch.take(), self._asyncUDPSendPort)
+                self._UDPCloseSendSocket(self._asyncUDPSendSocket)
+                self._asyncUDPSendSocket = None
+            if getattr(self, '_asyncListenSockets', None):
+                for sock in self._asyncListenSockets:
+                    self._asyncLoop.remove_reader(sock)
+                self._UDPCloseListenSockets(self._asyncListenSockets)
+                self._asyncListenSockets = None
+            if self._mqttEnabled and getattr(self, '_mqttClient', None) is not None:
+                if self._asyncMQTTBatch:
+                    self._MQTTPublishBatch(self._asyncMQTTTopic, self._asyncMQTTBatch.take())
+                # write the disconnect straight out rather than via the loop
+                self._mqttClient.on_socket_register_write = None
+                self._mqttClient.disconnect()
+            if getattr(self, '_serial', None) is not None:
+                self.logger.info("tSerial: Closing serial port")
+                self._AsyncSerialClose()
+        except Exception:
+            self.logger.exception("Failed to close down cleanly")
+        loop = self._asyncLoop
+        self._asyncLoop = None
+        loop.close()
+
     def _readConfig(self):
         """Read the Message Bridge config file from disk
         """
@@ -562,25 +1005,203 @@ is running then run in the current terminal
             self.logger.addHandler(self._fh)
             self.logger.info("File Logging started")
 
+    def _initMetrics(self):
+        """ Create the pipeline counters and histograms and if enabled start
+            serving them as Prometheus text over HTTP
+        """
+        self.logger.info("Metrics init")
+        self._mSerialRxFrames = self.metrics.counter('serial_rx_frames', "Language of Things messages received from the radio")
+        self._mSerialRxBytes = self.metrics.counter('serial_rx_bytes', "Bytes read from the serial port")
+        self._mSerialRxRejects = self.metrics.counter('serial_rx_rejects', "Partial or invalid messages dropped by the serial framer")
+        self._mSerialRxDuplicates = self.metrics.counter('serial_rx_duplicates', "Repeated Language of Things messages dropped by the deduplicator")
+        self._mSerialTxFrames = self.metrics.counter('serial_tx_frames', "Language of Things messages written to the radio")
+        self._mUDPTx = self.metrics.counter('udp_tx_messages', "JSON messages sent via UDP")
+        self._mUDPTxErrors = self.metrics.counter('udp_tx_errors', "JSON messages that failed to send via UDP")
+        self._mUDPRx = self.metrics.counter('udp_rx_datagrams', "Datagrams received by the UDP listener")
+        self._mUDPRxInvalid = self.metrics.counter('udp_rx_invalid', "Datagrams received by the UDP listener that were not valid JSON")
+        self._mUnixRx = self.metrics.counter('unix_rx_datagrams', "Datagrams received on the unix datagram socket")
+        self._mBinaryTx = self.metrics.counter('binary_tx_datagrams', "Binary wire format datagrams sent")
+        self._mBinaryTxRecords = self.metrics.counter('binary_tx_records', "Binary wire format records sent")
+        self._mBinaryRx = self.metrics.counter('binary_rx_datagrams', "Datagrams received by the binary listener")
+        self._mBinaryRxInvalid = self.metrics.counter('binary_rx_invalid', "Datagrams received by the binary listener that were not valid")
+        self._mMQTTPublish = self.metrics.counter('mqtt_published', "JSON messages published via MQTT")
+        self._mUDPTxBatched = self.metrics.counter('udp_tx_batched', "WirelessMessages sent via UDP inside a WirelessMessageBatch")
+        self._mUDPTxUnicast = self.metrics.counter('udp_tx_unicast', "Datagrams unicast via UDP to subscribers")
+        self._mSharedRingRecords = self.metrics.counter('shared_ring_records', "Messages written to the shared memory ring")
+        self._mStreamTx = self.metrics.counter('stream_tx_messages', "JSON messages sent to stream clients")
+        self._mStreamRx = self.metrics.counter('stream_rx_messages', "JSON messages received from stream clients")
+        self._mStreamDropped = self.metrics.counter('stream_dropped', "Messages dropped or coalesced as a stream client was too slow")
+        self._mStreamDisconnects = self.metrics.counter('stream_disconnects', "Stream clients disconnected as they were too slow")
+        self._mMQTTBatched = self.metrics.counter('mqtt_batched', "WirelessMessages published via MQTT inside a WirelessMessageBatch")
+        self._mUDPLatency = self.metrics.histogram('serial_to_udp_latency_seconds', "Time from a message being received on serial to being sent via UDP")
+        self._mMQTTLatency = self.metrics.histogram('serial_to_mqtt_latency_seconds', "Time from a message being received on serial to being published via MQTT")
+        self._mDCRCacheHits = self.metrics.counter('dcr_cache_hits', "DeviceConfigurationRequest queries answered from the DCR cache")
+        self._mDCRDuration = self.metrics.histogram('dcr_duration_seconds', "Time taken to complete a DeviceConfigurationRequest")
+        self._mDCRResults = {}
+        # updated from the UDP, MQTT, serial and main threads
+        self._mMailboxResults = {state: self.metrics.counter('mailbox_results', "Mailbox messages by what happened to them", ('state', state), shared=True)
+                                 for state in ("Queued", "Rejected", "Sent", "Expired")}
+
+        if not self.config.getboolean('Metrics', 'http_enabled', fallback=False):
+            return
+
+        metrics = self.metrics
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split('?', 1)[0] not in ('/', '/metrics'):
+                    handler.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'text/plain; version=0.0.4')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                pass
+
+        address = (self.config.get('Metrics', 'http_host', fallback='127.0.0.1'),
+                   self.config.getint('Metrics', 'http_port', fallback=50142))
+        try:
+            self._metricsServer = http.server.HTTPServer(address, MetricsHandler)
+        except socket.error:
+            self.logger.exception("Failed to start the metrics HTTP server on {}".format(address))
+            return
+
+        self.tMetricsHTTP = threading.Thread(name='tMetricsHTTP', target=self._metricsServer.serve_forever)
+        self.tMetricsHTTP.daemon = True
+        self.tMetricsHTTP.start()
+        self.logger.info("Metrics served on http://{}:{}/metrics".format(address[0], address[1]))
+
+    def _initDeviceStore(self):
+        """ Setup the device store and reload the last snapshot if there is one
+        """
+        self.logger.info("Device Store init")
+        self._deviceStore = DeviceStore.DeviceStore(self.config.getint('DeviceStore', 'history_length', fallback=10),
+                                                    self.config.getint('DeviceStore', 'max_devices', fallback=2048))
+        self._deviceStoreSnapshot = self.config.getboolean('DeviceStore', 'snapshot_enabled', fallback=True)
+        self._deviceStoreFile = self.config.get('DeviceStore', 'snapshot_file', fallback="./DeviceStore.json")
+        self._deviceStoreInterval = self.config.getint('DeviceStore', 'snapshot_interval', fallback=300)
+        self._deviceStoreSaved = monotonic()
+
+        if self._deviceStoreSnapshot and os.path.exists(self._deviceStoreFile):
+            try:
+                count = self._deviceStore.load(self._deviceStoreFile)
+            except (IOError, OSError, ValueError):
+                self.logger.exception("Failed to load the device store from {}".format(self._deviceStoreFile))
+            else:
+                self.logger.info("Loaded {} devices from {}".format(count, self._deviceStoreFile))
+
+    def _saveDeviceStore(self):
+        """ Write a snapshot of the device store to disk
+        """
+        self._deviceStoreSaved = monotonic()
+        try:
+            self._deviceStore.save(self._deviceStoreFile)
+        except (IOError, OSError):
+            self.logger.exception("Failed to save the device store to {}".format(self._deviceStoreFile))
+        else:
+            self.logger.debug("Saved the device store to {}".format(self._deviceStoreFile))
+
+    def _initMailbox(self):
+        """ Setup the mailbox for sleeping devices and reload what was
+            waiting when the Message Bridge stopped
+        """
+        self.logger.info("Mailbox init")
+        wakeTriggers = [trigger.strip().upper() for trigger in
+                        self.config.get('Mailbox', 'wake_triggers', fallback="AWAKE, STARTED").split(',')
+                        if trigger.strip()]
+        if "CONFIGME" in wakeTriggers:
+            # a device in CONFIGME sends as ?? so it is never matched to a mailbox
+            self.logger.warn("Mailbox: CONFIGME can not be a wake trigger, ignored")
+            wakeTriggers = [trigger for trigger in wakeTriggers if trigger != "CONFIGME"]
+        self._mailbox = Mailbox.Mailbox(self.config.getint('Mailbox', 'max_depth', fallback=10),
+                                        self.config.getint('Mailbox', 'ttl', fallback=86400),
+                                        wakeTriggers)
+        self._mailboxPersist = self.config.getboolean('Mailbox', 'persist', fallback=True)
+        self._mailboxFile = self.config.get('Mailbox', 'file', fallback="./Mailbox.json")
+        self.metrics.gauge('mailbox_pending', "Messages waiting in the mailbox for a device to wake", lambda: len(self._mailbox))
+
+        if self._mailboxPersist and os.path.exists(self._mailboxFile):
+            try:
+                count = self._mailbox.load(self._mailboxFile)
+            except (IOError, OSError, ValueError):
+                self.logger.exception("Failed to load the mailbox from {}".format(self._mailboxFile))
+            else:
+                self.logger.info("Loaded {} waiting messages from {}".format(count, self._mailboxFile))
+
+    def _saveMailbox(self):
+        """ Write what is waiting in the mailbox to disk
+        """
+        try:
+            self._mailbox.save(self._mailboxFile)
+        except (IOError, OSError):
+            self.logger.exception("Failed to save the mailbox to {}".format(self._mailboxFile))
+        else:
+            self.logger.debug("Saved the mailbox to {}".format(self._mailboxFile))
+
     def _initDCRThread(self):
         """ Setup the Thread and Queues for handling DeviceConfigurationRequest
         """
         self.logger.info("DCR Thread init")
 
-        self.qDCRRequest = queue.Queue()
-        self.qDCRSerial = queue.Queue()
+        # the DCR thread sleeps on fDCRWakeup which is set by a put on
+        # either queue and by tDCRStop
+        self.fDCRWakeup = threading.Event()
+        self._initDCR(self.fDCRWakeup.set)
 
         self.tDCRStop = threading.Event()
-        self.fAnsweredAll = threading.Event()
-        self.fRetryFail = threading.Event()
-        self.fTimeoutFail = threading.Event()
+
+        self._startDCR()
+
+    def _initDCR(self, notify):
+        """ Queues and state for DeviceConfigurationRequests, notify is
+            called after every put on qDCRRequest or qDCRSerial
+        """
+        self.qDCRRequest = self._makeQueue('dcr_request', notify)
+        self.qDCRSerial = self._makeQueue('dcr_serial', notify)
+        self._DCRNotify = notify
+
+        # in flight requests by DCRRequest.key and a heap of (deadline, key)
+        # for their timeouts, only touched by the DCR thread
+        self._DCRRequests = {}
+        self._DCRDeadlines = []
+        # requests that did not fit on qSerialToQuery, oldest first
+        self._DCRBacklog = deque()
+
+        # replies seen from each device, for requests with cacheOk
+        if self.config.getboolean('DCR', 'cache_enabled', fallback=True):
+            exclude = [command.strip().upper() for command in
+                       self.config.get('DCR', 'cache_exclude', fallback="BATT, RSSI").split(',')
+                       if command.strip()]
+            self._dcrCache = DCRCache.DCRCache(self.config.getint('DCR', 'cache_max_devices', fallback=2048),
+                                               exclude + list(self._DCRActionCommands))
+            self.metrics.gauge('dcr_cache_devices', "Devices with replies in the DCR cache", lambda: len(self._dcrCache))
+
         self.fKeepAwake = threading.Event()
         self.fKeepAwake.clear()
-        self.fTimeoutFail.clear()
-        self.fRetryFail.clear()
-        self.fAnsweredAll.clear()
 
-        self._startDCR()
+    def _makeQueue(self, name, notify=None):
+        """ Create one of the internal queues using its [Queues] config settings
+            and keep track of it for the "queues" MessageBridge request
+            notify is called after every put to wake the consuming thread
+        """
+        if self.config.has_option('Queues', name + '_size'):
+            maxsize = self.config.getint('Queues', name + '_size')
+        else:
+            maxsize = 0
+        policy = self.config.get('Queues', name + '_policy', fallback=BoundedQueue.BoundedQueue.DropNewest)
+        timeout = self.config.getfloat('Queues', 'block_timeout', fallback=1)
+        try:
+            newQueue = BoundedQueue.BoundedQueue(maxsize, policy, timeout, notify)
+        except ValueError:
+            self.logger.error("Invalid policy {} for queue {}, using {}".format(policy, name, BoundedQueue.BoundedQueue.DropNewest))
+            newQueue = BoundedQueue.BoundedQueue(maxsize, BoundedQueue.BoundedQueue.DropNewest, timeout, notify)
+        self._queues[name] = newQueue
+        self.metrics.gauge('queue_depth', "Messages waiting on each internal queue", newQueue.qsize, ('queue', name))
+        self.metrics.gauge('queue_drops', "Messages dropped from each internal queue as it was full", lambda: newQueue.drops, ('queue', name))
+        return newQueue
 
     def _startDCR(self):
         self.tDCR = threading.Thread(name='tDCR', target=self._DCRThread)
@@ -595,12 +1216,22 @@ is running then run in the current terminal
         """
         self.logger.info("UDP Send Thread init")
 
-        self.qUDPSend = queue.Queue()
+        self._initUDPSend()
 
         self.tUDPSendStop = threading.Event()
 
         self._startUDPSend()
 
+    def _initUDPSend(self, notify=None):
+        """ Queue and subscribers for the UDP output
+        """
+        self.qUDPSend = self._makeQueue('udp_send', notify)
+
+        # clients that want messages unicast to them, see _processSubscribe
+        self._UDPBroadcast = self.config.getboolean('UDP', 'broadcast', fallback=True)
+        self._subscribers = SubscriberRegistry.SubscriberRegistry(self.config.getint('UDP', 'max_subscribers', fallback=32),
+                                                                  self.config.getint('UDP', 'max_subscription_ttl', fallback=3600))
+
     def _startUDPSend(self):
         self.tUDPSend = threading.Thread(name='tUDPSendThread', target=self._UDPSendThread)
         self.tUDPSend.daemon = False
@@ -609,11 +1240,127 @@ is running then run in the current terminal
         except:
             self.logger.exception("Failed to Start the UDP send thread")
 
+    def _initBinaryThreads(self):
+        """ Start the binary wire format sender and listener
+        """
+        self.logger.info("Binary Threads init")
+
+        self.qBinarySend = self._makeQueue('binary_send')
+
+        self.tBinarySendStop = threading.Event()
+        self.tBinaryListenStop = threading.Event()
+
+        self._startBinarySend()
+        self._startBinaryListen()
+
+    def _startBinarySend(self):
+        self.tBinarySend = threading.Thread(name='tBinarySendThread', target=self._BinarySendThread)
+        self.tBinarySend.daemon = False
+        try:
+            self.tBinarySend.start()
+        except:
+            self.logger.exception("Failed to Start the binary send thread")
+
+    def _startBinaryListen(self):
+        self.tBinaryListen = threading.Thread(name='tBinaryListenThread', target=self._BinaryListenThread)
+        self.tBinaryListen.daemon = False
+        try:
+            self.tBinaryListen.start()
+        except:
+            self.logger.exception("Failed to Start the binary listen thread")
+
+    def _initSharedRingThread(self):
+        """ Create the shared memory ring and start its writer thread
+        """
+        self.logger.info("SharedRing Thread init")
+
+        path = self.config.get('SharedRing', 'path', fallback="/dev/shm/MessageBridge.ring")
+        try:
+            self._sharedRing = SharedRing.SharedRing(path,
+                                                     self.config.getint('SharedRing', 'slots', fallback=4096),
+                                                     self._network,
+                                                     self.config.getint('SharedRing', 'readers', fallback=16),
+                                                     int(self.config.get('SharedRing', 'mode', fallback="660"), 8))
+        except (OSError, ValueError):
+            self.logger.exception("Failed to create the shared ring {}".format(path))
+            self._sharedRingEnabled = False
+            return
+        self.logger.info("Writing received messages to the shared ring {}".format(path))
+
+        self.qSharedRing = self._makeQueue('shared_ring')
+
+        self.tSharedRingStop = threading.Event()
+
+        self._startSharedRing()
+
+    def _startSharedRing(self):
+        self.tSharedRing = threading.Thread(name='tSharedRingThread', target=self._SharedRingThread)
+        self.tSharedRing.daemon = False
+        try:
+            self.tSharedRing.start()
+        except:
+            self.logger.exception("Failed to Start the shared ring thread")
+
+    def _initStreamThread(self):
+        """ Start the TCP and WebSocket stream endpoint
+        """
+        self.logger.info("Stream Thread init")
+
+        self.qStreamSend = self._makeQueue('stream_send', self._StreamWakeup)
+        self._streamClients = set()
+        self.metrics.gauge('stream_clients', "Clients connected to the stream endpoint", lambda: len(self._streamClients))
+
+        self._streamPolicy = self.config.get('Stream', 'slow_consumer', fallback=StreamClient.StreamClient.DropOldest)
+        if self._streamPolicy not in StreamClient.StreamClient.policies:
+            self.logger.error("Invalid slow_consumer policy {}, using {}".format(self._streamPolicy, StreamClient.StreamClient.DropOldest))
+            self._streamPolicy = StreamClient.StreamClient.DropOldest
+        self._streamFormat = self.config.get('Stream', 'format', fallback=StreamClient.StreamClient.JSON)
+        if self._streamFormat not in StreamClient.StreamClient.formats:
+            self.logger.error("Invalid stream format {}, using {}".format(self._streamFormat, StreamClient.StreamClient.JSON))
+            self._streamFormat = StreamClient.StreamClient.JSON
+
+        # wakeup socket pair so the stream thread can block in select and still
+        # see new messages on qStreamSend, unlike a pipe this works on windows
+        self._streamWakeupPair = socket.socketpair()
+        for sock in self._streamWakeupPair:
+            sock.setblocking(False)
+
+        self.tStreamStop = threading.Event()
+
+        self._startStream()
+
+    def _startStream(self):
+        self.tStream = threading.Thread(name='tStreamThread', target=self._StreamThread)
+        self.tStream.daemon = False
+        try:
+            self.tStream.start()
+        except:
+            self.logger.exception("Failed to Start the stream thread")
+
     def _initSerialThread(self):
         """ Setup the serial port and start the thread
         """
         self.logger.info("Serial port init")
 
+        self._initSerial()
+        # wakeup pipe so the serial thread can block on the port and still
+        # see new work on qSerialOut, qSerialToQuery and fSetRadioEncryption
+        # the queues signal it for us on each put
+        if sys.platform == 'win32':
+            self._serialWakeupPipe = None
+        else:
+            self._serialWakeupPipe = os.pipe()
+            for fd in self._serialWakeupPipe:
+                fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        # setup thread
+        self.tSerialStop = threading.Event()
+
+        self._startSerial()
+
+    def _initSerial(self):
+        """ Serial port, queues and flags, puts on the queues call _SerialWakeup
+        """
         # serial port base on config file, thread handles opening and closing
         self._serial = serial.Serial()
         if (self.args.port):
@@ -624,18 +1371,32 @@ is running then run in the current terminal
         self._serial.baudrate = self.config.get('Serial', 'baudrate')
         self._serial.timeout = self._serialTimeout
         # setup queue
-        self.qSerialOut = queue.Queue()
-        self.qSerialToQuery = queue.Queue()
-        self.qReplyEncryption = queue.Queue()
+        self.qSerialOut = self._makeQueue('serial_out', self._SerialWakeup)
+        self.qSerialToQuery = self._makeQueue('serial_to_query', self._SerialWakeup)
+        self.qReplyEncryption = self._makeQueue('reply_encryption')
+        # everything written to the radio goes through the TX scheduler, it
+        # works out how long a frame takes from the serial baud rate
+        frameTime = 12 * 10 / self._serial.baudrate
+        self._txScheduler = TXScheduler.TXScheduler(frameTime,
+                                                    self.config.getfloat('TX', 'min_gap', fallback=0.005),
+                                                    self.config.getfloat('TX', 'frame_airtime', fallback=0.005),
+                                                    self.config.getfloat('TX', 'duty_cycle', fallback=0),
+                                                    self.config.getfloat('TX', 'duty_cycle_window', fallback=3600),
+                                                    self.config.getfloat('TX', 'max_wait', fallback=30),
+                                                    self.config.getint('TX', 'max_pending', fallback=1000))
+        for (priority, name) in enumerate(TXScheduler.TXScheduler.classes):
+            self.metrics.gauge('tx_pending', "Messages waiting in the TX scheduler", lambda p=priority: self._txScheduler.pending(p), ('class', name))
+            self.metrics.gauge('tx_deferred', "Messages the TX scheduler could not send straight away", lambda p=priority: self._txScheduler.deferred[p], ('class', name))
+            self.metrics.gauge('tx_dropped', "Messages the TX scheduler dropped as they waited too long or it was full", lambda p=priority: self._txScheduler.dropped[p], ('class', name))
+        # repeats of a message heard again within the window are dropped
+        # before they are encoded, logged or sent on
+        self._deduplicator = Deduplicator.Deduplicator(self.config.getfloat('Dedup', 'window', fallback=0))
+        self.metrics.gauge('dedup_entries', "Messages the deduplicator is remembering", lambda: len(self._deduplicator))
+
         #setup flags
         self.fSetRadioEncryption = threading.Event()
         self.fRadioEncryptionDone = threading.Event()
 
-        # setup thread
-        self.tSerialStop = threading.Event()
-
-        self._startSerial()
-
     def _startSerial(self):
         self.tSerial = threading.Thread(name='tSerial', target=self._SerialThread)
         self.tSerial.daemon = False
@@ -670,7 +1431,7 @@ is running then run in the current terminal
 
         self.logger.info("MQTT Thread init")
 
-        self.qMQTTSend = queue.Queue()
+        self.qMQTTSend = self._makeQueue('mqtt_send')
 
         self.tMQTTStop = threading.Event()
 
@@ -700,26 +1461,64 @@ is running then run in the current terminal
 
         publishTopic = "{}/listen".format(self.config.get('MQTT', 'base_topic').rstrip('/'))
 
+        # WirelessMessages received within batch_window are published as one WirelessMessageBatch
+        batch = WirelessMessage.WirelessMessageBatch(self.config.getfloat('MQTT', 'batch_window', fallback=0),
+                                                     self.config.getint('MQTT', 'batch_size', fallback=100))
+
         while (not self.tMQTTStop.is_set()):
             try:
-                message = self.qMQTTSend.get(timeout=1)     # block for up to 1 seconds
+                message = self.qMQTTSend.get(timeout=batch.timeout(1))     # block for up to 1 seconds
             except queue.Empty:
                 # MQTT Send queue was empty
                 # extrem debug message
                 # self.logger.debug("tMQTT: send queue is empty")
                 pass
             else:
-                self.logger.debug("tMQTT: Got json to send: {}".format(message))
-                self._mqttClient.publish(publishTopic, message)
-
+                self._MQTTPublishQueued(publishTopic, batch, message)
                 # tidy up
                 self.qMQTTSend.task_done()
 
+            if batch.due():
+                self._MQTTPublishBatch(publishTopic, batch.take())
+
+        if batch:
+            self._MQTTPublishBatch(publishTopic, batch.take())
+
         self.logger.info("tMQTT: Thread stopping")
         self._mqttClient.disconnect()
         self._mqttClient.loop_stop()
         return
 
+    def _MQTTPublishQueued(self, publishTopic, batch, message):
+        """ Publish a message from qMQTTSend, or add it to batch if batching
+        """
+        self.logger.debug("tMQTT: Got json to send: {}".format(message))
+        if batch.window > 0 and isinstance(message, WirelessMessage.WirelessMessage):
+            for ready in batch.add(message):
+                self._MQTTPublishBatch(publishTopic, ready)
+        else:
+            # keep the order messages were queued in
+            if batch:
+                self._MQTTPublishBatch(publishTopic, batch.take())
+            if isinstance(message, WirelessMessage.WirelessMessage):
+                self._mqttClient.publish(publishTopic, message.json)
+                self._mMQTTLatency.observe(monotonic() - message.received)
+            else:
+                self._mqttClient.publish(publishTopic, message)
+            self._mMQTTPublish.inc()
+
+    def _MQTTPublishBatch(self, publishTopic, batch):
+        """ Publish a (json, records) batch from WirelessMessageBatch.take()
+        """
+        (message, records) = batch
+        self._mqttClient.publish(publishTopic, message)
+        self._mMQTTPublish.inc()
+        if len(records) > 1:
+            self._mMQTTBatched.inc(len(records))
+        now = monotonic()
+        for record in records:
+            self._mMQTTLatency.observe(now - record.received)
+
     def _MQTT_on_connect(self, client, userdata, flags, rc):
         self.logger.debug("tMQTT: Connected with result code " + str(rc))
 
@@ -745,26 +1544,17 @@ is running then run in the current terminal
                 # yep its for our network or "ALL"
                 # error checking, dict should have keys for type
                 if 'type' in jsonin:
-                    if jsonin['type'] == "WirelessMessage":
-                        self.logger.debug("tMQTT@_MQTT_on_message: JSON of type WirelessMessage, send out messages")
+                    if jsonin['type'] in ("WirelessMessage", "WirelessMessageBatch"):
+                        self.logger.debug("tMQTT@_MQTT_on_message: JSON of type {}, send out messages".format(jsonin['type']))
                         # got a WirelessMessage type json, need to generate the Language of Things message and
                         # put them on the TX queue
-                        # error checking, dict should have keys for sendon and data
-                        if 'sendOn' in jsonin:
-                            self.processSendOnJSON(jsonin)
-                            return
-
-                        if 'data' in jsonin:
-                            for command in jsonin['data']:
-                                wirelessMsg = "a{}{}".format(jsonin['id'], command[0:9].upper())
-                                while len(wirelessMsg) <12:
-                                    wirelessMsg += '-'
-                                try:
-                                    self.qSerialOut.put_nowait(wirelessMsg)
-                                except queue.Full:
-                                    self.logger.debug("tMQTT@_MQTT_on_message: Failed to put {} on qDCRSerial as it's full".format(wirelessMsg))
-                                else:
-                                    self.logger.debug("tMQTT@_MQTT_on_message: Put {} on qSerialOut".format(wirelessMsg))
+                        serialOut = self._languageOfThingsFromJSON(jsonin)
+                        if serialOut:
+                            put = self.qSerialOut.putMany(serialOut)
+                            if put < len(serialOut):
+                                self.logger.warn("tMQTT@_MQTT_on_message: Failed to put {} of {} messages on qSerialOut as it's full".format(len(serialOut) - put, len(serialOut)))
+                            else:
+                                self.logger.debug("tMQTT@_MQTT_on_message: Put {} on qSerialOut".format(serialOut))
 
                     # elif jsonin['type'] == "DeviceConfigurationRequest" and self.config.getboolean('DCR', 'dcr_enable'):
                     #     # we have a DeviceConfigurationRequest pass in onto the DCR thread
@@ -787,230 +1577,884 @@ is running then run in the current terminal
         """ Device Configuration Request thread
             Main logic for dealing with DCR's
             We check the incoming qDCRRequest and qDCRSerial
+
+            Several requests can be in flight at once, each with its own
+            timeout. The serial thread talks to one CONFIGME device at a
+            time and uses DTY to pick the request that device can answer,
+            results come back on qDCRSerial tagged with the request key.
         """
         self.logger.info("tDCR: DCR thread started")
 
         while (not self.tDCRStop.is_set()):
-            # do we have a request
-            if not self.qDCRRequest.empty():
-                self.logger.debug("tDCR: Got a request to process")
-                # if we are not in the middle of an DCR
-                if not self._currentDCR:
-                    # lets get it out the queue and start processing it
+            self._DCRProcessQueues()
+
+            # check the timeouts and wait for the next one or for new work
+            self.fDCRWakeup.wait(self._DCRCheckTimeouts())
+            self.fDCRWakeup.clear()
+
+        self.logger.info("tDCR: Thread stopping")
+        return
+
+    def _DCRProcessQueues(self):
+        """ Start the new requests on qDCRRequest and handle the replies from
+            the serial thread on qDCRSerial
+        """
+        # do we have a request
+        while not self.qDCRRequest.empty():
+            self.logger.debug("tDCR: Got a request to process")
+            try:
+                jsonin = self.qDCRRequest.get_nowait()
+            except queue.Empty:
+                self.logger.debug("tDCR: Failed to get item from qDCRRequest")
+            else:
+                self._DCRStartRequest(jsonin)
+                self.qDCRRequest.task_done()
+
+        # do we have a reply from serial
+        while not self.qDCRSerial.empty():
+            self.logger.debug("tDCR: Something in qDCRSerial")
+            try:
+                (key, event, wirelessReply) = self.qDCRSerial.get_nowait()
+            except queue.Empty:
+                self.logger.debug("tDCR: Failed to get item from qDCRSerial")
+            else:
+                self._DCRProcessSerial(key, event, wirelessReply)
+                self.qDCRSerial.task_done()
+
+        # hand on any requests waiting for room on qSerialToQuery
+        self._DCRPassToSerial()
+
+    def _DCRCheckTimeouts(self):
+        """ Fail any requests whose timeout has expired
+            Returns the seconds until the next timeout or None if there are none
+        """
+        now = monotonic()
+        while self._DCRDeadlines:
+            (deadline, key) = self._DCRDeadlines[0]
+            if deadline > now:
+                return deadline - now
+            heapq.heappop(self._DCRDeadlines)
+            request = self._DCRRequests.get(key, None)
+            if not request:
+                # already finished
+                continue
+            if request.deadline > now:
+                # timeout was reset by a reply, check again later
+                heapq.heappush(self._DCRDeadlines, (request.deadline, key))
+                continue
+            # failed due to expired timeout
+            self.logger.warn("tDCR: Failed DCR {} due to timeout".format(request))
+            self._DCRReturnDCR(request, "FAIL_TIMEOUT")
+        return None
+
+    def _DCRStartRequest(self, jsonin):
+        """ Start work on a new DeviceConfigurationRequest
+        """
+        # check the keepAwake
+        if jsonin['data'].get('keepAwake', None) == 1:
+            self.logger.debug("tDCR: keepAwake turned on")
+            self.fKeepAwake.set()
+        elif jsonin['data'].get('keepAwake', None) == 0:
+            self.logger.debug("tDCR: keepAwake turned off")
+            self.fKeepAwake.clear()
+
+        # use a copy in case we are adding ENC stuff
+        toQuery = list(jsonin['data'].get('toQuery', []))
+        if toQuery and 'setENC' in jsonin['data']:
+            if self._encryption:
+                self.logger.debug("tDCR: auto setting encryption")
+                toQuery.insert(0, {"command":"ENC", "value":"ON"})
+                for (index, hex) in enumerate(list(self._chunkstring(self._encryptionKey, 6))):
+                    toQuery.insert(0, {"command":"EN{}".format(index+1), "value":hex})
+
+        # make place for replies later
+        jsonin['data']['replies'] = {}
+        # answer what we can from the cache, only the rest goes to the device
+        toQuery = self._DCRFromCache(jsonin, toQuery)
+        timeout = int(jsonin['data'].get('timeout', self.config.get('DCR', 'timeout')))
+        request = DCRRequest.DCRRequest(jsonin, toQuery, timeout)
+
+        if not toQuery:
+            # no toQuery section or all answered from the cache, so reply with all done
+            self._DCRReturnDCR(request, "PASS")
+            return
+        if request.progress and jsonin['data']['replies']:
+            # let the client have the cached replies while the device is asked for the rest
+            self._DCRSendProgress(request, dict(jsonin['data']['replies']))
+
+        # a repeat of a request still in flight replaces it
+        for old in list(self._DCRRequests.values()):
+            if old.target() == request.target():
+                self.logger.debug("tDCR: {} replaced by {}".format(old, request))
+                old.cancelled = True
+                del self._DCRRequests[old.key]
+
+        # pass queries on to the serial thread to send out, the timeout runs
+        # from now even if it has to wait for room on qSerialToQuery
+        self._DCRRequests[request.key] = request
+        heapq.heappush(self._DCRDeadlines, (request.deadline, request.key))
+        self._DCRBacklog.append(request)
+        self._DCRPassToSerial()
+        self.logger.debug("tDCR: started {} with timeout period: {}".format(request, timeout))
+
+    def _DCRPassToSerial(self):
+        """ Put the waiting requests on qSerialToQuery, oldest first, any that
+            do not fit wait here until the serial thread has taken some off
+        """
+        while self._DCRBacklog:
+            request = self._DCRBacklog[0]
+            if not request.cancelled:
+                # check first so waiting is not counted as a queue drop
+                if self.qSerialToQuery.full():
+                    self.logger.debug("tDCR: {} waiting for room on qSerialToQuery".format(request))
+                    return
+                self.qSerialToQuery.put_nowait(request)
+            self._DCRBacklog.popleft()
+
+    def _DCRFromCache(self, jsonin, toQuery):
+        """ For a request with "cacheOk" (seconds) and "devID", fill in the
+            replies the cache has that are no older than cacheOk. Only the
+            queries before the first command with a value or action can be
+            answered as that could change the ones after it
+            Returns the toQuery entries still to be asked
+        """
+        data = jsonin['data']
+        devID = data.get('devID', None)
+        if self._dcrCache is None or data.get('cacheOk', None) is None or not devID or devID == "??":
+            return toQuery
+        try:
+            maxAge = float(data['cacheOk'])
+        except (TypeError, ValueError):
+            self.logger.debug("tDCR: Invalid cacheOk in {}".format(jsonin))
+            return toQuery
+
+        asked = 0
+        for q in toQuery:
+            if q.get('value', "") or q['command'] in self._DCRActionCommands:
+                break
+            asked += 1
+        found = self._dcrCache.lookup(devID, data.get('devType', None),
+                                      [q['command'] for q in toQuery[:asked]], maxAge)
+        if not found:
+            return toQuery
+
+        for (command, (reply, age)) in found.items():
+            data['replies'][command] = {'value': "",
+                                        'reply': reply,
+                                        'cached': round(age, 1)
+                                        }
+        self._mDCRCacheHits.inc(len(found))
+        self.logger.debug("tDCR: Answered {} for {} from the cache".format(list(found), devID))
+        return [q for q in toQuery[:asked] if q['command'] not in found] + toQuery[asked:]
+
+    def _DCRUpdateCache(self, request):
+        """ Remember the replies a device gave, for later requests with cacheOk
+        """
+        if self._dcrCache is None:
+            return
+        data = request.request['data']
+        replies = {command: reply['reply'] for (command, reply) in data['replies'].items()
+                   if 'cached' not in reply and not self._encryptionCommandMatch.match(command)}
+        if not replies:
+            return
+        devID = data.get('devID', None)
+        _id = replies.get('CHDEVID', devID)
+        if devID and (_id != devID or 'LLAPRESET' in replies):
+            # the device has a new ID or has been reset
+            self._dcrCache.forget(devID)
+        if not _id or _id == "??":
+            return
+        self._dcrCache.update(_id, replies.get('DTY', request.devType), replies)
+
+    def _DCRProcessSerial(self, key, event, wirelessReply):
+        """ Handle a reply or result from the serial thread for request key
+        """
+        self.logger.debug("tDCR: Got {} {} for {} to process".format(event, wirelessReply, key))
+        request = self._DCRRequests.get(key, None)
+        if not request:
+            # finished or timed out already so drop it
+            return
+
+        if event == "reply":
+            # check and store the reply
+            stored = {}
+            for q in request.request['data']['toQuery']:
+                if wirelessReply.strip('-').startswith(q['command']):
+                    request.request['data']['replies'][q['command']] = {'value': q.get('value', ""),
+                                                                        'reply': wirelessReply[len(q['command']):].strip('-')
+                                                                        }
+                    stored[q['command']] = request.request['data']['replies'][q['command']]
+                    self.logger.debug("tDCR: Stored reply '{}':{}".format(q['command'], request.request['data']['replies'][q['command']]))
+            if stored and request.progress:
+                self._DCRSendProgress(request, stored)
+            # and reset the timeout
+            self.logger.debug("tDCR: Reset timeout for {}".format(request))
+            request.touch()
+        elif event == "answeredAll":
+            # finished toQuery ok
+            self.logger.debug("tDCR: Serial answered so send out json")
+            self._DCRReturnDCR(request, "PASS")
+        elif event == "retryFail":
+            # failed due to a message retry issue
+            self.logger.warn("tDCR: Failed DCR {} due to retry count".format(request))
+            self._DCRReturnDCR(request, "FAIL_RETRY")
+
+    def _DCRSendProgress(self, request, replies):
+        """ Send the replies stored since the last progress message for a
+            request with "progress", state PROGRESS, numbered by sequence so
+            the client can spot a lost one, the final reply still has them all
+        """
+        data = request.request['data']
+        request.sequence += 1
+        progress = {'type': "DeviceConfigurationRequest",
+                    'network': self._network,
+                    'timestamp': strftime("%d %b %Y %H:%M:%S +0000", gmtime()),
+                    'data': {'id': request.id,
+                             'state': "PROGRESS",
+                             'sequence': request.sequence,
+                             'answered': len(data['replies']),
+                             'total': len({q['command'] for q in data['toQuery']}),
+                             'replies': replies
+                             }
+                    }
+        if request.devType is not None:
+            progress['data']['devType'] = request.devType
+
+        jsonout = json.dumps(progress)
+        try:
+            self.qUDPSend.put_nowait(jsonout)
+        except queue.Full:
+            self.logger.warn("tDCR: Failed to put {} on qUDPSend as it's full".format(jsonout))
+        else:
+            self.logger.debug("tDCR: Sent DCR progress {} for {}".format(request.sequence, request))
+
+    def _DCRReturnDCR(self, request, state):
+        # finished with this request, let the serial thread know
+        request.cancelled = True
+        self._DCRRequests.pop(request.key, None)
+
+        self._DCRUpdateCache(request)
+
+        # prep the reply
+        reply = request.request
+        reply['timestamp'] = strftime("%d %b %Y %H:%M:%S +0000", gmtime())
+        reply['network'] = self._network
+        reply['keepAwake'] = 1 if self.fKeepAwake.is_set() else 0
+        reply['data']['state'] = state
+        if request.progress:
+            reply['data']['sequence'] = request.sequence + 1
+
+        # encode json
+        jsonout = json.dumps(reply)
+
+        self._mDCRDuration.observe(monotonic() - request.started)
+        if state not in self._mDCRResults:
+            self._mDCRResults[state] = self.metrics.counter('dcr_results', "Completed DeviceConfigurationRequests by state", ('state', state))
+        self._mDCRResults[state].inc()
+
+        # send to UDP thread
+        try:
+            self.qUDPSend.put_nowait(jsonout)
+        except queue.Full:
+            self.logger.warn("tDCR: Failed to put {} on qUDPSend as it's full".format(jsonout))
+        else:
+            self.logger.debug("tDCR: Sent DCR reply to qUDPSend")
+
+    def _UDPSendThread(self):
+        """ UDP Send thread
+        """
+        self.logger.info("tUDPSend: Send thread started")
+        UDPSendSocket = self._UDPOpenSendSocket()
+        sendPort = int(self.config.get('UDP', 'send_port'))
+        batch = self._UDPMakeBatch()
+
+        while (not self.tUDPSendStop.is_set()):
+            try:
+                message = self.qUDPSend.get(timeout=batch.timeout(1))     # block for up to 1 seconds
+            except queue.Empty:
+                # UDP Send queue was empty
+                # extrem debug message
+                # self.logger.debug("tUDPSend: queue is empty")
+                pass
+            else:
+                self._UDPSendQueued(UDPSendSocket, batch, message, sendPort)
+                # tidy up
+                self.qUDPSend.task_done()
+
+            if batch.due():
+                self._UDPSendBatch(UDPSendSocket, batch.take(), sendPort)
+
+        if batch:
+            self._UDPSendBatch(UDPSendSocket, batch.take(), sendPort)
+
+        self.logger.info("tUDPSend: Thread stopping")
+        self._UDPCloseSendSocket(UDPSendSocket)
+        return
+
+    def _UDPOpenSendSocket(self):
+        """ Setup the UDP send socket and the unix one if needed
+            Returns the UDP socket
+        """
+        try:
+            UDPSendSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        except socket.error as msg:
+            self.logger.critical("tUDPSend: Failed to create socket, Exiting. Error code : {} Message : {} ".format(msg.errno, msg.strerror))
+            self.die()
+
+        UDPSendSocket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        UDPSendSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._UDPSetupMulticastSend(UDPSendSocket)
+
+        # subscribers on the unix datagram socket are sent to from an unbound socket
+        if self.config.get('Unix', 'datagram_path', fallback="") and hasattr(socket, 'AF_UNIX'):
+            try:
+                self._unixSendSocket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                self._unixSendSocket.setblocking(0)
+            except socket.error:
+                self.logger.exception("tUDPSend: Failed to create unix socket")
+        return UDPSendSocket
+
+    def _UDPCloseSendSocket(self, UDPSendSocket):
+        try:
+            UDPSendSocket.close()
+            if self._unixSendSocket is not None:
+                self._unixSendSocket.close()
+                self._unixSendSocket = None
+        except socket.error:
+            self.logger.exception("tUDPSend: Failed to close socket")
+
+    def _UDPMakeBatch(self):
+        """ WirelessMessages received within batch_window are sent as one WirelessMessageBatch
+        """
+        return WirelessMessage.WirelessMessageBatch(self.config.getfloat('UDP', 'batch_window', fallback=0),
+                                                    self.config.getint('UDP', 'batch_size', fallback=20),
+                                                    self.config.getint('UDP', 'max_datagram_size', fallback=1400))
+
+    def _UDPSendQueued(self, UDPSendSocket, batch, message, sendPort):
+        """ Send a message from qUDPSend, or add it to batch if batching
+        """
+        self.logger.debug("tUDPSend: Got json to send: {}".format(message))
+        if batch.window > 0 and isinstance(message, WirelessMessage.WirelessMessage):
+            for ready in batch.add(message):
+                self._UDPSendBatch(UDPSendSocket, ready, sendPort)
+        else:
+            # keep the order messages were queued in
+            if batch:
+                self._UDPSendBatch(UDPSendSocket, batch.take(), sendPort)
+            if isinstance(message, WirelessMessage.WirelessMessage):
+                self._UDPSendBatch(UDPSendSocket, (message.json, [message]), sendPort)
+            else:
+                if isinstance(message, str):
+                    message = message.encode()
+                # replies to requests go to the stream clients too
+                if self._streamEnabled:
+                    try:
+                        self.qStreamSend.put_nowait(message)
+                    except queue.Full:
+                        self.logger.warn("tUDPSend: Failed to put {} on qStreamSend as it's full".format(message))
+                self._UDPDeliver(UDPSendSocket, message, None, sendPort)
+
+    def _UDPSendBatch(self, UDPSendSocket, batch, sendPort):
+        """ Send a (json, records) batch from WirelessMessageBatch.take()
+        """
+        (message, records) = batch
+        if self._UDPDeliver(UDPSendSocket, message, records, sendPort):
+            if len(records) > 1:
+                self._mUDPTxBatched.inc(len(records))
+            now = monotonic()
+            for record in records:
+                self._mUDPLatency.observe(now - record.received)
+
+    def _UDPDeliver(self, UDPSendSocket, message, records, sendPort):
+        """ Broadcast message and unicast it to each matching subscriber
+            records is the list of WirelessMessage records in message or None
+            for other JSON, [UDP] broadcast False only stops WirelessMessages
+            being broadcast, replies to requests are always broadcast
+            Returns False if the broadcast failed
+        """
+        sent = True
+        if self._UDPBroadcast or records is None:
+            sent = self._UDPSendMessage(UDPSendSocket, message, sendPort)
+            if sent:
+                self._mUDPTx.inc()
+            else:
+                self._mUDPTxErrors.inc()
+
+        subscribers = self._subscribers.current()
+        if not subscribers:
+            return sent
+
+        if records is None:
+            # replies to DCR and MessageBridge requests, rare enough to decode
+            try:
+                jsonout = json.loads(message)
+            except ValueError:
+                return sent
+            subscribers = [s for s in subscribers if s.format == s.JSON and
+                           s.matches(jsonout.get('type'), jsonout.get('network'))]
+        for subscriber in subscribers:
+            data = message
+            if records is not None:
+                matching = [r for r in records if subscriber.matches("WirelessMessage", r.network, r.id)]
+                if not matching:
+                    continue
+                if subscriber.format == subscriber.Binary:
+                    networkID = WirelessBinary.WirelessBinary.networkID(matching[0].network)
+                    data = b''.join([WirelessBinary.WirelessBinary.encode(WirelessBinary.WirelessBinary.Received, networkID,
+                                                                          int(r.received * 1e9), r.id, r.data) for r in matching])
+                elif len(matching) != len(records):
+                    data = WirelessMessage.WirelessMessageBatch.encode(matching)
+            unix = not isinstance(subscriber.address, tuple)
+            sock = self._unixSendSocket if unix else UDPSendSocket
+            if sock is None:
+                continue
+            try:
+                sock.sendto(data, subscriber.address)
+            except (ConnectionRefusedError, FileNotFoundError) as msg:
+                self._mUDPTxErrors.inc()
+                if unix:
+                    # unix client has gone away, no point waiting out its lease
+                    self.logger.info("tUDPSend: Unsubscribed {} as it has gone".format(subscriber.address))
+                    self._subscribers.subscribe(subscriber.address, {}, 0)
+            except socket.error as msg:
+                self.logger.debug("tUDPSend: Failed to send to subscriber {}. Error code : {} Message: {}".format(subscriber.address, msg.errno, msg.strerror))
+                self._mUDPTxErrors.inc()
+            else:
+                subscriber.sent += 1
+                self._mUDPTxUnicast.inc()
+        return sent
+
+    def _UDPSetupMulticastSend(self, UDPSendSocket):
+        """ Set the multicast TTL, loopback and interface on a send socket
+        """
+        if not self._multicastGroup:
+            return
+        try:
+            UDPSendSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL,
+                                     self.config.getint('UDP', 'multicast_ttl', fallback=1))
+            UDPSendSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP,
+                                     1 if self.config.getboolean('UDP', 'multicast_loopback', fallback=True) else 0)
+            interface = self.config.get('UDP', 'multicast_interface', fallback="")
+            if interface:
+                UDPSendSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+        except (socket.error, ValueError):
+            self.logger.exception("Failed to setup multicast on the send socket")
+
+    def _UDPJoinMulticast(self, UDPListenSocket):
+        """ Join the multicast group on a listen socket so clients can send to
+            the group as well as broadcast
+        """
+        if not self._multicastGroup:
+            return
+        interface = self.config.get('UDP', 'multicast_interface', fallback="") or "0.0.0.0"
+        try:
+            UDPListenSocket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                                       struct.pack('4s4s', socket.inet_aton(self._multicastGroup), socket.inet_aton(interface)))
+        except (socket.error, OSError):
+            self.logger.exception("Failed to join multicast group {} on {}".format(self._multicastGroup, interface))
+        else:
+            self.logger.info("Joined multicast group {} on {}".format(self._multicastGroup, interface))
+
+    def _UDPSendMessage(self, UDPSendSocket, message, sendPort):
+        """ Send one encoded message out via UDP multicast or broadcast
+            Returns True if it was sent
+        """
+        if self._multicastGroup:
+            try:
+                UDPSendSocket.sendto(message, (self._multicastGroup, sendPort))
+                self.logger.debug("tUDPSend: Put message out via UDP multicast")
+            except socket.error as msg:
+                self.logger.warn("tUDPSend: Failed to send via UDP multicast. Error code : {} Message: {}".format(msg.errno, msg.strerror))
+                return False
+        elif self.config.getboolean('UDP', 'use_local_only'):
+            try:
+                UDPSendSocket.sendto(message, ('127.0.0.255', sendPort))
+                self.logger.debug("tUDPSend: Put message out via UDP to local only")
+            except socket.error as msg:
+                self.logger.warn("tUDPSend: Failed to send via UDP local only. Error code : {} Message: {}".format(msg.errno, msg.strerror))
+                return False
+        else:
+            try:
+                UDPSendSocket.sendto(message, ('<broadcast>', sendPort))
+                self.logger.debug("tUDPSend: Put message out via UDP")
+            except socket.error as msg:
+                if msg.errno == errno.ENETUNREACH:
+                    try:
+                        self.logger.warn("tUDPSend: External network unreachable retrying on local interface only")
+                        UDPSendSocket.sendto(message, ('127.0.0.255', sendPort))
+                        self.logger.debug("tUDPSend: Put message out via UDP to local only")
+                    except socket.error as msg:
+                        self.logger.warn("tUDPSend: Failed to send via UDP local only. Error code : {} Message: {}".format(msg.errno, msg.strerror))
+                        return False
+                else:
+                    self.logger.warn("tUDPSend: Failed to send via UDP. Error code : {} Message: {}".format(msg.errno, msg.strerror))
+                    return False
+        return True
+
+    def _BinarySendThread(self):
+        """ Binary Send thread
+            Sends received messages in the WirelessBinary format, everything
+            waiting on the queue is packed into one datagram
+        """
+        self.logger.info("tBinarySend: Send thread started")
+        try:
+            BinarySendSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        except socket.error:
+            self.logger.exception("tBinarySend: Failed to create socket, Exiting")
+            self.die()
+
+        BinarySendSocket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        BinarySendSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._UDPSetupMulticastSend(BinarySendSocket)
+
+        sendPort = self.config.getint('Binary', 'send_port', fallback=50143)
+        maxSize = self.config.getint('UDP', 'max_datagram_size', fallback=1400)
+
+        while (not self.tBinarySendStop.is_set()):
+            try:
+                message = self.qBinarySend.get(timeout=1)     # block for up to 1 seconds
+            except queue.Empty:
+                continue
+
+            networkID = WirelessBinary.WirelessBinary.networkID(self._network)
+            records = []
+            size = 0
+            while message is not None:
+                record = WirelessBinary.WirelessBinary.encode(WirelessBinary.WirelessBinary.Received, networkID,
+                                                              int(message.received * 1e9), message.id, message.data)
+                records.append(record)
+                size += len(record)
+                self.qBinarySend.task_done()
+                message = None
+                if size + WirelessBinary.WirelessBinary.headerSize + 9 <= maxSize:
                     try:
-                        self._currentDCR = self.qDCRRequest.get_nowait()
+                        message = self.qBinarySend.get_nowait()
                     except queue.Empty:
-                        self.logger.debug("tDCR: Failed to get item from qDCRRequest")
-                    else:
-                        # check the keepAwake
-                        if self._currentDCR['data'].get('keepAwake', None) == 1:
-                            self.logger.debug("tDCR: keepAwake turned on")
-                            self.fKeepAwake.set()
-                        elif self._currentDCR['data'].get('keepAwake', None) == 0:
-                            self.logger.debug("tDCR: keepAwake turned off")
-                            self.fKeepAwake.clear()
-
-                        if self._currentDCR['data'].get('toQuery', False):
-                            # make place for replies later
-                            self._currentDCR['data']['replies'] = {}
-                            # use a copy in case we are adding ENC stuff
-                            toQuery = list(self._currentDCR['data']['toQuery'])
-                            if 'setENC' in self._currentDCR['data']:
-                                if self._encryption:
-                                    self.logger.debug("tDCR: auto setting encryption")
-                                    toQuery.insert(0, {"command":"ENC", "value":"ON"})
-                                    for (index, hex) in enumerate(list(self._chunkstring(self._encryptionKey, 6))):
-                                        toQuery.insert(0, {"command":"EN{}".format(index+1), "value":hex})
-
-                            # pass queries on to the serial thread to send out
-                            try:
-                                self.qSerialToQuery.put_nowait(toQuery)
-                            except queue.Full:
-                                self.logger.debug("tDCR: Failed to put item onto toQuery as it's full")
-                            else:
-                                self.devType = self._currentDCR['data'].get('devType', None)
-                                # reset flags
-                                self.fAnsweredAll.clear()
-                                self.fRetryFail.clear()
-                                self.fTimeoutFail.clear()
-                                # start timer
-                                self._DCRCurrentTimeout = int(self._currentDCR['data'].get('timeout', self.config.get('DCR', 'timeout')))
-                                self._DCRStartTime = time()
-                                self.logger.debug("tDCR: started DCR timeout with period: {}".format(self._DCRCurrentTimeout))
-                        else:
-                            # no toQuery section, so reply with all done
-                            self._DCRReturnDCR("PASS")
-                        self.qDCRRequest.task_done()
+                        pass
 
-            # do we have a reply from serial
-            while not self.qDCRSerial.empty():
-                self.logger.debug("tDCR: Something in qDCRSerial")
+            if self._UDPSendMessage(BinarySendSocket, b''.join(records), sendPort):
+                self._mBinaryTx.inc()
+                self._mBinaryTxRecords.inc(len(records))
+
+        self.logger.info("tBinarySend: Thread stopping")
+        try:
+            BinarySendSocket.close()
+        except socket.error:
+            self.logger.exception("tBinarySend: Failed to close socket")
+        return
+
+    def _BinaryListenThread(self):
+        """ Binary Listen thread
+            Language of Things messages to send in the WirelessBinary format
+        """
+        self.logger.info("tBinaryListen: listen thread started")
+        try:
+            BinaryListenSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        except socket.error:
+            self.logger.exception("tBinaryListen: Failed to create socket, Exiting")
+            self.die()
+
+        BinaryListenSocket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        BinaryListenSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        try:
+            BinaryListenSocket.bind(("", self.config.getint('Binary', 'listen_port', fallback=50144)))
+        except socket.error:
+            self.logger.exception("tBinaryListen: Failed to bind port, Exiting")
+            self.die()
+        self._UDPJoinMulticast(BinaryListenSocket)
+
+        BinaryListenSocket.setblocking(0)
+        buffer = bytearray(self._UDPListenBufferSize)
+
+        self.logger.info("tBinaryListen: listening")
+        while not self.tBinaryListenStop.is_set():
+            datawaiting = select.select([BinaryListenSocket], [], [], self._UDPListenTimeout)
+            if not datawaiting[0]:
+                continue
+            networkID = WirelessBinary.WirelessBinary.networkID(self._network)
+            serialOut = []
+            for (data, address) in self._UDPReadBatch(BinaryListenSocket, buffer, self._mBinaryRx):
                 try:
-                    wirelessReply = self.qDCRSerial.get_nowait()
-                except queue.Empty:
-                    self.logger.debug("tDCR: Failed to get item from qDCRSerial")
+                    records = WirelessBinary.WirelessBinary.decode(data)
+                except ValueError:
+                    self.logger.debug("tBinaryListen: Invalid datagram received from {}".format(address))
+                    self._mBinaryRxInvalid.inc()
+                    continue
+                for record in records:
+                    if (record.type == WirelessBinary.WirelessBinary.Send and
+                        record.networkID in (networkID, WirelessBinary.WirelessBinary.AllNetworks)):
+                        wirelessMsg = "a{}{}".format(record.id, record.data[0:9].upper())
+                        while len(wirelessMsg) <12:
+                            wirelessMsg += '-'
+                        serialOut.append(wirelessMsg)
+
+            if serialOut:
+                put = self.qSerialOut.putMany(serialOut)
+                if put < len(serialOut):
+                    self.logger.warn("tBinaryListen: Failed to put {} of {} messages on qSerialOut as it's full".format(len(serialOut) - put, len(serialOut)))
                 else:
-                    self.logger.debug("tDCR: Got {} to process".format(wirelessReply))
-                    if self._currentDCR:
-                        # we are working on a request check and store the reply
-                        for q in self._currentDCR['data']['toQuery']:
-                            if wirelessReply.strip('-').startswith(q['command']):
-                                self._currentDCR['data']['replies'][q['command']] = {'value': q.get('value', ""),
-                                                                                'reply': wirelessReply[len(q['command']):].strip('-')
-                                                                                }
-                                self.logger.debug("tDCR: Stored reply '{}':{}".format(q['command'], self._currentDCR['data']['replies'][q['command']]))
-                        # and reset the timeout
-                        self.logger.debug("tDCR: Reset timeout to 0")
-                        self._DCRStartTime = time()
-                    else:
-                        # drop it
-                        pass
-                    self.qDCRSerial.task_done()
-
-            # check the timeout
-            if self._currentDCR and ((time() - self._DCRStartTime) > self._DCRCurrentTimeout):
-                # if expired cancel the toQuery in tSerial
-                self.logger.debug("tDCR: DCR timeout expired")
-                self.fTimeoutFail.set()
-
-            # no point checking flags if we are not in the middle of a request
-            if self._currentDCR:
-                # has the serial thread finished getting all the query answers
-                if self.fAnsweredAll.is_set():
-                    # finished toQuery ok
-                    self.logger.debug("tDCR: Serial answered so send out json")
-                    self._DCRReturnDCR("PASS")
-                elif self.fRetryFail.is_set():
-                    # failed due to a message retry issue
-                    self.logger.warn("tDCR: Failed current DCR due to retry count")
-                    self._DCRReturnDCR("FAIL_RETRY")
-                elif self.fTimeoutFail.is_set():
-                    # failed due to expired timeout
-                    self.logger.warn("tDCR: Failed current DCR due to timeout")
-                    while not self.qSerialToQuery.empty():
-                        try:
-                            self.qSerialToQuery.get()
-                            self.logger.debug("tDCR: removed stale query from qSerialToQuery")
-                        except queue.Empty:
+                    self.logger.debug("tBinaryListen: Put {} on qSerialOut".format(serialOut))
+
+        self.logger.info("tBinaryListen: Thread stopping")
+        try:
+            BinaryListenSocket.close()
+        except socket.error:
+            self.logger.exception("tBinaryListen: Failed to close socket")
+        return
+
+    def _SharedRingThread(self):
+        """ Shared ring thread
+            Writes received messages into the shared memory ring, everything
+            waiting on the queue is written before the readers are woken
+        """
+        self.logger.info("tSharedRing: thread started")
+
+        while not self.tSharedRingStop.is_set():
+            try:
+                message = self.qSharedRing.get(timeout=1)     # block for up to 1 seconds
+            except queue.Empty:
+                continue
+
+            networkID = WirelessBinary.WirelessBinary.networkID(self._network)
+            records = []
+            while True:
+                records.append((int(message.received * 1e9), networkID, message.id, message.data))
+                self.qSharedRing.task_done()
+                if len(records) >= self._sharedRing.slots:
+                    # no point writing more than the ring holds in one go
+                    break
+                try:
+                    message = self.qSharedRing.get_nowait()
+                except queue.Empty:
+                    break
+
+            self._sharedRing.write(records)
+            self._mSharedRingRecords.inc(len(records))
+
+        self.logger.info("tSharedRing: Thread stopping")
+        return
+
+    def _StreamThread(self):
+        """ Stream thread
+            Serves newline delimited JSON over TCP and JSON text frames over
+            WebSocket. Each client has its own bounded buffer so a slow one
+            only loses its own messages, requests from clients are handled
+            as if they came in via UDP
+        """
+        self.logger.info("tStream: Stream thread started")
+
+        host = self.config.get('Stream', 'host', fallback="")
+        listeners = {}
+        for (option, default, websocket) in (('port', 50145, False), ('websocket_port', 50146, True)):
+            port = self.config.getint('Stream', option, fallback=default)
+            if port <= 0 or not self.config.getboolean('Stream', 'enabled', fallback=False):
+                continue
+            try:
+                listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                listener.bind((host, port))
+                listener.listen(16)
+                listener.setblocking(0)
+            except socket.error:
+                self.logger.exception("tStream: Failed to listen on port {}, Exiting".format(port))
+                self.die()
+            listeners[listener] = websocket
+            self.logger.info("tStream: listening for {} on port {}".format("WebSocket" if websocket else "TCP", port))
+
+        unixPath = self.config.get('Unix', 'stream_path', fallback="")
+        if unixPath:
+            listener = self._UnixBind(socket.SOCK_STREAM, unixPath)
+            if listener is None:
+                self.logger.critical("tStream: Failed to listen on {}, Exiting".format(unixPath))
+                self.die()
+            listener.listen(16)
+            listener.setblocking(0)
+            listeners[listener] = False
+            self.logger.info("tStream: listening for unix stream clients on {}".format(unixPath))
+
+        wakeup = self._streamWakeupPair[0]
+        while not self.tStreamStop.is_set():
+            clients = list(self._streamClients)
+            writers = [client for client in clients if client.wantsWrite()]
+            try:
+                readable = select.select(list(listeners) + [wakeup] + clients, writers, [], self._UDPListenTimeout)[0]
+            except (select.error, ValueError):
+                self.logger.exception("tStream: select failed")
+                self.tStreamStop.wait(0.1)
+                continue
+
+            for sock in readable:
+                if sock is wakeup:
+                    # drain the wakeup, a single pass handles all of the queued messages
+                    try:
+                        while wakeup.recv(512):
                             pass
+                    except (BlockingIOError, OSError):
+                        pass
+                elif sock in listeners:
+                    self._StreamAccept(sock, listeners[sock])
+                else:
+                    self._StreamRead(sock)
 
-                    self._DCRReturnDCR("FAIL_TIMEOUT")
-
-            # wait a little
-            self.tDCRStop.wait(0.5)
-
-        self.logger.info("tDCR: Thread stopping")
+            while True:
+                try:
+                    message = self.qStreamSend.get_nowait()
+                except queue.Empty:
+                    break
+                self._StreamPublish(message)
+                self.qStreamSend.task_done()
+
+            # write straight away rather than waiting for select to say we can
+            for client in list(self._streamClients):
+                if client.wantsWrite():
+                    sent = client.sent
+                    if not client.flush():
+                        self._StreamClose(client, "send failed")
+                    self._mStreamTx.inc(client.sent - sent)
+
+        self.logger.info("tStream: Thread stopping")
+        for client in list(self._streamClients):
+            self._StreamClose(client, "stopping")
+        for listener in listeners:
+            try:
+                listener.close()
+            except socket.error:
+                self.logger.exception("tStream: Failed to close socket")
+        if unixPath:
+            self._UnixUnlink(unixPath)
         return
 
-    def _DCRReturnDCR(self, state):
-        # prep the reply
-        self._currentDCR['timestamp'] = strftime("%d %b %Y %H:%M:%S +0000", gmtime())
-        self._currentDCR['network'] = self._network
-        self._currentDCR['keepAwake'] = 1 if self.fKeepAwake.is_set() else 0
-        self._currentDCR['data']['state'] = state
+    def _StreamAccept(self, listener, websocket):
+        """ Accept a new stream client
+        """
+        try:
+            (sock, address) = listener.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        except socket.error as msg:
+            self.logger.warn("tStream: Failed to accept. Error code : {} Message: {}".format(msg.errno, msg.strerror))
+            return
 
-        # encode json
-        jsonout = json.dumps(self._currentDCR)
+        maxClients = self.config.getint('Stream', 'max_clients', fallback=16)
+        if len(self._streamClients) >= maxClients:
+            self.logger.warn("tStream: Refused {} as there are already {} clients".format(address, maxClients))
+            sock.close()
+            return
 
-        # send to UDP thread
-        try:
-            self.qUDPSend.put_nowait(jsonout)
-        except queue.Full:
-            self.logger.warn("tDCR: Failed to put {} on qUDPSend as it's full".format(wirelessMsg))
+        sock.setblocking(0)
+        if listener.family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         else:
-            self.logger.debug("tDCR: Sent DCR reply to qUDPSend")
-            # and clear DCR and SentAll flag
-            self._currentDCR = False
-
-    def _UDPSendThread(self):
-        """ UDP Send thread
+            # unix clients rarely bind a path of their own, report the one they connected to
+            address = listener.getsockname()
+        client = StreamClient.StreamClient(sock, address, websocket,
+                                           self.config.getint('Stream', 'send_buffer', fallback=1000),
+                                           self._streamPolicy,
+                                           self._streamFormat,
+                                           WirelessMessage.WirelessMessageBatch.encode,
+                                           self.config.getint('Stream', 'batch_size', fallback=100))
+        self._streamClients.add(client)
+        self.logger.info("tStream: {} client connected from {}".format(client.report()['protocol'], address))
+
+    def _StreamRead(self, client):
+        """ Read and handle the requests waiting from a stream client
         """
-        self.logger.info("tUDPSend: Send thread started")
-        # setup the UDP send socket
         try:
-            UDPSendSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        except socket.error as msg:
-            self.logger.critical("tUDPSend: Failed to create socket, Exiting. Error code : {} Message : {} ".format(msg[0], msg[1]))
-            self.die()
-
-        UDPSendSocket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        UDPSendSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            messages = client.read()
+        except ValueError as error:
+            self._StreamClose(client, error)
+            return
+        if messages is None:
+            self._StreamClose(client, "closed by the client")
+            return
+        if not messages:
+            return
 
-        sendPort = int(self.config.get('UDP', 'send_port'))
+        self._mStreamRx.inc(len(messages))
+        batch = [(data, client.address) for data in messages]
+        for (reply, address) in self._UDPProcessBatch(batch, lambda jsonin, address: self._StreamSubscribe(client, jsonin)):
+            client.queue(reply)
 
-        while (not self.tUDPSendStop.is_set()):
+    def _StreamSubscribe(self, client, jsonin):
+        """ Set the filters and format of a stream client, the subscription
+            lasts as long as the connection so there is no ttl
+            Returns (reply, address)
+        """
+        data = jsonin.get('data', {})
+        if not isinstance(data, dict):
+            data = {}
+        try:
+            client.subscribe(data.get('filter', {}), data.get('format'))
+        except (ValueError, TypeError, AttributeError) as error:
+            self.logger.warn("tStream: Rejected subscription from {}: {}".format(client.address, error))
+            state = "Rejected"
+            data['error'] = str(error)
+        else:
+            self.logger.info("tStream: Subscribed {}".format(client.address))
+            state = "Subscribed"
+            data['format'] = client.format
+
+        reply = {'type': "Subscribe",
+                 'network': self._network,
+                 'timestamp': strftime("%d %b %Y %H:%M:%S +0000", gmtime()),
+                 'state': state,
+                 'data': data
+                 }
+        return (json.dumps(reply).encode(), client.address)
+
+    def _StreamPublish(self, message):
+        """ Queue a WirelessMessage record or encoded reply for every stream
+            client whose filters match it
+        """
+        if not self._streamClients:
+            return
+        if isinstance(message, WirelessMessage.WirelessMessage):
+            (type, network, key) = ("WirelessMessage", message.network, message.id)
+        else:
             try:
-                message = self.qUDPSend.get(timeout=1)     # block for up to 1 seconds
-            except queue.Empty:
-                # UDP Send queue was empty
-                # extrem debug message
-                # self.logger.debug("tUDPSend: queue is empty")
-                pass
-            else:
-                self.logger.debug("tUDPSend: Got json to send: {}".format(message))
-                if self.config.getboolean('UDP', 'use_local_only'):
-                    try:
-                        UDPSendSocket.sendto(message.encode(), ('127.0.0.255', sendPort))
-                        self.logger.debug("tUDPSend: Put message out via UDP to local only")
-                    except socket.error as msg:
-                        self.logger.warn("tUDPSend: Failed to send via UDP local only. Error code : {} Message: {}".format(msg[0], msg[1]))
-                else:
-                    try:
-                        UDPSendSocket.sendto(message.encode(), ('<broadcast>', sendPort))
-                        self.logger.debug("tUDPSend: Put message out via UDP")
-                    except socket.error as msg:
-                        if msg[0] == 101:
-                            try:
-                                self.logger.warn("tUDPSend: External network unreachable retrying on local interface only")
-                                UDPSendSocket.sendto(message.encode(), ('127.0.0.255', sendPort))
-                                self.logger.debug("tUDPSend: Put message out via UDP to local only")
-                            except socket.error as msg:
-                                self.logger.warn("tUDPSend: Failed to send via UDP local only. Error code : {} Message: {}".format(msg[0], msg[1]))
-                        else:
-                            self.logger.warn("tUDPSend: Failed to send via UDP. Error code : {} Message: {}".format(msg[0], msg[1]))
-                # tidy up
-                self.qUDPSend.task_done()
-
-        self.logger.info("tUDPSend: Thread stopping")
+                jsonout = json.loads(message)
+            except ValueError:
+                return
+            (type, network, key) = (jsonout.get('type'), jsonout.get('network'), None)
+
+        for client in list(self._streamClients):
+            if not client.matches(type, network, key):
+                continue
+            dropped = client.dropped + client.coalesced
+            if not client.queue(message, key):
+                self._mStreamDisconnects.inc()
+                self._StreamClose(client, "too slow with {} messages waiting".format(len(client)))
+            elif client.dropped + client.coalesced != dropped:
+                self._mStreamDropped.inc()
+
+    def _StreamClose(self, client, reason):
+        self.logger.info("tStream: Closing {}, {}".format(client.address, reason))
+        client.close()
+        self._streamClients.discard(client)
+
+    def _StreamWakeup(self):
+        """ Let the stream thread know it has messages to send
+        """
         try:
-            UDPSendSocket.close()
-        except socket.error:
-            self.logger.exception("tUDPSend: Failed to close socket")
-        return
+            self._streamWakeupPair[1].send(b'.')
+        except (BlockingIOError, OSError):
+            # buffer is full so a wakeup is already pending
+            pass
 
     def _SerialThread(self):
         """ Serial Thread
         """
         self.logger.info("tSerial: Serial thread started")
-        self._SerialToQueryState = 0
-        self._SerialToQuery = []
+        self._SerialDCRPending = []     # requests waiting for a CONFIGME device
+        self._SerialDCRActive = None    # request being asked of the current CONFIGME device
+        self._SerialDTYWait = False     # waiting on a DTY reply to pick or confirm a request
         self.tSerialStop.wait(1)
         checkEncKeyCounter = 0
 
         try:
             while (not self.tSerialStop.is_set()):
-                # open the port
-                try:
-                    self._serial.open()
-                    self.logger.info("tSerial: Opened the serial port")
-                except serial.SerialException:
-                    self.logger.exception("tSerial: Failed to open port {} Exiting".format(self._serial.port))
-                    self._serial.close()
-                    self.die()
-
-                self.tSerialStop.wait(0.1)
-
-                # we clear out any stale serial messages that might be in the buffer
-                self._serial.flushInput()
-
-                # check the ATLH settings
-                retries = 0
-                while not self._SerialCheckATLH():
-                    retries += 1
-                    self.logger.error("tSerial: Retrying Check ATLH attempt: {}".format(retries))
-                    if retries == self._ATLHRetriesCount:
-                        self.logger.critical("tSerial: Error on Check ATLH")
-                        self.die()
+                self._SerialOpen()
 
                 # main serial processing loop
                 while self._serial.isOpen() and not self.tSerialStop.is_set():
@@ -1023,27 +2467,22 @@ is running then run in the current terminal
                         self.logger.debug("tSerial: fSetRadioEncryption set")
                         self.fRadioEncryptionDone.clear()
                         self.SetRadioEncryption()
+                        self._framer.reset()
                         self.fRadioEncryptionDone.set() #informs the main thread that has some encryption result to send
 
-                    # do we have anything to send
-                    if not self.qSerialOut.empty():
-                        self.logger.debug("tSerial: got something to send")
-                        try:
-                            wirelessMsg = self.qSerialOut.get_nowait()
-                            self._serial.write(wirelessMsg.encode())
-                        except queue.Empty:
-                            self.logger.debug("tSerial: failed to get item from queue")
-                        except Serial.SerialException as e:
-                            self.logger.warn("tSerial: failed to write to the serial port {}: {}".format(self._serial.port, e))
-                        else:
-                             self.logger.debug("tSerial: TX:{}".format(wirelessMsg))
-                             self.qSerialOut.task_done()
+                    # pick up new DCRs so qSerialToQuery never stays full waiting for a ?? message
+                    self._SerialUpdateDCRPending()
 
-                    # sleep for a little
-                    if self._SerialToQueryState or self._serial.inWaiting():
-                        self.tSerialStop.wait(0.01)
-                    else:
-                        self.tSerialStop.wait(0.1)
+                    # do we have anything to send, one wakeup can cover several queued messages
+                    self._SerialSendQueued()
+
+                    # a partial message that has stopped arriving is dropped as the old reader timed out on it
+                    if self._framer.expire(self._serialTimeout):
+                        self._mSerialRxRejects.inc()
+                        self.logger.debug("tSerial: Dropped partial message after timeout")
+
+                    # wait for the port or new work
+                    self._SerialWait()
 
                 # port closed for some reason (or tSerialStop), if tSerialStop is not set we will try reopening
         except IOError:
@@ -1056,6 +2495,136 @@ is running then run in the current terminal
         self.logger.info("tSerial: Thread stoping")
         return
 
+    def _SerialOpen(self):
+        """ Open the port, clear out anything stale and check the ATLH setting
+        """
+        try:
+            self._serial.open()
+            self.logger.info("tSerial: Opened the serial port")
+        except serial.SerialException:
+            self.logger.exception("tSerial: Failed to open port {} Exiting".format(self._serial.port))
+            self._serial.close()
+            self.die()
+
+        self.tSerialStop.wait(0.1)
+
+        # we clear out any stale serial messages that might be in the buffer
+        self._serial.flushInput()
+        self._framer = LLAPFramer.LLAPFramer(self._validID, self._validData)
+        self._serialReadBuffer = bytearray(self._serialReadSize)
+
+        # check the ATLH settings
+        retries = 0
+        while not self._SerialCheckATLH():
+            retries += 1
+            self.logger.error("tSerial: Retrying Check ATLH attempt: {}".format(retries))
+            if retries == self._ATLHRetriesCount:
+                self.logger.critical("tSerial: Error on Check ATLH")
+                self.die()
+
+    def _SerialSendQueued(self):
+        """ Move everything waiting on qSerialOut into the TX scheduler, which
+            holds the backlog and counts any it has to drop, and write what
+            the scheduler will let go now
+            Returns the seconds until it will let the next one go, None if
+            nothing is waiting
+        """
+        while True:
+            try:
+                wirelessMsg = self.qSerialOut.get_nowait()
+            except queue.Empty:
+                break
+            self.logger.debug("tSerial: got something to send")
+            if not self._txScheduler.add(wirelessMsg, TXScheduler.TXScheduler.Command):
+                self.logger.warn("tSerial: Dropped {} as the TX scheduler is full".format(wirelessMsg))
+            self.qSerialOut.task_done()
+        return self._SerialTransmit()
+
+    def _SerialQueueTX(self, wirelessMsg, priority):
+        """ Send a DCR or keepAwake message, ahead of any waiting commands
+            Returns False if the scheduler dropped it
+        """
+        if not self._txScheduler.add(wirelessMsg, priority):
+            self.logger.warn("tSerial: Dropped {} as the TX scheduler is full".format(wirelessMsg))
+            return False
+        self._SerialTransmit()
+        return True
+
+    def _SerialTransmit(self):
+        """ Write the messages the TX scheduler will let go now
+            Returns the seconds until it will let the next one go, None if
+            nothing is waiting
+        """
+        while True:
+            ready = self._txScheduler.next()
+            if ready is None:
+                break
+            wirelessMsg = ready[0]
+            try:
+                self._serial.write(wirelessMsg.encode())
+            except serial.SerialException as e:
+                self.logger.warn("tSerial: failed to write to the serial port {}: {}".format(self._serial.port, e))
+            else:
+                self.logger.debug("tSerial: TX:{}".format(wirelessMsg))
+                self._mSerialTxFrames.inc()
+        delay = self._txScheduler.delay()
+        if delay is not None and self._asyncLoop is not None:
+            self._AsyncTimer('serialTX', delay, self._AsyncSerialWork)
+        return delay
+
+    def _SerialWait(self):
+        """ Block until the serial port has data, another thread has signalled
+            work for us via _SerialWakeup or we need to time out a partial message
+        """
+        if self.tSerialStop.is_set() or self._serial.inWaiting():
+            return
+
+        if self._framer.pending():
+            timeout = self._serialTimeout
+        else:
+            timeout = self._serialSelectTimeout
+        # wake up when the TX scheduler will let the next message go
+        delay = self._txScheduler.delay()
+        if delay is not None:
+            timeout = min(timeout, delay)
+
+        if self._serialWakeupPipe is None:
+            # no select() on a serial port under windows so fall back to polling
+            if self._SerialDCRActive:
+                self.tSerialStop.wait(0.01)
+            else:
+                self.tSerialStop.wait(0.1)
+            return
+
+        try:
+            readable = select.select([self._serial.fileno(), self._serialWakeupPipe[0]], [], [], timeout)[0]
+        except (select.error, ValueError):
+            self.logger.exception("tSerial: select on serial port failed")
+            self.tSerialStop.wait(0.1)
+            return
+
+        if self._serialWakeupPipe[0] in readable:
+            # drain the pipe, a single pass handles all of the signalled work
+            try:
+                while os.read(self._serialWakeupPipe[0], 512):
+                    pass
+            except (BlockingIOError, OSError):
+                pass
+
+    def _SerialWakeup(self):
+        """ Let the serial thread know it has work to do
+        """
+        if self._asyncLoop is not None:
+            self._AsyncSchedule(self._AsyncSerialWork)
+            return
+        if self._serialWakeupPipe is None:
+            return
+        try:
+            os.write(self._serialWakeupPipe[1], b'.')
+        except (BlockingIOError, OSError):
+            # pipe is full so a wakeup is already pending
+            pass
+
     def SetRadioEncryption(self):
         self.logger.info("tSerial: SetRadioEncryption: Checking Serial Number of the radio")
         self.fSetRadioEncryption.clear()
@@ -1225,208 +2794,248 @@ is running then run in the current terminal
 
 
     def _SerialReadIncomingLanguageOfThings(self):
-        char = self._serial.read().decode()  # should not time out but we should check anyway
-        self.logger.debug("tSerial: RX:{}".format(char))
-
-        if char == 'a':
-            # this should be the start of a Language of Things message
-            # read 11 more or time out
-            wirelessMsg = "a"
-            count = 0
-            while count < 11:
-                char = self._serial.read().decode()
-                if not char:
-                    self.logger.debug("tSerial: RX:{}".format(char))
-                    return
+        """ Drain the waiting bytes from the serial port and process any
+            complete Language of Things messages they finish
+        """
+        waiting = min(self._serial.inWaiting(), self._serialReadSize)
+        if not waiting:
+            return
+        view = memoryview(self._serialReadBuffer)
+        count = self._serial.readinto(view[:waiting])
+        if not count:
+            return
+        self._mSerialRxBytes.inc(count)
 
-                if char == 'a':
-                    # start again and
-                    count = 0
-                    wirelessMsg = "a"
-                    self.logger.debug("tSerial: RX:{}".format(char))
-                elif (count == 0 or count == 1) and char in self._validID:
-                    # we have a valid ID
-                    wirelessMsg += char
-                    count += 1
-                elif count >= 2 and char in self._validData:
-                    # we have a valid data
-                    wirelessMsg += char
-                    count +=1
-                else:
-                    self.logger.debug("tSerial: RX:{}".format(wirelessMsg[1:] + char))
-                    return
+        rejected = self._framer.rejected
+        frames = self._framer.feed(view[:count])
+        self._mSerialRxRejects.inc(self._framer.rejected - rejected)
+        self._mSerialRxFrames.inc(len(frames))
+        for wirelessMsg in frames:
+            self._SerialProcessLanguageOfThings(wirelessMsg)
 
-            self.logger.debug("tSerial: RX:{}".format(wirelessMsg[1:]))
+    def _SerialProcessLanguageOfThings(self, wirelessMsg):
+        """ Process a single complete 12 character Language of Things message
+        """
+        self.logger.debug("tSerial: RX:{}".format(wirelessMsg[1:]))
 
-            if len(wirelessMsg) == 12:  # just double check length
-                if wirelessMsg[1:3] == "??":
-                    self._SerialProcessQQ(wirelessMsg[3:].strip("-"))
-                else:
-                    #now will check if there's any message to be sent on the "sendOn" queue
-                    if wirelessMsg[1:3] in self._sendOnIDs:
-                        self.sendOnForMatchedID(wirelessMsg[1:3], wirelessMsg[3:].strip("-"))
-                    # not a configme Language of Things message so send out via UDP WirelessMessage
-                    try:
-                        self.qUDPSend.put_nowait(self.encodeWirelessMessageJson(wirelessMsg, self._network))
-                    except queue.Full:
-                        self.logger.warn("tSerial: Failed to put {} on qUDPSend as it's full".format(wirelessMsg))
+        if wirelessMsg[1:3] == "??":
+            self._SerialProcessQQ(wirelessMsg[3:].strip("-"))
+        elif self._deduplicator.seen(wirelessMsg[1:3], wirelessMsg[3:]):
+            self.logger.debug("tSerial: Dropped duplicate {}".format(wirelessMsg[1:]))
+            self._mSerialRxDuplicates.inc()
+        else:
+            #now will check if there's any message waiting in the mailbox for this device
+            self.sendOnForMatchedID(wirelessMsg[1:3], wirelessMsg[3:].strip("-"))
+            # not a configme Language of Things message so send out via UDP WirelessMessage
+            # encoded once and the same record is shared by every output
+            message = self.encodeWirelessMessageJson(wirelessMsg, self._network)
+            try:
+                self.qUDPSend.put_nowait(message)
+            except queue.Full:
+                self.logger.warn("tSerial: Failed to put {} on qUDPSend as it's full".format(wirelessMsg))
 
-                    if self.config.getboolean('MQTT', 'enabled'):
-                        try:
-                            self.qMQTTSend.put_nowait(self.encodeWirelessMessageJson(wirelessMsg, self._network))
-                        except queue.Full:
-                            self.logger.warn("tSerial: Failed to put {} on qMQTTSend as it's full".format(wirelessMsg))
+            if self._mqttEnabled:
+                try:
+                    self.qMQTTSend.put_nowait(message)
+                except queue.Full:
+                    self.logger.warn("tSerial: Failed to put {} on qMQTTSend as it's full".format(wirelessMsg))
+
+            if self._binaryEnabled:
+                try:
+                    self.qBinarySend.put_nowait(message)
+                except queue.Full:
+                    self.logger.warn("tSerial: Failed to put {} on qBinarySend as it's full".format(wirelessMsg))
+
+            if self._streamEnabled:
+                try:
+                    self.qStreamSend.put_nowait(message)
+                except queue.Full:
+                    self.logger.warn("tSerial: Failed to put {} on qStreamSend as it's full".format(wirelessMsg))
+
+            if self._sharedRingEnabled:
+                try:
+                    self.qSharedRing.put_nowait(message)
+                except queue.Full:
+                    self.logger.warn("tSerial: Failed to put {} on qSharedRing as it's full".format(wirelessMsg))
 
     def _SerialProcessQQ(self, wirelessMsg):
         """ process an incoming ?? Language of Things message
+
+            Only one device can talk to us as ?? at a time so DCRs are
+            worked on one device at a time, but any waiting request that
+            matches the device's DTY can be picked rather than only the oldest
         """
-        # has the timeout expired
-        if not self.fTimeoutFail.is_set():
-            if self._SerialToQueryState:
-                # was it a reply to our DTY test
-                if self.devType and (not self._SerialDTYSync):
-                    # we should have a reply to DTY
-                    if wirelessMsg.startswith("DTY"):
-                        if wirelessMsg[3:] == self.devType:
-                            self._SerialDTYSync = True
-                            self.logger.debug("tSerial: Confirmed DTY, Send next toQuery, State: {}".format(self._SerialToQueryState))
-                            if not self._SerialSendDCRQuery():
-                                # failed to send question (serial or retry error)
-                                if self.fRetryFail.is_set():
-                                    # was a retry fail
-                                    # stop processing toQuery
-                                    self._SerialToQueryState = 0
-                            return
-
-                # check reply was to the last question
-                if wirelessMsg.startswith(self._SerialToQuery[self._SerialToQueryState-1]['command']) or (self._encryptionCommandMatch.match(self._SerialToQuery[self._SerialToQueryState-1]['command']) and wirelessMsg == "ENACK"):
-
-                    # special case for encryption
-                    if self._encryptionCommandMatch.match(self._SerialToQuery[self._SerialToQueryState-1]['command']):
-                        wirelessMsg = self._SerialToQuery[self._SerialToQueryState-1]['command'] + wirelessMsg
-
-                    # reduce the state count and reset retry count
-                    self._SerialToQueryState -= 1
-                    self._SerialRetryCount = 0
-
-                    # store the reply
-                    try:
-                        self.qDCRSerial.put_nowait(wirelessMsg)
-                    except queue.Full:
-                        self.logger.warn("tSerial: Failed to put {} on qDCRSerial as it's full".format(wirelessMsg))
-
-                    # if we have replies for all state == 0:
-                    if self._SerialToQueryState == 0:
-                        # sent and received all
-                        self.fAnsweredAll.set()
-                        self.logger.debug("tSerial: Go answers for all toQuery")
-                    # else we have a another query to send
-                    else:
-                        # send next
-                        self.logger.debug("tSerial: Send next toQuery, State: {}".format(self._SerialToQueryState))
-                        if not self._SerialSendDCRQuery():
-                            # failed to send question (serial error)
-                            pass
-                # else if was not our answer so send it again
-                elif wirelessMsg == "CONFIGME":
-                    if self.devType:
-                        # out of sync should we recheck DTY?
-                        self._SerialDTYSync = False
-                        self.logger.debug("tSerial: Checking DTY again before sending next toQuery")
-                        self._SerialSendDTY()
-                        return
-                    else:
-                        # send last again
-                        self.logger.debug("tSerial: Retry toQuery, State: {}".format(self._SerialToQueryState))
-                        if not self._SerialSendDCRQuery():
-                            # failed to send question (serial or retry error)
-                            if self.fRetryFail.is_set():
-                                # was a retry fail
-                                # stop processing toQuery
-                                self._SerialToQueryState = 0
-                                return
+        self._SerialUpdateDCRPending()
+
+        if self._SerialDTYWait and wirelessMsg.startswith("DTY"):
+            # reply to our DTY test
+            self._SerialDTYWait = False
+            devType = wirelessMsg[3:]
+            if self._SerialDCRActive:
+                if self._SerialDCRActive.devType == devType:
+                    self.logger.debug("tSerial: Confirmed DTY, Send next toQuery for {}".format(self._SerialDCRActive))
+                    self._SerialSendDCRQuery()
+                return
+            for request in self._SerialDCRPending:
+                if request.matchesDevType(devType):
+                    self._SerialDCRPending.remove(request)
+                    self._SerialStartDCR(request)
+                    return
+            self.logger.debug("tSerial: No waiting DCR for devType {}".format(devType))
+            return
 
+        if self._SerialDCRActive:
+            request = self._SerialDCRActive
+            command = request.current()['command']
+            # check reply was to the last question
+            if wirelessMsg.startswith(command) or (self._encryptionCommandMatch.match(command) and wirelessMsg == "ENACK"):
+
+                # special case for encryption
+                if self._encryptionCommandMatch.match(command):
+                    wirelessMsg = command + wirelessMsg
+
+                # move on and reset retry count
+                request.position += 1
+                request.retryCount = 0
+
+                # store the reply
+                self._SerialPutDCRSerial(request, "reply", wirelessMsg)
+
+                # if we have replies for all
+                if request.finished():
+                    # sent and received all
+                    self._SerialDCRActive = None
+                    self._SerialPutDCRSerial(request, "answeredAll")
+                    self.logger.debug("tSerial: Go answers for all toQuery for {}".format(request))
+                # else we have a another query to send
+                else:
+                    # send next
+                    self.logger.debug("tSerial: Send next toQuery, State: {}".format(request.position))
+                    self._SerialSendDCRQuery()
+            # else if was not our answer so send it again
             elif wirelessMsg == "CONFIGME":
-                # do we have a waiting query and can we send one
-                try:
-                    self._SerialToQuery = self.qSerialToQuery.get_nowait()
-                except queue.Empty:
-                    pass
+                if request.devType:
+                    # out of sync should we recheck DTY?
+                    self.logger.debug("tSerial: Checking DTY again before sending next toQuery")
+                    self._SerialSendDTY()
+                    return
                 else:
-                    self._SerialToQuery.reverse()
-                    self._SerialToQueryState = len(self._SerialToQuery)
-                    self.fAnsweredAll.clear()
-                    self.fRetryFail.clear()
-                    # clear retry count
-                    self._SerialRetryCount = 0
-                    # new query should we check DTY
-                    if self.devType:
-                        self.logger.debug("tSerial: Checking DTY before sending first toQuery")
-                        self._SerialSendDTY()
+                    # send last again
+                    self.logger.debug("tSerial: Retry toQuery, State: {}".format(request.position))
+                    if not self._SerialSendDCRQuery():
                         return
-                    else:
-                        # send first
-                        self.logger.debug("tSerial: Send first toQuery, State: {}".format(self._SerialToQueryState))
-                        if not self._SerialSendDCRQuery():
-                            # failed to send question (serial or retry error)
-                            pass
-        elif self._SerialToQueryState:
-            # yes the time out expired, clear down any current toQuery
-            self.logger.debug("tSerial: toQuery Timed out")
-            self._SerialToQueryState = 0
 
+        elif wirelessMsg == "CONFIGME" and self._SerialDCRPending:
+            # do we have a waiting query and can we send one
+            if any(request.devType for request in self._SerialDCRPending):
+                # new query, check DTY to pick which request this device is for
+                self.logger.debug("tSerial: Checking DTY before sending first toQuery")
+                self._SerialSendDTY()
+                return
+            else:
+                # send first
+                self._SerialStartDCR(self._SerialDCRPending.pop(0))
 
         # only thing left now would be a CONFIGME so do we need to send a keepAwake
         if wirelessMsg == "CONFIGME" and self.fKeepAwake.is_set():
+            self._SerialQueueTX("a??HELLO----", TXScheduler.TXScheduler.KeepAwake)
+            return
+
+    def _SerialUpdateDCRPending(self):
+        """ Pick up new requests from qSerialToQuery and drop any the DCR
+            thread has finished with (timed out or replaced)
+        """
+        taken = 0
+        while True:
             try:
-                self._serial.write("a??HELLO----".encode())
-            except Serial.SerialException as e:
-                self.logger.warn("tSerial: failed to write to the serial port {}: {}".format(self._serial.port, e))
+                self._SerialDCRPending.append(self.qSerialToQuery.get_nowait())
+            except queue.Empty:
+                break
             else:
-                self.logger.debug("tSerial: TX:a??HELLO-----")
-            return
+                taken += 1
+                self.qSerialToQuery.task_done()
+        if taken and self.qSerialToQuery.maxsize:
+            # there is room again for requests the DCR thread is holding
+            self._DCRNotify()
+
+        if any(request.cancelled for request in self._SerialDCRPending):
+            self._SerialDCRPending = [request for request in self._SerialDCRPending if not request.cancelled]
+
+        if self._SerialDCRActive and self._SerialDCRActive.cancelled:
+            # yes the time out expired, clear down the current toQuery
+            self.logger.debug("tSerial: toQuery Timed out for {}".format(self._SerialDCRActive))
+            self._SerialDCRActive = None
+            self._SerialDTYWait = False
+
+    def _SerialStartDCR(self, request):
+        """ Start asking the current CONFIGME device the toQuery of request
+        """
+        self._SerialDCRActive = request
+        request.position = 0
+        # clear retry count
+        request.retryCount = 0
+        self.logger.debug("tSerial: Send first toQuery for {}".format(request))
+        self._SerialSendDCRQuery()
+
+    def _SerialPutDCRSerial(self, request, event, wirelessMsg=None):
+        """ Pass a reply or result for request back to the DCR thread
+        """
+        try:
+            self.qDCRSerial.put_nowait((request.key, event, wirelessMsg))
+        except queue.Full:
+            self.logger.warn("tSerial: Failed to put {} {} on qDCRSerial as it's full".format(event, wirelessMsg))
 
     def _SerialSendDCRQuery(self):
         """ send out the next query in the current DCR
         """
+        request = self._SerialDCRActive
         # check retry count before sending
-        if self._SerialRetryCount < int(self.config.get('DCR', 'single_query_retry_count')):
-            wirelessToSend = "a??{}{}".format(self._SerialToQuery[self._SerialToQueryState-1]['command'],
-                                           self._SerialToQuery[self._SerialToQueryState-1].get('value', "")
+        if request.retryCount < int(self.config.get('DCR', 'single_query_retry_count')):
+            wirelessToSend = "a??{}{}".format(request.current()['command'],
+                                           request.current().get('value', "")
                                            )
             while len(wirelessToSend) < 12:
                 wirelessToSend += "-"
-            try:
-                self._serial.write(wirelessToSend.encode())
-            except Serial.SerialException as e:
-                self.logger.warn("tSerial: failed to write to the serial port {}: {}".format(self._serial.port, e))
+            if not self._SerialQueueTX(wirelessToSend, TXScheduler.TXScheduler.DCR):
                 return False
-            else:
-                self.logger.debug("tSerial: TX:{}".format(wirelessToSend))
-                self._SerialRetryCount += 1
-                return True
+            request.retryCount += 1
+            return True
         self.logger.debug("tSerial: toQuery failed on retry count, letting tDCR know")
-        self.fRetryFail.set()
+        # stop processing toQuery
+        self._SerialDCRActive = None
+        self._SerialPutDCRSerial(request, "retryFail")
         return False
 
     def _SerialSendDTY(self):
         """ Ask a Language of Things device it devType
         """
-        try:
-          self._serial.write("a??DTY------".encode())
-        except Serial.SerialException as e:
-          self.logger.warn("tSerial: failed to write to the serial port {}: {}".format(self._serial.port, e))
-          return False
-        else:
-          self.logger.debug("tSerial: TX:a??DTY------")
-          self._SerialDTYSync = False
-          return True
+        if not self._SerialQueueTX("a??DTY------", TXScheduler.TXScheduler.DCR):
+            return False
+        self._SerialDTYWait = True
+        return True
 
     def _UDPListenThread(self):
         """ UDP Listen Thread
         """
         self.logger.info("tUDPListen: UDP listen thread started")
 
+        listenSockets = self._UDPOpenListenSockets()
+        buffer = bytearray(self._UDPListenBufferSize)
+
+        self.logger.info("tUDPListen: listening")
+        while not self.tUDPListenStop.is_set():
+            datawaiting = select.select(list(listenSockets), [], [], self._UDPListenTimeout)
+            for sock in datawaiting[0]:
+                self._UDPListenRead(sock, buffer, listenSockets[sock])
+
+        self.logger.info("tUDPListen: Thread stopping")
+        self._UDPCloseListenSockets(listenSockets)
+        return
+
+    def _UDPOpenListenSockets(self):
+        """ Bind the UDP listen socket and the unix datagram one if set
+            Returns a dict of socket: rx counter
+        """
         try:
             UDPListenSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         except socket.error:
@@ -1438,119 +3047,315 @@ is running then run in the current terminal
         if (self.args.debug) and sys.platform == 'darwin':
             UDPListenSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
+        receiveBufferSize = self.config.getint('UDP', 'receive_buffer_size', fallback=262144)
+        if receiveBufferSize > 0:
+            try:
+                UDPListenSocket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receiveBufferSize)
+            except socket.error:
+                self.logger.warn("tUDPListen: Failed to set the receive buffer size to {}".format(receiveBufferSize))
+
         try:
             UDPListenSocket.bind(("", int(self.config.get('UDP', 'listen_port'))))
         except socket.error:
             self.logger.exception("tUDPListen: Failed to bind port, Exiting")
             self.die()
+        self._UDPJoinMulticast(UDPListenSocket)
 
         UDPListenSocket.setblocking(0)
+        listenSockets = {UDPListenSocket: self._mUDPRx}
+
+        # same host clients can use a unix datagram socket instead
+        unixPath = self.config.get('Unix', 'datagram_path', fallback="")
+        if unixPath:
+            UnixListenSocket = self._UnixBind(socket.SOCK_DGRAM, unixPath)
+            if UnixListenSocket is not None:
+                UnixListenSocket.setblocking(0)
+                listenSockets[UnixListenSocket] = self._mUnixRx
+                self.logger.info("tUDPListen: listening on {}".format(unixPath))
+        return listenSockets
+
+    def _UDPCloseListenSockets(self, listenSockets):
+        for sock in listenSockets:
+            try:
+                sock.close()
+            except socket.error:
+                self.logger.exception("tUDPListen: Failed to close socket")
+        if len(listenSockets) > 1:
+            self._UnixUnlink(self.config.get('Unix', 'datagram_path', fallback=""))
+
+    def _UDPListenRead(self, sock, buffer, counter):
+        """ Read and handle everything waiting on a listen socket and send
+            back any replies
+        """
+        for (reply, address) in self._UDPProcessBatch(self._UDPReadBatch(sock, buffer, counter)):
+            if not address:
+                # unix datagram client that has not bound a path, nowhere to reply to
+                continue
+            try:
+                sock.sendto(reply, address)
+            except socket.error as msg:
+                self.logger.debug("tUDPListen: Failed to reply to {}. Error code : {} Message: {}".format(address, msg.errno, msg.strerror))
+
+    def _UnixBind(self, kind, path):
+        """ Create an AF_UNIX socket of kind bound to path, replacing a stale
+            socket file left behind and applying the [Unix] mode and group
+            Returns the socket or None if it could not be setup
+        """
+        if not hasattr(socket, 'AF_UNIX'):
+            self.logger.error("Unix domain sockets are not supported on this platform, not listening on {}".format(path))
+            return None
+        try:
+            if stat.S_ISSOCK(os.stat(path).st_mode):
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            self.logger.exception("Failed to remove old socket {}".format(path))
+        try:
+            sock = socket.socket(socket.AF_UNIX, kind)
+            sock.bind(path)
+        except (socket.error, OSError):
+            self.logger.exception("Failed to bind {}".format(path))
+            return None
+        try:
+            os.chmod(path, int(self.config.get('Unix', 'mode', fallback="660"), 8))
+            group = self.config.get('Unix', 'group', fallback="")
+            if group:
+                os.chown(path, -1, grp.getgrnam(group).gr_gid)
+        except (OSError, ValueError, KeyError):
+            self.logger.exception("Failed to set the permissions on {}".format(path))
+        return sock
+
+    def _UnixUnlink(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
 
-        self.logger.info("tUDPListen: listening")
-        while not self.tUDPListenStop.is_set():
-            datawaiting = select.select([UDPListenSocket], [], [], self._UDPListenTimeout)
-            if datawaiting[0]:
-                (data, address) = UDPListenSocket.recvfrom(8192)
-                self.logger.debug("tUDPListen: Received JSON: {} From: {}".format(data.decode(), address))
-
-                # Test its actually json/catch errors
-                try :
-                    jsonin = json.loads(data.decode())
-                except ValueError:
-                    self.logger.debug("tUDPListen: Invalid JSON received")
-                    continue
-
-                # error checking, dict should have keys for network, ignore it if not there
-                if 'network' in jsonin:
-                    if (jsonin['network'] == self._network or
-                        jsonin['network'] == "ALL"):
-                        # yep its for our network or "ALL"
-                        # error checking, dict should have keys for type
-                        if 'type' in jsonin:
-                            if jsonin['type'] == "WirelessMessage":
-                                self.logger.debug("tUDPListen: JSON of type WirelessMessage, send out messages")
-                                # got a WirelessMessage type json, need to generate the Language of Things message and
-                                # put them on the TX queue
-                                # error checking, dict should have keys for sendon and data
-                                if 'sendOn' in jsonin:
-                                    self.processSendOnJSON(jsonin)
-                                    continue
-                                
-                                if 'data' in jsonin:
-                                    for command in jsonin['data']:
-                                        wirelessMsg = "a{}{}".format(jsonin['id'], command[0:9].upper())
-                                        while len(wirelessMsg) <12:
-                                            wirelessMsg += '-'
-                                        try:
-                                            self.qSerialOut.put_nowait(wirelessMsg)
-                                        except queue.Full:
-                                            self.logger.debug("tUDPListen: Failed to put {} on qDCRSerial as it's full".format(wirelessMsg))
-                                        else:
-                                            self.logger.debug("tUDPListen: Put {} on qSerialOut".format(wirelessMsg))
-
-                            elif jsonin['type'] == "DeviceConfigurationRequest" and self.config.getboolean('DCR', 'dcr_enable'):
-                                # we have a DeviceConfigurationRequest pass in onto the DCR thread
-                                # TODO: error checking, dict should have keys for data
-                                self.logger.debug("tUDPListen: JSON of type DeviceConfigurationRequest, passing to qDCRRequest")
-                                try:
-                                    self.qDCRRequest.put_nowait(jsonin)
-                                except queue.Full:
-                                    self.logger.debug("tUDPListen: Failed to put json on qDCRRequest")
-
-                            elif jsonin['type'] == "MessageBridge":
-                                # we have a MessageBridge json do stuff with it
-                                self.logger.debug("tUDPListen: JSON of type MessageBridge, passing to qMessageBridge")
-                                try:
-                                    self.qMessageBridge.put(jsonin)
-                                except queue.Full():
-                                    self.logger.debug("tUDPListen: Failed to put json on qMessageBridge")
-
-        self.logger.info("tUDPListen: Thread stopping")
+    def _UDPReadBatch(self, UDPListenSocket, buffer, counter=None):
+        """ Read every datagram waiting on the socket (up to _UDPListenBatchMax)
+            into the reusable buffer, counted on counter (default udp_rx_datagrams)
+            Returns a list of (data, address)
+        """
+        batch = []
+        view = memoryview(buffer)
+        while len(batch) < self._UDPListenBatchMax:
+            try:
+                (size, address) = UDPListenSocket.recvfrom_into(buffer)
+            except (BlockingIOError, InterruptedError):
+                break
+            except socket.error as msg:
+                self.logger.warn("tUDPListen: Failed to read from socket. Error code : {} Message: {}".format(msg.errno, msg.strerror))
+                break
+            batch.append((view[:size].tobytes(), address))
+        (counter or self._mUDPRx).inc(len(batch))
+        return batch
+
+    def _UDPProcessBatch(self, batch, subscribe=None):
+        """ Parse a batch of received JSON and hand it on, Language of Things
+            messages and DCRs are put on their queues in one go
+            Also used for requests from stream clients, subscribe is called
+            with (jsonin, address) for a Subscribe instead of _processSubscribe
+            Returns a list of (reply, address) to send straight back
+        """
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        serialOut = []
+        DCRRequests = []
+        replies = []
+        for (data, address) in batch:
+            # Test its actually json/catch errors
+            try :
+                jsonin = json.loads(data)
+            except ValueError:
+                self.logger.debug("tUDPListen: Invalid JSON received")
+                self._mUDPRxInvalid.inc()
+                continue
+            if debug:
+                self.logger.debug("tUDPListen: Received JSON: {} From: {}".format(jsonin, address))
+
+            # error checking, dict should have keys for network, ignore it if not there
+            if not isinstance(jsonin, dict) or 'network' not in jsonin:
+                continue
+            if not (jsonin['network'] == self._network or jsonin['network'] == "ALL"):
+                continue
+            # yep its for our network or "ALL"
+            # error checking, dict should have keys for type
+            if jsonin.get('type') in ("WirelessMessage", "WirelessMessageBatch"):
+                # got a WirelessMessage type json, need to generate the Language of Things message and
+                # put them on the TX queue
+                serialOut.extend(self._languageOfThingsFromJSON(jsonin))
+
+            elif jsonin.get('type') == "DeviceConfigurationRequest" and self.config.getboolean('DCR', 'dcr_enable'):
+                # we have a DeviceConfigurationRequest pass in onto the DCR thread
+                # TODO: error checking, dict should have keys for data
+                DCRRequests.append(jsonin)
+
+            elif jsonin.get('type') == "MessageBridge":
+                # we have a MessageBridge json do stuff with it
+                self.logger.debug("tUDPListen: JSON of type MessageBridge, passing to qMessageBridge")
+                self.qMessageBridge.put(jsonin)
+
+            elif jsonin.get('type') == "Subscribe":
+                self.logger.debug("tUDPListen: JSON of type Subscribe from {}".format(address))
+                replies.append((subscribe or self._processSubscribe)(jsonin, address))
+
+        if serialOut:
+            put = self.qSerialOut.putMany(serialOut)
+            if put < len(serialOut):
+                self.logger.warn("tUDPListen: Failed to put {} of {} messages on qSerialOut as it's full".format(len(serialOut) - put, len(serialOut)))
+            elif debug:
+                self.logger.debug("tUDPListen: Put {} on qSerialOut".format(serialOut))
+        if DCRRequests:
+            self.logger.debug("tUDPListen: Passing {} DeviceConfigurationRequest to qDCRRequest".format(len(DCRRequests)))
+            put = self.qDCRRequest.putMany(DCRRequests)
+            if put < len(DCRRequests):
+                self.logger.warn("tUDPListen: Failed to put {} json on qDCRRequest".format(len(DCRRequests) - put))
+        return replies
+
+    def _processSubscribe(self, jsonin, address):
+        """ Add, renew or remove a unicast subscription
+            Returns (reply, address), the reply goes to the subscribed address
+        """
+        data = jsonin.get('data', {})
+        if not isinstance(data, dict):
+            data = {}
         try:
-            UDPListenSocket.close()
-        except socket.error:
-            self.logger.exception("tUDPListen: Failed to close socket")
-        return
+            # always the sender's own address so nobody can subscribe someone else
+            if isinstance(address, tuple):
+                subscriber = (address[0], int(data.get('port', address[1])))
+            elif address:
+                # unix datagram client, messages go to the path it bound
+                subscriber = address
+            else:
+                raise ValueError("Unix datagram clients must bind a path to subscribe")
+            ttl = self._subscribers.subscribe(subscriber, data.get('filter', {}),
+                                              int(data.get('ttl', 300)),
+                                              data.get('format', "json"))
+        except (ValueError, TypeError, AttributeError) as error:
+            self.logger.warn("tUDPListen: Rejected subscription from {}: {}".format(address, error))
+            subscriber = address
+            state = "Rejected"
+            data['error'] = str(error)
+        else:
+            self.logger.info("tUDPListen: {} {} for {} seconds".format("Subscribed" if ttl else "Unsubscribed", subscriber, ttl))
+            state = "Subscribed" if ttl else "Unsubscribed"
+            data['ttl'] = ttl
+
+        reply = {'type': "Subscribe",
+                 'network': self._network,
+                 'timestamp': strftime("%d %b %Y %H:%M:%S +0000", gmtime()),
+                 'state': state,
+                 'data': data
+                 }
+        return (json.dumps(reply).encode(), subscriber)
+
+    def _languageOfThingsFromJSON(self, jsonin):
+        """ Language of Things messages for a WirelessMessage or each entry
+            of a WirelessMessageBatch, entries with a sendOn are stored to be
+            sent later instead
+            Returns a list of 12 character messages
+        """
+        if jsonin['type'] == "WirelessMessageBatch":
+            entries = jsonin.get('messages', [])
+        else:
+            entries = [jsonin]
+
+        messages = []
+        for entry in entries:
+            # error checking, each entry needs an id
+            if not isinstance(entry, dict) or 'id' not in entry:
+                continue
+            if 'sendOn' in entry:
+                self.processSendOnJSON(entry)
+                continue
+            for command in entry.get('data', []):
+                wirelessMsg = "a{}{}".format(entry['id'], command[0:9].upper())
+                while len(wirelessMsg) <12:
+                    wirelessMsg += '-'
+                messages.append(wirelessMsg)
+        return messages
 
     def processSendOnJSON(self, jsonin):
+        """ Put the data of a WirelessMessage with a sendOn in the device's
+            mailbox, to be sent when the device sends one of the sendOn
+            payloads, the replies from the device then let the rest go one
+            at a time. sendOn is a payload, a list of them or "WAKE" for any
+            of [Mailbox] wake_triggers, an optional ttl overrides [Mailbox] ttl
+            and an optional ref is passed back in the Mailbox status messages
+        """
         _id = jsonin['id']
-        request = { _id:[] }
-        request[_id].append({
-                            "on":jsonin['sendOn'],
-                            "send":jsonin['data'][0]
-                            })
-
-        for i in range(0, len(jsonin['data'])-1):
-            request[_id].append({ "on":jsonin['data'][i], "send":jsonin['data'][i+1] })
-
-        if not _id in self._sendOnIDs:
-            self._sendOnIDs.append(_id)
-
-        if _id in self._sendOnRequests:
-            for i in range(0, len(request[_id])):
-                self._sendOnRequests[_id].append(request[_id][i])
-        else:
-            self._sendOnRequests.update(request)
+        try:
+            on = jsonin['sendOn']
+            on = [on] if isinstance(on, str) else list(on)
+            on = [trigger[0:9].upper() for trigger in on]
+            commands = [command[0:9].upper() for command in jsonin.get('data', [])]
+            ttl = jsonin.get('ttl', None)
+            ttl = int(ttl) if ttl is not None else None
+        except (TypeError, ValueError, AttributeError):
+            self.logger.warn("Invalid sendOn in {}".format(jsonin))
+            return
+        if not commands or not on:
+            return
+        ref = jsonin.get('ref', None)
+
+        entries = self._mailbox.add(_id, commands, on, ttl, ref)
+        if not entries:
+            self.logger.warn("Mailbox for {} is full, rejected {}".format(_id, commands))
+            entry = {'send': commands[0], 'on': on}
+            if ref is not None:
+                entry['ref'] = ref
+            self._mailboxStatus(_id, entry, "Rejected")
+            return
+        for entry in entries:
+            self._mailboxStatus(_id, entry, "Queued")
 
     def sendOnForMatchedID(self, _id, command):
-        if _id in self._sendOnRequests:
-            if self._sendOnRequests[_id][0]['on'] == command:
-                wirelessMsg = "a{}{}".format(_id, self._sendOnRequests[_id][0]['send'])
-                while len(wirelessMsg) <12:
-                    wirelessMsg += '-'
-
-                try:
-                    self.qSerialOut.put_nowait(wirelessMsg)
-                except queue.Full:
-                    self.logger.debug("checkSendOnQueue: Failed to put {} on qSerialOut as it's full".format(wirelessMsg))
-                else:
-                    self.logger.debug("checkSendOnQueue: Put {} on qSerialOut".format(wirelessMsg))
-                    # if message sent, remove from the sendOnRequest
-                    self._sendOnRequests[_id].pop(0)
-                    # if is the last message for that ID, remove it from the sendOn arrays
-                    if len(self._sendOnRequests[_id]) == 0:
-                        self._sendOnIDs.remove(_id)
-                        self._sendOnRequests.pop(_id)
+        """ Send the oldest message waiting in the mailbox for device _id if
+            command is one that lets it go, called for every message received
+        """
+        (entry, expired) = self._mailbox.match(_id, command)
+        for old in expired:
+            self._mailboxStatus(_id, old, "Expired")
+        if entry is None:
+            return
+        wirelessMsg = "a{}{}".format(_id, entry['send'])
+        while len(wirelessMsg) <12:
+            wirelessMsg += '-'
+
+        # the device is only awake for a moment so it goes ahead of other commands
+        if self._SerialQueueTX(wirelessMsg, TXScheduler.TXScheduler.KeepAwake):
+            self.logger.debug("tSerial: Sent {} from the mailbox".format(wirelessMsg))
+            self._mailbox.taken(_id, entry)
+            self._mailboxStatus(_id, entry, "Sent")
+
+    def _mailboxStatus(self, _id, entry, state):
+        """ Tell clients what happened to a mailbox message, Queued, Rejected,
+            Sent or Expired, via UDP and MQTT
+        """
+        self._mMailboxResults[state].inc()
+
+        data = {'send': entry['send'], 'on': entry['on']}
+        if entry.get('expires') is not None:
+            data['expires'] = strftime("%d %b %Y %H:%M:%S +0000", gmtime(entry['expires']))
+        if 'ref' in entry:
+            data['ref'] = entry['ref']
+        status = {'type': "Mailbox",
+                  'network': self._network,
+                  'timestamp': strftime("%d %b %Y %H:%M:%S +0000", gmtime()),
+                  'id': _id,
+                  'state': state,
+                  'data': data
+                  }
+        jsonout = json.dumps(status)
+        try:
+            self.qUDPSend.put_nowait(jsonout)
+        except queue.Full:
+            self.logger.warn("Failed to put {} on qUDPSend as it's full".format(jsonout))
+        if self._mqttEnabled:
+            try:
+                self.qMQTTSend.put_nowait(jsonout)
+            except queue.Full:
+                self.logger.warn("Failed to put {} on qMQTTSend as it's full".format(jsonout))
 
     def _processMessageBridgeMessage(self, message):
         message['timestamp'] = strftime("%d %b %Y %H:%M:%S +0000", gmtime())
@@ -1560,8 +3365,22 @@ is running then run in the current terminal
             result = {}
             if 'request' in message['data']:
                 for request in message['data']['request']:
-                    if request == "deviceStore":
-                        result['deviceStore'] = self._deviceStore
+                    if request in ("deviceStore", "deviceHistory"):
+                        # optional since (store version), offset and limit to
+                        # ask for changes only or a page at a time
+                        try:
+                            since = message['data'].get('since', None)
+                            since = int(since) if since is not None else None
+                            offset = max(0, int(message['data'].get('offset', 0)))
+                            limit = max(0, int(message['data'].get('limit', 0)))
+                        except (TypeError, ValueError):
+                            self.logger.debug("tMain: Invalid since, offset or limit in {}".format(message))
+                            (since, offset, limit) = (None, 0, 0)
+                        (version, total, devices) = self._deviceStore.report(history=(request == "deviceHistory"),
+                                                                             since=since, offset=offset, limit=limit)
+                        result[request] = devices
+                        result['deviceStoreVersion'] = version
+                        result['deviceStoreTotal'] = total
                     # TODO: implement other MessageBridge "requests"
                     elif request == "PANID":
                         result['PANID'] = self._panID
@@ -1569,10 +3388,28 @@ is running then run in the current terminal
                         result['encryptionSet'] = self._encryption
                     elif request == "version":
                         result['version'] = self._version
+                    elif request == "runtime":
+                        result['runtime'] = self._runtime
                     elif request == "radioFirmwareVersion":
                         result['radioFirmwareVersion'] = self.radioFirmwareVersion
                     elif request == "radioSerialNumber":
                         result['radioSerialNumber'] = self.radioSerialNumber
+                    elif request == "stats":
+                        result['stats'] = self.metrics.snapshot()
+                    elif request == "txScheduler":
+                        result['txScheduler'] = self._txScheduler.stats()
+                    elif request == "dcrCache":
+                        result['dcrCache'] = self._dcrCache.report() if self._dcrCache is not None else {}
+                    elif request == "mailbox":
+                        result['mailbox'] = self._mailbox.report()
+                    elif request == "duplicates":
+                        result['duplicates'] = self._deduplicator.report()
+                    elif request == "queues":
+                        result['queues'] = {name: q.stats() for (name, q) in list(self._queues.items())}
+                    elif request == "subscribers":
+                        result['subscribers'] = self._subscribers.report()
+                    elif request == "streamClients":
+                        result['streamClients'] = [client.report() for client in list(self._streamClients)]
                 message['data']['result'] = result
 
             elif 'set' in message['data']:
@@ -1588,6 +3425,7 @@ is running then run in the current terminal
                          self._setRadioEncryption['encryptionKey'] = message['data']['set'][_set]
                 #in case of a 'set' received, set the flag to set encryption on radio
                 self.fSetRadioEncryption.set()
+                self._SerialWakeup()
 
         try:
             # just report state
@@ -1596,34 +3434,82 @@ is running then run in the current terminal
                     self.qReplyEncryption.put(message)
             else:
                 queueName = "qUDPSend"
-                self.qUDPSend.put(json.dumps(message))
+                for jsonout in self._chunkMessageBridgeReply(message):
+                    self.qUDPSend.put(jsonout)
         except queue.Full:
             self.logger.debug("tMain: Failed to put {} on {} as it's full".format(message, queueName))
         else:
             self.logger.debug("tMain: Put {} on {}".format(message, queueName))
 
+    def _chunkMessageBridgeReply(self, message):
+        """ Encode a MessageBridge reply, splitting the deviceStore or
+            deviceHistory over several sequence numbered replies if it will
+            not fit in one datagram of [UDP] max_datagram_size bytes
+            Returns a list of JSON strings
+        """
+        maxSize = self.config.getint('UDP', 'max_datagram_size', fallback=1400)
+        jsonout = json.dumps(message)
+        result = message.get('data', {}).get('result', {})
+        keys = [key for key in ("deviceStore", "deviceHistory") if key in result]
+        if len(jsonout) <= maxSize or not keys:
+            return [jsonout]
+
+        # everything but the devices goes in every chunk
+        base = dict(message)
+        base['data'] = dict(message['data'])
+        base['data']['result'] = dict(result)
+        for key in keys:
+            base['data']['result'][key] = {}
+        base['data']['sequence'] = 0
+        base['data']['sequenceCount'] = 0
+        # allow for the sequence numbers growing
+        baseSize = len(json.dumps(base)) + 16
+
+        chunks = [[]]
+        size = baseSize
+        for key in keys:
+            for (_id, entry) in result[key].items():
+                entrySize = len(json.dumps({_id: entry})) + 2
+                if chunks[-1] and size + entrySize > maxSize:
+                    chunks.append([])
+                    size = baseSize
+                chunks[-1].append((key, _id, entry))
+                size += entrySize
+
+        replies = []
+        for (sequence, chunk) in enumerate(chunks):
+            reply = dict(base)
+            reply['data'] = dict(base['data'])
+            reply['data']['result'] = dict(base['data']['result'])
+            for key in keys:
+                reply['data']['result'][key] = {}
+            for (key, _id, entry) in chunk:
+                reply['data']['result'][key][_id] = entry
+            reply['data']['sequence'] = sequence
+            reply['data']['sequenceCount'] = len(chunks)
+            replies.append(json.dumps(reply))
+        self.logger.debug("tMain: Split MessageBridge reply into {} chunks".format(len(replies)))
+        return replies
+
     def encodeWirelessMessageJson(self, message, network=None):
-        """Encode a single Language of Things message into an outgoing JSON message
+        """Encode a single Language of Things message into an outgoing WirelessMessage
+            Logs it to CSV and updates the deviceStore, then returns the
+            WirelessMessage record whose json bytes are shared by all outputs
             """
         self.logger.debug("tSerial: JSON: encoding {} to json WirelessMessage".format(message))
-        jsonDict = {'type':"WirelessMessage"}
-        jsonDict['network'] = network if network else "DEFAULT"
-        jsonDict['timestamp'] = strftime("%d %b %Y %H:%M:%S +0000", gmtime())
-        jsonDict['id'] = message[1:3]
-        jsonDict['data'] = [message[3:].strip("-")]
+        record = WirelessMessage.WirelessMessage.fromLanguageOfThings(message, network)
 
         if self._csvLog:
-            self.csvLogger.info(jsonDict['timestamp']+','+jsonDict['id']+','+jsonDict['data'][0])
+            self.csvLogger.info(record.csv())
 
-        jsonout = json.dumps(jsonDict)
-        self._updateDeviceStore(jsonDict)
+        self._updateDeviceStore(record)
         # extrem debugging
-        # self.logger.debug("JSON: {}".format(jsonout))
+        # self.logger.debug("JSON: {}".format(record.json))
 
-        return jsonout
+        return record
 
     def _updateDeviceStore(self, message):
-        self._deviceStore[message['id']] = {'data': message['data'][0], 'timestamp': message['timestamp']}
+        self._deviceStore.update(message.id, message.data, message.timestamp)
 
     def _chunkstring(self, string, length):
         return (string[0+i:length+i] for i in range(0, len(string), length))
@@ -1672,6 +3558,19 @@ is running then run in the current terminal
         """
         # first stop the main thread from try to restart stuff
         self.tMainStop.set()
+        if self._asyncLoop is not None:
+            # the event loop closes down its own sockets once it has stopped
+            try:
+                self._asyncLoop.call_soon_threadsafe(self._asyncLoop.stop)
+            except RuntimeError:
+                pass
+        if self._metricsServer:
+            try:
+                self._metricsServer.shutdown()
+                self._metricsServer.server_close()
+            except:
+                pass
+            self._metricsServer = None
         # writes the config file
         self._writeConfig()
         # now stop the other threads
@@ -1682,11 +3581,13 @@ is running then run in the current terminal
             pass
         try:
             self.tSerialStop.set()
+            self._SerialWakeup()
             self.tSerial.join()
         except:
             pass
         try:
             self.tDCRStop.set()
+            self.fDCRWakeup.set()
             self.tDCR.join()
         except:
             pass
@@ -1703,6 +3604,39 @@ is running then run in the current terminal
             except:
                 pass
 
+        if self._binaryEnabled:
+            try:
+                self.tBinaryListenStop.set()
+                self.tBinaryListen.join()
+                self.tBinarySendStop.set()
+                self.tBinarySend.join()
+            except:
+                pass
+
+        if self._sharedRingEnabled:
+            try:
+                self.tSharedRingStop.set()
+                self.tSharedRing.join()
+                self._sharedRing.close()
+            except:
+                pass
+
+        if self._streamEnabled:
+            try:
+                self.tStreamStop.set()
+                self._StreamWakeup()
+                self.tStream.join()
+            except:
+                pass
+
+        # keep the device store for next time
+        if self._deviceStore is not None and self._deviceStoreSnapshot:
+            self._saveDeviceStore()
+
+        # and anything still waiting in the mailbox
+        if self._mailbox is not None and self._mailboxPersist and self._mailbox.changed:
+            self._saveMailbox()
+
         if not self._background:
             if not sys.platform == 'win32':
                 try:
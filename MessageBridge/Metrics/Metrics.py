@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Metrics Classes
+    Low overhead counters and latency histograms for the Message Bridge
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+from time import monotonic
+from bisect import bisect_left
+import threading
+
+class Counter():
+    """ A single counter, should only be written to from one thread
+    """
+    __slots__ = ('name', 'help', 'label', 'value')
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+class SharedCounter(Counter):
+    """ A Counter that can be written to from several threads
+    """
+    __slots__ = ('_lock',)
+
+    def __init__(self, name, help, label=None):
+        Counter.__init__(self, name, help, label)
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+class Histogram():
+    """ Fixed bucket histogram of durations in seconds, should only be
+        written to from one thread
+    """
+    __slots__ = ('name', 'help', 'bounds', 'counts', 'sum', 'count')
+
+    defaultBounds = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                     1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+    def __init__(self, name, help, bounds=None):
+        self.name = name
+        self.help = help
+        self.bounds = tuple(bounds or self.defaultBounds)
+        # last bucket is +Inf
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """ List of (upper bound, cumulative count) with the last bound "+Inf"
+        """
+        result = []
+        total = 0
+        for (bound, count) in zip(self.bounds + ("+Inf",), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+class Metrics():
+    """ Registry of Counters, Histograms and Gauges
+
+        Counters and Histograms are created up front and then updated by
+        the owning thread with no locking, a shared Counter takes a lock so
+        several threads can update it. Gauges are functions that are called
+        when a snapshot is taken.
+    """
+
+    def __init__(self, prefix="messagebridge"):
+        self._prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = []
+        self._histograms = []
+        self._gauges = []
+        self._started = monotonic()
+
+    def counter(self, name, help, label=None, shared=False):
+        """ Create or find a Counter, label is an optional (name, value) pair,
+            shared for one written to from more than one thread
+        """
+        with self._lock:
+            for counter in self._counters:
+                if counter.name == name and counter.label == label:
+                    return counter
+            counter = (SharedCounter if shared else Counter)(name, help, label)
+            self._counters.append(counter)
+            return counter
+
+    def histogram(self, name, help, bounds=None):
+        """ Create or find a Histogram
+        """
+        with self._lock:
+            for histogram in self._histograms:
+                if histogram.name == name:
+                    return histogram
+            histogram = Histogram(name, help, bounds)
+            self._histograms.append(histogram)
+            return histogram
+
+    def gauge(self, name, help, function, label=None):
+        """ Register a function returning the current value of a Gauge
+        """
+        with self._lock:
+            self._gauges = [g for g in self._gauges if not (g[0] == name and g[3] == label)]
+            self._gauges.append((name, help, function, label))
+
+    def _store(self, result, name, label, value):
+        if label:
+            result.setdefault(name, {})[label[1]] = value
+        else:
+            result[name] = value
+
+    def snapshot(self):
+        """ All the current values as a dict suitable for JSON
+        """
+        with self._lock:
+            counters = list(self._counters)
+            histograms = list(self._histograms)
+            gauges = list(self._gauges)
+
+        result = {'uptime': round(monotonic() - self._started, 3),
+                  'counters': {},
+                  'gauges': {},
+                  'histograms': {}
+                  }
+        for counter in counters:
+            self._store(result['counters'], counter.name, counter.label, counter.value)
+        for (name, help, function, label) in gauges:
+            self._store(result['gauges'], name, label, function())
+        for histogram in histograms:
+            result['histograms'][histogram.name] = {'buckets': histogram.cumulative(),
+                                                    'sum': round(histogram.sum, 6),
+                                                    'count': histogram.count
+                                                    }
+        return result
+
+    def prometheus(self):
+        """ All the current values in the Prometheus text exposition format
+        """
+        with self._lock:
+            counters = list(self._counters)
+            histograms = list(self._histograms)
+            gauges = list(self._gauges)
+
+        lines = []
+        seen = set()
+
+        def header(name, help, kind):
+            if name not in seen:
+                seen.add(name)
+                lines.append("# HELP {} {}".format(name, help))
+                lines.append("# TYPE {} {}".format(name, kind))
+
+        def labels(label):
+            return '{{{}="{}"}}'.format(label[0], label[1]) if label else ""
+
+        lines.append("# HELP {0}_uptime_seconds Seconds since the Message Bridge started".format(self._prefix))
+        lines.append("# TYPE {0}_uptime_seconds gauge".format(self._prefix))
+        lines.append("{}_uptime_seconds {:.3f}".format(self._prefix, monotonic() - self._started))
+        for counter in counters:
+            name = "{}_{}_total".format(self._prefix, counter.name)
+            header(name, counter.help, "counter")
+            lines.append("{}{} {}".format(name, labels(counter.label), counter.value))
+        for (gaugeName, help, function, label) in gauges:
+            name = "{}_{}".format(self._prefix, gaugeName)
+            header(name, help, "gauge")
+            lines.append("{}{} {}".format(name, labels(label), function()))
+        for histogram in histograms:
+            name = "{}_{}".format(self._prefix, histogram.name)
+            header(name, histogram.help, "histogram")
+            for (bound, count) in histogram.cumulative():
+                lines.append('{}_bucket{{le="{}"}} {}'.format(name, bound, count))
+            lines.append("{}_sum {:.6f}".format(name, histogram.sum))
+            lines.append("{}_count {}".format(name, histogram.count))
+        return "\n".join(lines) + "\n"
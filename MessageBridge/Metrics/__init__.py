@@ -0,0 +1,3 @@
+from .Metrics import Metrics, Counter, SharedCounter, Histogram
+
+__ALL__ = ['Metrics', 'Counter', 'SharedCounter', 'Histogram']
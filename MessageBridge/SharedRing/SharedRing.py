@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Shared ring Classes
+    Received messages in a memory mapped ring of fixed width records that
+    any number of processes on the same host can tail
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+from collections import namedtuple
+import os
+import mmap
+import select
+import struct
+
+class SharedRing():
+    """ Writer for a ring file, little endian throughout
+
+        header, 64 bytes
+            magic       4 bytes  b'LRNG'
+            version     1 byte   1
+            pad         1 byte
+            recordSize  2 bytes  32
+            slots       4 bytes  records the ring holds
+            readers     2 bytes  reader wakeup slots
+            pad         2 bytes
+            network     16 bytes network name, ASCII, NUL padded
+            written     8 bytes  sequence number of the last record written
+            reserved    24 bytes
+        reader wakeup slots, 8 bytes each
+            waiting     4 bytes  set by a reader about to sleep, cleared by the writer
+            pid         4 bytes  process holding the slot
+        records, recordSize bytes each, record n (from 1) is in slot (n - 1) % slots
+            sequence    8 bytes  n once the record is complete, 0 while it is written
+            timestamp   8 bytes  monotonic nanoseconds when the message was received
+            networkID   2 bytes  as WirelessBinary.networkID()
+            id          2 bytes  device ID, ASCII
+            length      1 byte   payload length
+            payload     9 bytes  the Language of Things message without the
+                                 leading 'a', the ID and the '-' padding
+            pad         2 bytes
+
+        Records are read straight out of the mapping so tailing the ring
+        takes no system calls per record. A reader that falls more than
+        slots records behind sees a gap in the sequence numbers.
+
+        Wakeups work like a futex, a reader sets its waiting flag, checks
+        written once more and then blocks on its own FIFO, <path>.<slot>.wake.
+        After each batch the writer writes a byte to the FIFO of every
+        reader with waiting set, so a busy reader costs the writer nothing.
+    """
+
+    magic = b'LRNG'
+    version = 1
+    payloadSize = 9
+
+    _header = struct.Struct('<4sBxHIHxx16sQ24x')
+    _reader = struct.Struct('<II')
+    _record = struct.Struct('<QQH2sB9sxx')
+    _sequence = struct.Struct('<Q')
+    _waiting = struct.Struct('<I')
+    _writtenOffset = 32
+
+    def __init__(self, path, slots=4096, network="", readers=16, mode=0o640):
+        self.path = path
+        self.slots = max(1, slots)
+        self.readers = max(0, readers)
+        self.written = 0
+        self._wakeFiles = {}
+        self._recordsOffset = self._header.size + self.readers * self._reader.size
+        size = self._recordsOffset + self.slots * self._record.size
+
+        # build the new ring alongside and swap it in so a reader of an old
+        # ring never sees the file shrink under it
+        tmpPath = "{}.{}.tmp".format(path, os.getpid())
+        fd = os.open(tmpPath, os.O_RDWR | os.O_CREAT | os.O_TRUNC, mode)
+        try:
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._header.pack_into(self._map, 0, self.magic, self.version, self._record.size, self.slots,
+                               self.readers, network.encode('ascii', 'replace')[:16], 0)
+        os.replace(tmpPath, path)
+
+    def write(self, records):
+        """ Add (timestamp, networkID, id, data) records and publish them
+            Returns the sequence number of the last record
+        """
+        for (timestamp, networkID, id, data) in records:
+            if isinstance(data, str):
+                data = data.encode('ascii', 'replace')
+            data = data[:self.payloadSize]
+            self.written += 1
+            offset = self._recordsOffset + ((self.written - 1) % self.slots) * self._record.size
+            self._sequence.pack_into(self._map, offset, 0)
+            self._record.pack_into(self._map, offset, 0, timestamp, networkID, id.encode('ascii', 'replace'), len(data), data)
+            self._sequence.pack_into(self._map, offset, self.written)
+        self._sequence.pack_into(self._map, self._writtenOffset, self.written)
+        self._wake()
+        return self.written
+
+    def _wake(self):
+        """ Ring every reader that is waiting
+        """
+        for slot in range(self.readers):
+            offset = self._header.size + slot * self._reader.size
+            if not self._waiting.unpack_from(self._map, offset)[0]:
+                continue
+            self._waiting.pack_into(self._map, offset, 0)
+            # a cached FIFO can belong to a reader that has since gone and
+            # given up the slot, so have a second go with the current one
+            for attempt in range(2):
+                fd = self._wakeFiles.get(slot)
+                if fd is None:
+                    try:
+                        fd = os.open("{}.{}.wake".format(self.path, slot), os.O_WRONLY | os.O_NONBLOCK)
+                    except OSError:
+                        # reader has gone or never made its FIFO
+                        break
+                    self._wakeFiles[slot] = fd
+                try:
+                    os.write(fd, b'.')
+                except BlockingIOError:
+                    # FIFO is full so a wakeup is already pending
+                    pass
+                except OSError:
+                    os.close(fd)
+                    del self._wakeFiles[slot]
+                    continue
+                break
+
+    def close(self, remove=True):
+        for fd in self._wakeFiles.values():
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._wakeFiles = {}
+        self._map.close()
+        if remove:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+class SharedRingReader():
+    """ Tails a ring written by SharedRing
+
+        read() returns the records written since the last call, lost counts
+        the records that were overwritten before they could be read. wait()
+        blocks until there is something to read. Taking a wakeup slot needs
+        write access to the ring file, without one (no permission, windows or
+        all the slots taken) wait() polls instead.
+    """
+
+    Record = namedtuple('Record', ['sequence', 'timestamp', 'networkID', 'id', 'data'])
+
+    _pollInterval = 0.01
+    _maxSleep = 1       # longest wait() blocks for, bounds the cost of a missed wakeup
+
+    def __init__(self, path, fromStart=False):
+        self.path = path
+        self.lost = 0
+        self._slot = None
+        self._wakeFd = None
+        self._open(fromStart)
+
+    def _open(self, fromStart):
+        with open(self.path, 'rb') as ringFile:
+            self._inode = os.fstat(ringFile.fileno()).st_ino
+            self._map = mmap.mmap(ringFile.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, recordSize, self.slots, self.readers, network, written) = SharedRing._header.unpack_from(self._map, 0)
+        if magic != SharedRing.magic or version != SharedRing.version or recordSize != SharedRing._record.size:
+            self._map.close()
+            raise ValueError("{} is not a version {} ring".format(self.path, SharedRing.version))
+        self.network = network.rstrip(b'\0').decode('ascii', 'replace')
+        self._recordsOffset = SharedRing._header.size + self.readers * SharedRing._reader.size
+        # carry on from the oldest record still in the ring or from now
+        self.next = max(1, written - self.slots + 1) if fromStart else written + 1
+
+    def written(self):
+        return SharedRing._sequence.unpack_from(self._map, SharedRing._writtenOffset)[0]
+
+    def read(self, limit=0):
+        """ Records written since the last call, oldest first, at most limit
+            if it is not 0
+        """
+        written = self.written()
+        if written < self.next and self._replaced():
+            written = self.written()
+        if written - self.next + 1 > self.slots:
+            skipped = written - self.slots + 1 - self.next
+            self.lost += skipped
+            self.next += skipped
+        end = written if not limit else min(written, self.next + limit - 1)
+
+        records = []
+        size = SharedRing._record.size
+        while self.next <= end:
+            offset = self._recordsOffset + ((self.next - 1) % self.slots) * size
+            (sequence, timestamp, networkID, id, length, data) = SharedRing._record.unpack_from(self._map, offset)
+            if sequence != self.next or SharedRing._sequence.unpack_from(self._map, offset)[0] != sequence:
+                # overwritten while we were reading, pick up from the oldest
+                written = self.written()
+                skipped = max(1, written - self.slots + 1 - self.next)
+                self.lost += skipped
+                self.next += skipped
+                continue
+            records.append(self.Record(sequence, timestamp, networkID, id.decode('ascii', 'replace'),
+                                       data[:length].decode('ascii', 'replace')))
+            self.next += 1
+        return records
+
+    def _replaced(self):
+        """ Check if the writer has started a new ring in the same place,
+            when a Message Bridge restarts, and switch to it
+            Returns True if it has
+        """
+        try:
+            if os.stat(self.path).st_ino == self._inode:
+                return False
+        except OSError:
+            # Message Bridge has stopped, keep the old ring until it is back
+            return False
+        self._release()
+        self._map.close()
+        self._open(True)
+        return True
+
+    def _release(self):
+        """ Give up the wakeup slot
+        """
+        if self._slot is not None:
+            os.close(self._wakeFd)
+            os.close(self._slotFd)
+            try:
+                os.unlink("{}.{}.wake".format(self.path, self._slot))
+            except OSError:
+                pass
+            self._slot = None
+        self._wakeFd = None
+
+    def _claim(self):
+        """ Take a reader wakeup slot by making its FIFO, a FIFO left by a
+            reader that has gone is reused
+        """
+        if not hasattr(os, 'mkfifo'):
+            return
+        for slot in range(self.readers):
+            fifo = "{}.{}.wake".format(self.path, slot)
+            try:
+                os.mkfifo(fifo, 0o600)
+            except FileExistsError:
+                offset = SharedRing._header.size + slot * SharedRing._reader.size
+                pid = SharedRing._reader.unpack_from(self._map, offset)[1]
+                try:
+                    os.kill(pid, 0)
+                    continue
+                except ProcessLookupError:
+                    pass
+                except PermissionError:
+                    continue
+                os.unlink(fifo)
+                try:
+                    os.mkfifo(fifo, 0o600)
+                except FileExistsError:
+                    continue
+            try:
+                # the ring is mapped read only, the slot is written through the file
+                self._slotFd = os.open(self.path, os.O_RDWR)
+            except PermissionError:
+                os.unlink(fifo)
+                return
+            self._wakeFd = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+            self._slot = slot
+            self._wakeOffset = SharedRing._header.size + slot * SharedRing._reader.size
+            os.pwrite(self._slotFd, SharedRing._reader.pack(0, os.getpid()), self._wakeOffset)
+            return
+
+    def wait(self, timeout=None):
+        """ Block until there are records to read, for up to timeout seconds
+            Returns True if there are records, it can return False early
+            so call it in a loop
+        """
+        if self.written() >= self.next:
+            return True
+        if self._wakeFd is None:
+            self._claim()
+            if self._slot is None:
+                # no FIFO, poll
+                self._wakeFd = False
+        sleep = self._maxSleep if timeout is None else min(timeout, self._maxSleep)
+
+        if self._wakeFd is False:
+            while self.written() < self.next and sleep > 0:
+                select.select([], [], [], self._pollInterval)
+                sleep -= self._pollInterval
+        else:
+            os.pwrite(self._slotFd, SharedRing._waiting.pack(1), self._wakeOffset)
+            # check again now the writer can see we are waiting
+            if self.written() < self.next:
+                try:
+                    select.select([self._wakeFd], [], [], sleep)
+                except InterruptedError:
+                    pass
+                try:
+                    while os.read(self._wakeFd, 512):
+                        pass
+                except (BlockingIOError, OSError):
+                    pass
+            os.pwrite(self._slotFd, SharedRing._waiting.pack(0), self._wakeOffset)
+
+        if self.written() < self.next:
+            self._replaced()
+        return self.written() >= self.next
+
+    def close(self):
+        self._release()
+        self._map.close()
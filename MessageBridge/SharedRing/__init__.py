@@ -0,0 +1,3 @@
+from .SharedRing import SharedRing, SharedRingReader
+
+__ALL__ = ['SharedRing', 'SharedRingReader']
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Stream client Class
+    One TCP or WebSocket connection to the Message Bridge stream endpoint
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+from collections import OrderedDict
+import struct
+import hashlib
+import base64
+
+class StreamClient():
+    """ Buffers and frames the JSON going to one stream client and splits up
+        the requests coming back from it
+
+        A plain TCP client gets newline delimited JSON, a WebSocket client
+        one text frame per JSON message. Messages wait in a bounded buffer
+        of maxPending until the socket can take them, when it is full the
+        slow consumer policy decides what happens to the next one
+            drop_oldest  the oldest waiting message is thrown away
+            drop_newest  the new message is thrown away
+            disconnect   queue() returns False and the client should be closed
+            coalesce     as drop_oldest
+        With coalesce a new message from a device also replaces the one still
+        waiting from it, so a client that falls behind gets the latest from
+        each device rather than a backlog.
+        With the batch format consecutive WirelessMessage records waiting
+        are sent as one WirelessMessageBatch made by batchEncoder.
+
+        Not thread safe, a client is owned by the stream thread.
+    """
+
+    DropOldest = "drop_oldest"
+    DropNewest = "drop_newest"
+    Disconnect = "disconnect"
+    Coalesce = "coalesce"
+    policies = (DropOldest, DropNewest, Disconnect, Coalesce)
+
+    JSON = "json"
+    Batch = "batch"
+    formats = (JSON, Batch)
+
+    _GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+    _readSize = 65536           # most bytes read from the socket in one go
+    _fillSize = 65536           # most bytes encoded ahead of the socket
+    _maxHandshake = 8192        # longest WebSocket upgrade request accepted
+
+    def __init__(self, sock, address, websocket=False, maxPending=1000, policy=DropOldest,
+                 format=JSON, batchEncoder=None, batchSize=100, maxMessage=65536):
+        if policy not in self.policies:
+            raise ValueError("Invalid slow consumer policy: {}".format(policy))
+        if format not in self.formats:
+            raise ValueError("Unknown format {}".format(format))
+        self.sock = sock
+        self.address = address
+        self.websocket = websocket
+        self.maxPending = max(1, maxPending)
+        self.policy = policy
+        self.format = format
+        self.batchEncoder = batchEncoder
+        self.batchSize = max(1, batchSize)
+        self.maxMessage = maxMessage
+        # a WebSocket client is not sent anything until it has upgraded
+        self.open = not websocket
+        self.ids = None
+        self.networks = None
+        self.types = None
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self._in = bytearray()
+        self._out = bytearray()
+        self._fragment = None
+        self._pending = OrderedDict()   # seq: (key, item)
+        self._latest = {}               # key: seq of its waiting message, coalesce only
+        self._seq = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def __len__(self):
+        return len(self._pending)
+
+    @staticmethod
+    def _filter(values):
+        if values is None:
+            return None
+        if isinstance(values, str):
+            values = [values]
+        return frozenset(values)
+
+    def subscribe(self, filters, format=None):
+        """ Set the id, network and type filters and optionally the format
+            Raises ValueError for a bad format
+        """
+        if format is not None:
+            if format not in self.formats:
+                raise ValueError("Unknown format {}".format(format))
+            self.format = format
+        self.ids = self._filter(filters.get('id'))
+        self.networks = self._filter(filters.get('network'))
+        self.types = self._filter(filters.get('type'))
+
+    def matches(self, type, network, id=None):
+        return ((self.types is None or type in self.types) and
+                (self.networks is None or network in self.networks) and
+                (id is None or self.ids is None or id in self.ids))
+
+    def wantsWrite(self):
+        return bool(self._out) or (self.open and bool(self._pending))
+
+    def queue(self, item, key=None):
+        """ Add a message to send, item is JSON bytes or a WirelessMessage
+            record and key the device it is from for coalescing
+            Returns False if the client is too slow and should be disconnected
+        """
+        if not self.open:
+            return True
+        if self.policy == self.Coalesce and key is not None and key in self._latest:
+            self._pending[self._latest[key]] = (key, item)
+            self.coalesced += 1
+            return True
+        if len(self._pending) >= self.maxPending:
+            if self.policy == self.Disconnect:
+                return False
+            if self.policy == self.DropNewest:
+                self.dropped += 1
+                return True
+            self._pop()
+            self.dropped += 1
+        self._seq += 1
+        self._pending[self._seq] = (key, item)
+        if self.policy == self.Coalesce and key is not None:
+            self._latest[key] = self._seq
+        return True
+
+    def _pop(self):
+        (seq, (key, item)) = self._pending.popitem(last=False)
+        if key is not None and self._latest.get(key) == seq:
+            del self._latest[key]
+        return item
+
+    def flush(self):
+        """ Write as much as the socket will take without blocking
+            Returns False if the connection has failed
+        """
+        while True:
+            if not self._out and not self._fill():
+                return True
+            try:
+                sent = self.sock.send(self._out)
+            except (BlockingIOError, InterruptedError):
+                return True
+            except OSError:
+                return False
+            del self._out[:sent]
+            if self._out:
+                # socket buffer is full, wait until it is writable again
+                return True
+
+    def _fill(self):
+        """ Encode waiting messages into the output buffer
+            Returns False if there was nothing to encode
+        """
+        if not self.open or not self._pending:
+            return False
+        while self._pending and len(self._out) < self._fillSize:
+            item = self._pop()
+            if isinstance(item, bytes):
+                self._frame(item)
+                self.sent += 1
+                continue
+            records = [item]
+            if self.format == self.Batch and self.batchEncoder is not None:
+                while self._pending and len(records) < self.batchSize:
+                    nextItem = next(iter(self._pending.values()))[1]
+                    if isinstance(nextItem, bytes) or nextItem.network != item.network:
+                        break
+                    records.append(self._pop())
+            if len(records) > 1:
+                self._frame(self.batchEncoder(records))
+            else:
+                self._frame(item.json)
+            self.sent += len(records)
+        return True
+
+    def _frame(self, data, opcode=0x1):
+        """ Append one message to the output buffer
+        """
+        if not self.websocket:
+            self._out += data
+            self._out += b'\n'
+            return
+        length = len(data)
+        if length < 126:
+            self._out += struct.pack('!BB', 0x80 | opcode, length)
+        elif length < 65536:
+            self._out += struct.pack('!BBH', 0x80 | opcode, 126, length)
+        else:
+            self._out += struct.pack('!BBQ', 0x80 | opcode, 127, length)
+        self._out += data
+
+    def read(self):
+        """ Read what is waiting on the socket
+            Returns a list of complete JSON messages, None if the client has
+            closed the connection
+            Raises ValueError if the client breaks the protocol
+        """
+        try:
+            data = self.sock.recv(self._readSize)
+        except (BlockingIOError, InterruptedError):
+            return []
+        except OSError:
+            return None
+        if not data:
+            return None
+        self._in += data
+        if not self.websocket:
+            return self._readLines()
+        if not self.open and not self._handshake():
+            return []
+        return self._readFrames()
+
+    def _readLines(self):
+        messages = []
+        start = 0
+        while True:
+            end = self._in.find(b'\n', start)
+            if end < 0:
+                break
+            line = bytes(self._in[start:end]).strip()
+            if line:
+                messages.append(line)
+            start = end + 1
+        del self._in[:start]
+        if len(self._in) > self.maxMessage:
+            raise ValueError("Line longer than {} bytes".format(self.maxMessage))
+        return messages
+
+    def _handshake(self):
+        """ Answer the HTTP upgrade request that starts a WebSocket
+            Returns True once the connection is open
+        """
+        end = self._in.find(b'\r\n\r\n')
+        if end < 0:
+            if len(self._in) > self._maxHandshake:
+                raise ValueError("WebSocket upgrade request too long")
+            return False
+        lines = bytes(self._in[:end]).decode('latin-1').split('\r\n')
+        del self._in[:end + 4]
+        if not lines[0].startswith("GET "):
+            raise ValueError("Not a WebSocket upgrade request")
+        headers = {}
+        for line in lines[1:]:
+            (name, _, value) = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        key = headers.get('sec-websocket-key')
+        if not key or 'websocket' not in headers.get('upgrade', '').lower():
+            self._out += b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n'
+            self.flush()
+            raise ValueError("Not a WebSocket upgrade request")
+        accept = base64.b64encode(hashlib.sha1(key.encode('latin-1') + self._GUID).digest())
+        self._out += (b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n'
+                      b'Connection: Upgrade\r\nSec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+        self.open = True
+        return True
+
+    def _readFrames(self):
+        messages = []
+        while len(self._in) >= 2:
+            (first, second) = (self._in[0], self._in[1])
+            opcode = first & 0x0F
+            length = second & 0x7F
+            offset = 2
+            if length == 126:
+                if len(self._in) < 4:
+                    break
+                length = struct.unpack_from('!H', self._in, 2)[0]
+                offset = 4
+            elif length == 127:
+                if len(self._in) < 10:
+                    break
+                length = struct.unpack_from('!Q', self._in, 2)[0]
+                offset = 10
+            if length > self.maxMessage:
+                raise ValueError("Frame longer than {} bytes".format(self.maxMessage))
+            mask = None
+            if second & 0x80:
+                mask = bytes(self._in[offset:offset + 4])
+                offset += 4
+            if len(self._in) < offset + length:
+                break
+            payload = bytes(self._in[offset:offset + length])
+            del self._in[:offset + length]
+            if mask and length:
+                key = (mask * (length // 4 + 1))[:length]
+                payload = (int.from_bytes(payload, 'big') ^ int.from_bytes(key, 'big')).to_bytes(length, 'big')
+
+            if opcode == 0x8:
+                # close, answer it and let the caller drop the connection
+                self._frame(payload[:2], 0x8)
+                self.flush()
+                return None
+            elif opcode == 0x9:
+                self._frame(payload, 0xA)
+            elif opcode == 0xA:
+                pass
+            elif opcode == 0x0:
+                if self._fragment is None:
+                    raise ValueError("Continuation frame without a start")
+                self._fragment += payload
+                if len(self._fragment) > self.maxMessage:
+                    raise ValueError("Message longer than {} bytes".format(self.maxMessage))
+                if first & 0x80:
+                    messages.append(bytes(self._fragment))
+                    self._fragment = None
+            elif opcode in (0x1, 0x2):
+                if first & 0x80:
+                    messages.append(payload)
+                else:
+                    self._fragment = bytearray(payload)
+            else:
+                raise ValueError("Unknown WebSocket opcode {}".format(opcode))
+        return messages
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def report(self):
+        # unix stream clients have the path they connected to rather than (address, port)
+        (address, port) = self.address if isinstance(self.address, tuple) else (self.address, None)
+        if isinstance(address, bytes):
+            address = address.decode('utf-8', 'replace')
+        if self.websocket:
+            protocol = "websocket"
+        else:
+            protocol = "tcp" if port is not None else "unix"
+        return {'address': address,
+                'port': port,
+                'protocol': protocol,
+                'format': self.format,
+                'filter': {'id': sorted(self.ids) if self.ids is not None else None,
+                           'network': sorted(self.networks) if self.networks is not None else None,
+                           'type': sorted(self.types) if self.types is not None else None},
+                'pending': len(self._pending),
+                'sent': self.sent,
+                'dropped': self.dropped,
+                'coalesced': self.coalesced
+                }
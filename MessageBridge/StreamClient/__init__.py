@@ -0,0 +1,3 @@
+from .StreamClient import StreamClient
+
+__ALL__ = ['StreamClient']
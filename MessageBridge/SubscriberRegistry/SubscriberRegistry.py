@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Subscriber registry Class
+    Clients that have asked for messages to be unicast to them
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+from time import monotonic
+import threading
+
+class Subscriber():
+    """ One unicast destination and its filters
+
+        A filter of None matches everything, otherwise it is a frozenset of
+        allowed values. The id filter only applies to WirelessMessages.
+    """
+    __slots__ = ('address', 'ids', 'networks', 'types', 'format', 'expires', 'sent')
+
+    JSON = "json"
+    Binary = "binary"
+    formats = (JSON, Binary)
+
+    def __init__(self, address, ids, networks, types, format, expires):
+        self.address = address
+        self.ids = ids
+        self.networks = networks
+        self.types = types
+        self.format = format
+        self.expires = expires
+        self.sent = 0
+
+    def matches(self, type, network, id=None):
+        return ((self.types is None or type in self.types) and
+                (self.networks is None or network in self.networks) and
+                (id is None or self.ids is None or id in self.ids))
+
+    def report(self, now):
+        # unix datagram subscribers have a path rather than (address, port)
+        (address, port) = self.address if isinstance(self.address, tuple) else (self.address, None)
+        if isinstance(address, bytes):
+            address = address.decode('utf-8', 'replace')
+        return {'address': address,
+                'port': port,
+                'format': self.format,
+                'filter': {'id': sorted(self.ids) if self.ids is not None else None,
+                           'network': sorted(self.networks) if self.networks is not None else None,
+                           'type': sorted(self.types) if self.types is not None else None},
+                'ttl': max(0, int(self.expires - now)),
+                'sent': self.sent
+                }
+
+class SubscriberRegistry():
+    """ Subscribers keyed by (address, port) or unix socket path, each with
+        a lease that the client renews by subscribing again before ttl
+        seconds are up
+
+        Written by the UDP listen thread and read by the senders. Readers
+        get an immutable tuple from current() that is rebuilt on each change
+        so matching a message never takes the lock.
+    """
+
+    def __init__(self, maxSubscribers=32, maxTTL=3600):
+        self.maxSubscribers = maxSubscribers
+        self.maxTTL = maxTTL
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._current = ()
+        self._nextExpiry = None
+
+    def __len__(self):
+        return len(self._current)
+
+    @staticmethod
+    def _filter(values):
+        if values is None:
+            return None
+        if isinstance(values, str):
+            values = [values]
+        return frozenset(values)
+
+    def subscribe(self, address, filters, ttl, format=Subscriber.JSON):
+        """ Add or renew a subscription, a ttl of 0 removes it
+            Returns the granted ttl
+            Raises ValueError for a bad format or when the registry is full
+        """
+        if format not in Subscriber.formats:
+            raise ValueError("Unknown format {}".format(format))
+        ttl = min(max(0, ttl), self.maxTTL)
+        with self._lock:
+            if ttl == 0:
+                self._subscribers.pop(address, None)
+            else:
+                if address not in self._subscribers and len(self._subscribers) >= self.maxSubscribers:
+                    raise ValueError("Too many subscribers")
+                self._subscribers[address] = Subscriber(address,
+                                                        self._filter(filters.get('id')),
+                                                        self._filter(filters.get('network')),
+                                                        self._filter(filters.get('type')),
+                                                        format,
+                                                        monotonic() + ttl)
+            self._rebuild()
+        return ttl
+
+    def _rebuild(self):
+        self._current = tuple(self._subscribers.values())
+        self._nextExpiry = min([s.expires for s in self._current]) if self._current else None
+
+    def current(self):
+        """ The live subscribers, dropping any whose lease has run out
+        """
+        if self._nextExpiry is not None and monotonic() >= self._nextExpiry:
+            now = monotonic()
+            with self._lock:
+                for address in [a for (a, s) in self._subscribers.items() if s.expires <= now]:
+                    del self._subscribers[address]
+                self._rebuild()
+        return self._current
+
+    def report(self):
+        now = monotonic()
+        return [subscriber.report(now) for subscriber in self.current()]
@@ -0,0 +1,3 @@
+from .SubscriberRegistry import SubscriberRegistry
+
+__ALL__ = ['SubscriberRegistry']
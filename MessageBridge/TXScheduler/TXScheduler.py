@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" TX Scheduler Class
+    Orders the Language of Things messages going to the radio and spaces
+    them out to fit an airtime budget
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+from collections import deque
+from time import monotonic
+
+class TXScheduler():
+    """ Holds frames waiting to go to the radio, one queue per priority class
+            dcr        DeviceConfigurationRequest queries and DTY checks
+            keepawake  HELLOs keeping a CONFIGME device awake and mailbox
+                       messages for a device that has just woken
+            command    everything else, from UDP, MQTT and the other inputs
+        next() hands out the waiting frame with the highest priority once
+        the radio is allowed to transmit again, that is
+            frameTime + minGap seconds after the start of the last frame
+            and
+            sending it keeps the airtime used over the last window seconds
+            within dutyCycle percent of window, 0 for no limit
+        A frame that could not go straight away is counted as deferred, one
+        that waited longer than maxWait seconds (0 for no limit) or found its
+        class already holding maxPending frames is dropped.
+
+        Not thread safe, the scheduler is owned by the serial thread.
+    """
+
+    DCR = 0
+    KeepAwake = 1
+    Command = 2
+    classes = ("dcr", "keepawake", "command")
+
+    def __init__(self, frameTime, minGap=0, airtime=None, dutyCycle=0, window=3600, maxWait=0, maxPending=1000):
+        self.frameTime = frameTime
+        self.minGap = max(0, minGap)
+        self.airtime = frameTime if airtime is None else airtime
+        self.budget = window * dutyCycle / 100 if dutyCycle > 0 else None
+        self.window = window
+        self.maxWait = maxWait
+        self.maxPending = max(1, maxPending)
+        self.sent = [0] * len(self.classes)
+        self.deferred = [0] * len(self.classes)
+        self.dropped = [0] * len(self.classes)
+        self._pending = [deque() for name in self.classes]     # (frame, added)
+        self._nextFree = 0
+        self._history = deque()         # start of each frame still inside window
+        self._used = 0
+
+    def __len__(self):
+        return sum(len(pending) for pending in self._pending)
+
+    def pending(self, priority):
+        return len(self._pending[priority])
+
+    def full(self, priority):
+        return len(self._pending[priority]) >= self.maxPending
+
+    def add(self, frame, priority=Command):
+        """ Queue a frame to send
+            Returns False if it was dropped as its class is full
+        """
+        if self.full(priority):
+            self.dropped[priority] += 1
+            return False
+        now = monotonic()
+        if any(self._pending[:priority + 1]) or self._wait(now) > 0:
+            self.deferred[priority] += 1
+        self._pending[priority].append((frame, now))
+        return True
+
+    def next(self):
+        """ The frame to send now, if the radio may transmit
+            Returns (frame, priority) or None
+        """
+        now = monotonic()
+        self._expire(now)
+        if self._wait(now) > 0:
+            return None
+        for (priority, pending) in enumerate(self._pending):
+            if pending:
+                frame = pending.popleft()[0]
+                break
+        else:
+            return None
+        self._nextFree = now + self.frameTime + self.minGap
+        if self.budget is not None:
+            self._history.append(now)
+            self._used += self.airtime
+        self.sent[priority] += 1
+        return (frame, priority)
+
+    def delay(self):
+        """ Seconds until the next waiting frame can go, None if nothing is waiting
+        """
+        now = monotonic()
+        self._expire(now)
+        if not any(self._pending):
+            return None
+        return self._wait(now)
+
+    def _wait(self, now):
+        """ Seconds until the radio may transmit another frame
+        """
+        wait = max(0, self._nextFree - now)
+        if self.budget is None:
+            return wait
+        while self._history and self._history[0] <= now - self.window:
+            self._history.popleft()
+            self._used -= self.airtime
+        if self._used + self.airtime > self.budget + 1e-9:
+            # until enough of the oldest frames have left the window
+            over = int((self._used + self.airtime - self.budget) / self.airtime + 0.999999)
+            if over > len(self._history):
+                # a single frame is more than the budget, it will never fit
+                return max(wait, self.window)
+            wait = max(wait, self._history[over - 1] + self.window - now)
+        return wait
+
+    def _expire(self, now):
+        if not self.maxWait:
+            return
+        for (priority, pending) in enumerate(self._pending):
+            while pending and now - pending[0][1] > self.maxWait:
+                pending.popleft()
+                self.dropped[priority] += 1
+
+    def stats(self):
+        """ Counts per class and the airtime used over the window, as of the
+            last frame, as a dict
+        """
+        return {'classes': {name: {'pending': len(self._pending[priority]),
+                                   'sent': self.sent[priority],
+                                   'deferred': self.deferred[priority],
+                                   'dropped': self.dropped[priority]}
+                            for (priority, name) in enumerate(self.classes)},
+                'airtimeUsed': round(self._used, 6) if self.budget is not None else None,
+                'airtimeBudget': self.budget,
+                'window': self.window,
+                'minGap': self.minGap
+                }
@@ -0,0 +1,3 @@
+from .TXScheduler import TXScheduler
+
+__ALL__ = ['TXScheduler']
@@ -0,0 +1,3 @@
+from .WirelessBinary import WirelessBinary
+
+__ALL__ = ['WirelessBinary']
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" WirelessMessage record Class
+    Immutable record of a received Language of Things message and a
+    helper to coalesce records into WirelessMessageBatch JSON
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+from time import gmtime, strftime, monotonic
+from collections import namedtuple
+import json
+
+class WirelessMessage(namedtuple('WirelessMessage', ['network', 'timestamp', 'id', 'data', 'json', 'received'])):
+    """ A received Language of Things message and its WirelessMessage JSON
+
+        Built once per message and handed to every output (UDP, MQTT, CSV log,
+        deviceStore) so the timestamp and JSON encoding are only done once.
+        json holds the encoded packet as bytes ready to send and received
+        the monotonic time the record was built, used for latency metrics.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def fromLanguageOfThings(cls, message, network=None):
+        """ Build a record from a 12 character Language of Things message
+        """
+        network = network if network else "DEFAULT"
+        timestamp = strftime("%d %b %Y %H:%M:%S +0000", gmtime())
+        _id = message[1:3]
+        data = message[3:].strip("-")
+        jsonDict = {'type': "WirelessMessage",
+                    'network': network,
+                    'timestamp': timestamp,
+                    'id': _id,
+                    'data': [data]
+                    }
+        return cls(network, timestamp, _id, data, json.dumps(jsonDict).encode(), monotonic())
+
+    def csv(self):
+        """ CSV log line for this message
+        """
+        return "{},{},{}".format(self.timestamp, self.id, self.data)
+
+    def entryJson(self):
+        """ This message as an entry in a WirelessMessageBatch messages list
+        """
+        return json.dumps({'timestamp': self.timestamp, 'id': self.id, 'data': [self.data]}).encode()
+
+class WirelessMessageBatch():
+    """ Collects WirelessMessage records received within window seconds into
+        one WirelessMessageBatch JSON packet
+
+        A batch is ready when it holds maxMessages records, when the next
+        record would take it over maxBytes (0 for no limit) or window seconds
+        after its first record. A batch of one is sent as the record's own
+        WirelessMessage JSON so a quiet network looks no different.
+    """
+
+    _overhead = 100     # allowance for the type and network around the messages
+
+    def __init__(self, window, maxMessages, maxBytes=0):
+        self.window = window
+        self.maxMessages = max(1, maxMessages)
+        self.maxBytes = maxBytes
+        self.deadline = None
+        self._entries = []
+        self._records = []
+        self._size = self._overhead
+
+    def __len__(self):
+        return len(self._records)
+
+    def add(self, record):
+        """ Add a record
+            Returns a list of (json, records) batches that are ready to send
+        """
+        ready = []
+        entry = record.entryJson()
+        if self._records and self.maxBytes and self._size + len(entry) + 2 > self.maxBytes:
+            ready.append(self.take())
+        if not self._records:
+            self.deadline = monotonic() + self.window
+        self._entries.append(entry)
+        self._records.append(record)
+        self._size += len(entry) + 2
+        if len(self._records) >= self.maxMessages:
+            ready.append(self.take())
+        return ready
+
+    def due(self):
+        """ True if the window of the current batch has closed
+        """
+        return bool(self._records) and monotonic() >= self.deadline
+
+    def timeout(self, idle):
+        """ Seconds a sender can block for before the batch is due, idle if
+            the batch is empty
+        """
+        if not self._records:
+            return idle
+        return max(0, self.deadline - monotonic())
+
+    @classmethod
+    def encode(cls, records, entries=None):
+        """ JSON bytes for a list of records, a single record is sent as its
+            own WirelessMessage
+        """
+        if len(records) == 1:
+            return records[0].json
+        if entries is None:
+            entries = [record.entryJson() for record in records]
+        return b''.join([b'{"type": "WirelessMessageBatch", "network": ', json.dumps(records[0].network).encode(),
+                         b', "messages": [', b', '.join(entries), b']}'])
+
+    def take(self):
+        """ Empty the batch
+            Returns (json, records), json is bytes ready to send
+        """
+        records = self._records
+        data = self.encode(records, self._entries)
+        self._entries = []
+        self._records = []
+        self._size = self._overhead
+        self.deadline = None
+        return (data, records)
@@ -0,0 +1,3 @@
+from .WirelessMessage import WirelessMessage, WirelessMessageBatch
+
+__ALL__ = ['WirelessMessage', 'WirelessMessageBatch']
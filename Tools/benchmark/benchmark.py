@@ -0,0 +1,541 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" WirelessThings Message Bridge benchmark
+
+    Runs a real Message Bridge against the simulated radio from
+    Tools/radioSimulator and measures the pipeline from the outside over
+    UDP (and MQTT if paho is installed and a broker is given).
+    Each scenario starts a fresh Message Bridge process and records
+        serial RX -> UDP and UDP -> serial TX throughput
+        p50/p90/p99 latency
+        CPU seconds used by the Message Bridge per 1000 frames
+        RSS of the Message Bridge sampled every second
+        the Message Bridge own "stats" and "queues" replies
+    Results are written as JSON so runs can be compared across commits
+    and between the threads and asyncio runtimes
+
+    Usage
+    $ python benchmark.py
+    or
+    $ ./benchmark.py -s sensors50 burst1000 -o before.json
+    $ ./benchmark.py -o after.json --compare before.json
+    $ ./benchmark.py --runtime asyncio -o asyncio.json --compare after.json
+
+    Linux only, CPU and RSS are read from /proc
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import sys
+import os
+import json
+import socket
+import select
+import signal
+import argparse
+import logging
+import platform
+import tempfile
+import threading
+import subprocess
+import configparser
+from time import time, monotonic, sleep, strftime, gmtime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'radioSimulator'))
+from radioSimulator import radioSimulator
+
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:
+    mqtt = None
+
+class benchmark():
+
+    _bridgeDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'MessageBridge')
+    _clockTicks = os.sysconf('SC_CLK_TCK')
+    _pageSize = os.sysconf('SC_PAGE_SIZE')
+
+    # name: radio simulator options and what to drive through the Message Bridge
+    _scenarios = {
+                  'idle': {'devices': 0, 'rate': 0},
+                  'sensors50': {'devices': 50, 'rate': 1.0},
+                  'sensors50_mqtt': {'devices': 50, 'rate': 1.0, 'mqtt': True},
+                  'sensors50_batch': {'devices': 50, 'rate': 1.0, 'batch': 0.02},
+                  'burst1000': {'devices': 0, 'rate': 0, 'burst': 1000},
+                  'commands1000': {'devices': 0, 'rate': 0, 'commands': 1000},
+                  'dcr_storm': {'devices': 10, 'rate': 1.0, 'configme': 1, 'dcr': 20}
+                  }
+
+    def __init__(self, logger=None):
+        """Instantiation
+
+        Setup basics
+        """
+        if logger is None:
+            logging.getLogger().setLevel(logging.NOTSET)
+            self.logger = logging.getLogger('Benchmark')
+            self._ch = logging.StreamHandler()
+            self._ch.setLevel(logging.INFO)
+            self._ch.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+            self.logger.addHandler(self._ch)
+        else:
+            self.logger = logger
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _checkArgs(self):
+        """Parse the command line options
+        """
+        parser = argparse.ArgumentParser(description='Message Bridge benchmark', formatter_class=argparse.RawTextHelpFormatter)
+        parser.add_argument('-s', '--scenarios', nargs='+', choices=sorted(self._scenarios),
+                            default=['idle', 'sensors50', 'sensors50_batch', 'burst1000', 'commands1000', 'dcr_storm', 'sensors50_mqtt'],
+                            help='Scenarios to run (default all)'
+                            )
+        parser.add_argument('-t', '--duration', type=float, default=30,
+                            help='Seconds to measure each scenario for (default 30)'
+                            )
+        parser.add_argument('-o', '--output',
+                            help='JSON file to write the results to (default benchmark-<time>.json)'
+                            )
+        parser.add_argument('--compare',
+                            help='Earlier results JSON file to compare with'
+                            )
+        parser.add_argument('--send-port', type=int, default=50140,
+                            help='[UDP] send_port for the Message Bridge under test (default 50140)'
+                            )
+        parser.add_argument('--listen-port', type=int, default=50141,
+                            help='[UDP] listen_port for the Message Bridge under test (default 50141)'
+                            )
+        parser.add_argument('--mqtt-host', default="127.0.0.1",
+                            help='MQTT broker for the _mqtt scenarios (default 127.0.0.1)'
+                            )
+        parser.add_argument('--mqtt-port', type=int, default=1883,
+                            help='MQTT broker port (default 1883)'
+                            )
+        parser.add_argument('--runtime', choices=('threads', 'asyncio'), default="threads",
+                            help='[Run] runtime for the Message Bridge under test (default threads)'
+                            )
+        parser.add_argument('--bridge-log',
+                            help='Keep the Message Bridge console output in this file'
+                            )
+        self.args = parser.parse_args()
+
+    # --------------------------------------------------------------------
+    # Message Bridge process
+
+    def _writeConfig(self, path, port, scenario):
+        """ Config for the Message Bridge under test, everything that would
+            touch the disk is turned off
+        """
+        config = configparser.ConfigParser()
+        config['Debug'] = {'console_debug': "False", 'file_debug': "False"}
+        config['CSVLog'] = {'csv_log': "False"}
+        config['Serial'] = {'port': port, 'network': "Serial"}
+        config['UDP'] = {'send_port': str(self.args.send_port),
+                         'listen_port': str(self.args.listen_port),
+                         'use_local_only': "True",
+                         'batch_window': str(scenario.get('batch', 0))}
+        config['MQTT'] = {'enabled': str(scenario.get('mqtt', False)),
+                          'host': self.args.mqtt_host,
+                          'port': str(self.args.mqtt_port),
+                          'batch_window': str(scenario.get('batch', 0))}
+        config['DeviceStore'] = {'snapshot_enabled': "False"}
+        config['Mailbox'] = {'persist': "False"}
+        config['Metrics'] = {'http_enabled': "False"}
+        config['Run'] = {'pid_file_path_name': os.path.dirname(path),
+                         'runtime': self.args.runtime}
+        with open(path, 'w') as configFile:
+            config.write(configFile)
+
+    def _startBridge(self, configFile):
+        output = open(self.args.bridge_log, 'a') if self.args.bridge_log else subprocess.DEVNULL
+        return subprocess.Popen([sys.executable, 'MessageBridge.py', '-c', configFile],
+                                cwd=self._bridgeDir, stdout=output, stderr=subprocess.STDOUT)
+
+    def _stopBridge(self, process):
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(15)
+        except subprocess.TimeoutExpired:
+            self.logger.warning("Message Bridge did not stop, killing it")
+            process.kill()
+            process.wait()
+
+    def _cpuSeconds(self, pid):
+        """ User plus system CPU time used by pid
+        """
+        with open("/proc/{}/stat".format(pid)) as stat:
+            fields = stat.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self._clockTicks
+
+    def _rssKB(self, pid):
+        with open("/proc/{}/statm".format(pid)) as statm:
+            return int(statm.read().split()[1]) * self._pageSize // 1024
+
+    # --------------------------------------------------------------------
+    # traffic
+
+    def _reset(self):
+        with self._lock:
+            self._sent = {}             # (id, data) -> monotonic time handed to the radio
+            self._commands = {}         # (id, data) -> monotonic time sent via UDP
+            self._udpLatency = []
+            self._mqttLatency = []
+            self._commandLatency = []
+            self._udpFrames = 0
+            self._mqttFrames = 0
+            self._serialFrames = 0
+            self._dcrSent = {}
+            self._dcrReplies = {}
+            self._bridgeReplies = {}
+            self._firstRx = None
+            self._lastRx = None
+            self._lastCommand = None
+
+    def _onRadioSend(self, message):
+        key = (message[1:3], message[3:].rstrip('-'))
+        with self._lock:
+            self._sent[key] = monotonic()
+
+    def _onRadioReceive(self, message):
+        now = monotonic()
+        key = (message[1:3], message[3:].rstrip('-'))
+        with self._lock:
+            if key in self._commands:
+                self._commandLatency.append(now - self._commands.pop(key))
+                self._serialFrames += 1
+                self._lastCommand = now
+
+    def _UDPReceiveThread(self, sock):
+        while not self._stop.is_set():
+            if not select.select([sock], [], [], 0.2)[0]:
+                continue
+            (data, address) = sock.recvfrom(65536)
+            now = monotonic()
+            try:
+                jsonin = json.loads(data.decode())
+            except ValueError:
+                continue
+            if jsonin.get('type') == "WirelessMessage":
+                self._recordWirelessMessage(jsonin, now, udp=True)
+            elif jsonin.get('type') == "WirelessMessageBatch":
+                for message in jsonin.get('messages', []):
+                    self._recordWirelessMessage(message, now, udp=True)
+            elif jsonin.get('type') == "DeviceConfigurationRequest":
+                with self._lock:
+                    self._dcrReplies.setdefault(jsonin['data'].get('id'), (now, jsonin['data'].get('state')))
+            elif jsonin.get('type') == "MessageBridge":
+                with self._lock:
+                    self._bridgeReplies[jsonin.get('data', {}).get('id')] = jsonin
+
+    def _recordWirelessMessage(self, jsonin, now, udp):
+        for data in jsonin.get('data', []):
+            key = (jsonin.get('id'), data)
+            with self._lock:
+                sent = self._sent.get(key)
+                if sent is None:
+                    continue
+                if udp:
+                    self._udpFrames += 1
+                    self._udpLatency.append(now - sent)
+                    if self._firstRx is None:
+                        self._firstRx = now
+                    self._lastRx = now
+                else:
+                    self._mqttFrames += 1
+                    self._mqttLatency.append(now - sent)
+
+    def _MQTTConnect(self):
+        if mqtt is None:
+            self.logger.warning("paho not installed, MQTT messages will not be counted")
+            return None
+        client = mqtt.Client()
+        client.on_message = lambda client, userdata, message: self._MQTTMessage(message)
+        try:
+            client.connect(self.args.mqtt_host, self.args.mqtt_port, 60)
+        except (socket.error, OSError):
+            self.logger.warning("Could not connect to the MQTT broker, MQTT messages will not be counted")
+            return None
+        client.subscribe("llap/#")
+        client.loop_start()
+        return client
+
+    def _MQTTMessage(self, message):
+        try:
+            jsonin = json.loads(message.payload.decode())
+        except ValueError:
+            return
+        if jsonin.get('type') == "WirelessMessage":
+            self._recordWirelessMessage(jsonin, monotonic(), udp=False)
+        elif jsonin.get('type') == "WirelessMessageBatch":
+            for entry in jsonin.get('messages', []):
+                self._recordWirelessMessage(entry, monotonic(), udp=False)
+
+    def _sendJSON(self, sock, message):
+        sock.sendto(json.dumps(message).encode(), ("127.0.0.1", self.args.listen_port))
+
+    def _bridgeRequest(self, sock, request, requestID, timeout=5):
+        """ Send a MessageBridge request and wait for the reply
+        """
+        self._sendJSON(sock, {"type": "MessageBridge", "network": "ALL",
+                              "data": {"id": requestID, "request": request}})
+        end = monotonic() + timeout
+        while monotonic() < end:
+            with self._lock:
+                if requestID in self._bridgeReplies:
+                    return self._bridgeReplies[requestID]
+            sleep(0.05)
+        return None
+
+    def _waitReady(self, radio, timeout=60):
+        """ Wait until a frame from the radio makes it out over UDP, by then
+            the Message Bridge has finished talking to the radio in AT mode
+        """
+        end = monotonic() + timeout
+        while monotonic() < end:
+            radio.burst(1, "ZZ")
+            wait = monotonic() + 1
+            while monotonic() < wait:
+                with self._lock:
+                    if self._udpFrames:
+                        return True
+                sleep(0.05)
+        return False
+
+    @staticmethod
+    def _percentiles(values):
+        if not values:
+            return None
+        values = sorted(values)
+        pick = lambda p: values[int(round(p * (len(values) - 1)))]
+        return {'count': len(values),
+                'mean': sum(values) / len(values),
+                'p50': pick(0.50),
+                'p90': pick(0.90),
+                'p99': pick(0.99),
+                'max': values[-1]
+                }
+
+    # --------------------------------------------------------------------
+    # scenarios
+
+    def _runScenario(self, name):
+        scenario = self._scenarios[name]
+        self.logger.info("Scenario {}".format(name))
+        self._reset()
+        self._stop.clear()
+
+        radioArgs = ['-n', str(scenario['devices']), '-r', str(scenario['rate']),
+                     '-c', str(scenario.get('configme', 0)),
+                     '--configme-timeout', str(self.args.duration * 10 + 60)]
+        radio = radioSimulator(radioSimulator.parseArgs(radioArgs), logger=self.logger.getChild('radio'))
+        radio.logger.setLevel(logging.WARNING)
+        radio.onSend = self._onRadioSend
+        radio.onReceive = self._onRadioReceive
+        port = radio.start()
+
+        tempDir = tempfile.mkdtemp(prefix='MessageBridgeBenchmark')
+        configFile = os.path.join(tempDir, 'MessageBridge.cfg')
+        self._writeConfig(configFile, port, scenario)
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        sock.bind(("", self.args.send_port))
+        receiver = threading.Thread(name='tReceive', target=self._UDPReceiveThread, args=(sock,))
+        receiver.daemon = True
+        receiver.start()
+
+        mqttClient = self._MQTTConnect() if scenario.get('mqtt') else None
+
+        process = self._startBridge(configFile)
+        result = {'scenario': scenario}
+        try:
+            if not self._waitReady(radio):
+                result['error'] = "Message Bridge did not pass any traffic"
+                return result
+            sleep(1)
+            self._reset()
+
+            rss = []
+            startCPU = self._cpuSeconds(process.pid)
+            start = monotonic()
+            rss.append(self._rssKB(process.pid))
+
+            if scenario.get('burst'):
+                radio.burst(scenario['burst'])
+            if scenario.get('commands'):
+                self._sendCommands(sock, scenario['commands'])
+            if scenario.get('dcr'):
+                self._sendDCRs(sock, scenario['dcr'])
+
+            end = start + self.args.duration
+            while monotonic() < end and process.poll() is None:
+                sleep(min(1, max(0, end - monotonic())))
+                rss.append(self._rssKB(process.pid))
+                if self._scenarioDone(scenario):
+                    break
+            elapsed = monotonic() - start
+            cpu = self._cpuSeconds(process.pid) - startCPU
+
+            result.update(self._collect(scenario, elapsed, cpu, rss))
+            reply = self._bridgeRequest(sock, ["stats", "queues"], 'benchmark')
+            if reply:
+                result['bridge'] = reply['data'].get('result', {})
+        finally:
+            self._stopBridge(process)
+            self._stop.set()
+            receiver.join()
+            sock.close()
+            if mqttClient:
+                mqttClient.loop_stop()
+                mqttClient.disconnect()
+            radio.stop()
+            for file in os.listdir(tempDir):
+                os.unlink(os.path.join(tempDir, file))
+            os.rmdir(tempDir)
+        return result
+
+    def _scenarioDone(self, scenario):
+        """ Bursts, commands and DCRs finish early once everything is back
+        """
+        with self._lock:
+            if scenario.get('burst'):
+                return self._udpFrames >= scenario['burst']
+            if scenario.get('commands'):
+                return not self._commands
+            if scenario.get('dcr'):
+                return len(self._dcrReplies) >= scenario['dcr']
+        return False
+
+    def _sendCommands(self, sock, count):
+        """ Language of Things commands via UDP as fast as we can
+        """
+        for n in range(count):
+            data = "P{:04d}".format(n)
+            with self._lock:
+                self._commands[("BA", data)] = monotonic()
+            self._sendJSON(sock, {"type": "WirelessMessage", "network": "ALL", "id": "BA", "data": [data]})
+
+    def _sendDCRs(self, sock, count):
+        for n in range(count):
+            with self._lock:
+                self._dcrSent[n] = monotonic()
+            self._sendJSON(sock, {"type": "DeviceConfigurationRequest", "network": "ALL",
+                                  "data": {"id": n, "timeout": self.args.duration,
+                                           "toQuery": [{"command": "APVER"}, {"command": "DTY"}]}})
+
+    def _collect(self, scenario, elapsed, cpu, rss):
+        with self._lock:
+            frames = self._udpFrames + self._serialFrames
+            result = {'elapsed': elapsed,
+                      'cpu_seconds': cpu,
+                      'cpu_seconds_per_1k_frames': cpu * 1000 / frames if frames else None,
+                      'rss_kb': {'start': rss[0], 'end': rss[-1], 'max': max(rss),
+                                 'growth': rss[-1] - rss[0], 'samples': rss},
+                      'serial_to_udp': {'frames': self._udpFrames,
+                                        'frames_per_second': self._udpFrames / elapsed,
+                                        'latency_seconds': self._percentiles(self._udpLatency)}
+                      }
+            if scenario.get('burst'):
+                result['serial_to_udp']['lost'] = scenario['burst'] - self._udpFrames
+                if self._firstRx is not None:
+                    result['serial_to_udp']['burst_seconds'] = self._lastRx - self._firstRx
+            if scenario.get('commands'):
+                result['udp_to_serial'] = {'frames': self._serialFrames,
+                                           'lost': len(self._commands),
+                                           'frames_per_second': self._serialFrames / elapsed,
+                                           'latency_seconds': self._percentiles(self._commandLatency)}
+            if scenario.get('mqtt'):
+                result['serial_to_mqtt'] = {'frames': self._mqttFrames,
+                                            'latency_seconds': self._percentiles(self._mqttLatency)}
+            if scenario.get('dcr'):
+                states = {}
+                durations = []
+                for (requestID, (when, state)) in self._dcrReplies.items():
+                    states[state] = states.get(state, 0) + 1
+                    if requestID in self._dcrSent:
+                        durations.append(when - self._dcrSent[requestID])
+                result['dcr'] = {'sent': len(self._dcrSent),
+                                 'replies': len(self._dcrReplies),
+                                 'states': states,
+                                 'duration_seconds': self._percentiles(durations)}
+        return result
+
+    # --------------------------------------------------------------------
+
+    def _gitCommit(self):
+        try:
+            return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=self._bridgeDir,
+                                           stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def _compare(self, results):
+        """ Print the headline numbers next to an earlier run
+        """
+        with open(self.args.compare) as file:
+            old = json.load(file)
+        print("{:<16} {:<36} {:>12} {:>12}".format("scenario", "metric",
+              "{} {}".format(old.get('commit'), old.get('runtime', "threads")),
+              "{} {}".format(results.get('commit'), results.get('runtime'))))
+        for (name, scenario) in sorted(results['scenarios'].items()):
+            before = old['scenarios'].get(name)
+            if not before:
+                continue
+            for path in (('serial_to_udp', 'frames_per_second'), ('serial_to_udp', 'latency_seconds', 'p50'),
+                         ('serial_to_udp', 'latency_seconds', 'p99'), ('udp_to_serial', 'frames_per_second'),
+                         ('udp_to_serial', 'latency_seconds', 'p99'), ('dcr', 'duration_seconds', 'p50'),
+                         ('cpu_seconds_per_1k_frames',), ('rss_kb', 'growth')):
+                values = []
+                for result in (before, scenario):
+                    for key in path:
+                        result = result.get(key) if isinstance(result, dict) else None
+                    values.append(result)
+                if values[0] is None and values[1] is None:
+                    continue
+                print("{:<16} {:<36} {:>12} {:>12}".format(name, ".".join(path),
+                      *["-" if v is None else "{:.4g}".format(v) for v in values]))
+
+    def run(self):
+        """
+           This is the main entry point
+        """
+        self._checkArgs()
+        results = {'commit': self._gitCommit(),
+                   'created': strftime("%d %b %Y %H:%M:%S +0000", gmtime()),
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'duration': self.args.duration,
+                   'runtime': self.args.runtime,
+                   'scenarios': {}
+                   }
+        try:
+            for name in self.args.scenarios:
+                results['scenarios'][name] = self._runScenario(name)
+        except KeyboardInterrupt:
+            self.logger.info("Keyboard Interrupt - Exiting")
+
+        output = self.args.output or "benchmark-{}.json".format(int(time()))
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+        self.logger.info("Results written to {}".format(output))
+
+        if self.args.compare:
+            self._compare(results)
+
+# run code
+if __name__ == "__main__" :
+    app = benchmark()
+    app.run()
@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" WirelessThings virtual radio simulator
+
+    Opens a pseudo terminal that behaves like a WirelessThings radio so the
+    Message Bridge can be run, load tested and soaked without any hardware.
+    The simulated radio answers the AT command dialogue the Message Bridge
+    uses and sends Language of Things traffic from a number of simulated
+    devices, some of which can go into CONFIGME mode and answer DCR's.
+
+    Usage
+    $ python radioSimulator.py
+    or
+    $ ./radioSimulator.py -n 50 -r 1
+
+    The path of the pseudo terminal is printed at start, pass it to the
+    Message Bridge with its --port option
+
+    $ ./MessageBridge.py --port /dev/pts/5
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import sys
+import os
+import tty
+import select
+import errno
+import heapq
+import random
+import argparse
+import logging
+import threading
+from time import monotonic
+
+class simulatedDevice():
+    """ A single simulated Language of Things device
+    """
+
+    def __init__(self, devID, devType, interval, configme=False):
+        self.devID = devID
+        self.devType = devType
+        self.interval = interval
+        self.configme = configme
+        self.settings = {'APVER': "2.0", 'DTY': devType, 'INTVL': "005M", 'PANID': "5AA5",
+                         'RETRIES': "05", 'SNL': "000000", 'SNH': "000000", 'ENC': "OFF",
+                         'FVER': "0.99", 'DVI': "1", 'SLEEPM': "0"
+                         }
+        self.reading = random.uniform(15, 25)
+
+    def nextReading(self):
+        """ The next reading to report, a slowly wandering temperature
+        """
+        self.reading += random.uniform(-0.1, 0.1)
+        return "TEMP{:.2f}".format(self.reading)
+
+class radioSimulator():
+
+    _frameLength = 12
+    _ATGuardTime = 0.5      # delay before answering +++ with OK
+    _ATTimeout = 5          # the radio leaves AT mode after this long without a command
+    _maxOutput = 65536      # bytes held for the Message Bridge before dropping
+    _idChars = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+    def __init__(self, args, logger=None):
+        """Instantiation
+
+        Setup basics, args is the result of parseArgs()
+        """
+        self.args = args
+        if logger is None:
+            logging.getLogger().setLevel(logging.NOTSET)
+            self.logger = logging.getLogger('Radio Simulator')
+            self._ch = logging.StreamHandler()
+            self._ch.setLevel(logging.DEBUG if args.debug else logging.INFO)
+            self._ch.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+            self.logger.addHandler(self._ch)
+        else:
+            self.logger = logger
+
+        self._radio = {'VR': "0.99B SRFV2", 'SF': "1234567890", 'SN': "1234567890", 'LH': "0",
+                       'ID': "5AA5", 'EE': "0", 'EK': "000102030405060708090A0B0C0D0E0F"
+                       }
+        self._inATMode = False
+        self._ATBuffer = ""
+        self._ATLastCommand = 0
+        self._plusCount = 0
+        self._inBuffer = ""
+        self._output = bytearray()
+        self._lock = threading.Lock()
+        self._timers = []
+        self._timerSequence = 0
+
+        self._devices = []
+        self._configmeDevice = None
+        self._configmeIdle = 0
+
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
+        self.dcrAnswered = 0
+
+        # optional callbacks with each message sent to or received from the Message Bridge
+        self.onSend = None
+        self.onReceive = None
+
+        self._master = None
+        self._slave = None
+        self._wakeRead = None
+        self._wakeWrite = None
+        self.port = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def parseArgs(argv=None):
+        """Parse the command line options
+        """
+        parser = argparse.ArgumentParser(description='Virtual radio simulator for the Message Bridge', formatter_class=argparse.RawTextHelpFormatter)
+        parser.add_argument('-d', '--debug',
+                            help='Enable extra debug output to console',
+                            action='store_true'
+                            )
+        parser.add_argument('-n', '--devices', type=int, default=10,
+                            help='Number of simulated devices sending readings (default 10)'
+                            )
+        parser.add_argument('-r', '--rate', type=float, default=0.2,
+                            help='Readings per second from each device (default 0.2)'
+                            )
+        parser.add_argument('--repeat', type=int, default=1,
+                            help='Send each reading this many times like devices set to retry (default 1)'
+                            )
+        parser.add_argument('-c', '--configme', type=int, default=0,
+                            help='Number of extra devices that go into CONFIGME mode and answer DCRs (default 0)'
+                            )
+        parser.add_argument('--configme-interval', type=float, default=1.0,
+                            help='Seconds between CONFIGME messages from a device in CONFIGME mode (default 1)'
+                            )
+        parser.add_argument('--configme-timeout', type=float, default=30.0,
+                            help='Seconds a device stays in CONFIGME mode without being spoken to (default 30)'
+                            )
+        parser.add_argument('--devtype', default="SIMU01",
+                            help='devType reported to DTY by the CONFIGME devices (default SIMU01)'
+                            )
+        parser.add_argument('--reply-delay', type=float, default=0.02,
+                            help='Seconds a device takes to answer a message (default 0.02)'
+                            )
+        parser.add_argument('-l', '--link',
+                            help='Also make a symlink to the pseudo terminal at this path'
+                            )
+        parser.add_argument('-t', '--duration', type=float, default=0,
+                            help='Stop after this many seconds (default run until Ctrl-C)'
+                            )
+        return parser.parse_args(argv)
+
+    def openPort(self):
+        """ Create the pseudo terminal, returns the path to give the Message Bridge
+        """
+        (self._master, self._slave) = os.openpty()
+        (self._wakeRead, self._wakeWrite) = os.pipe()
+        os.set_blocking(self._wakeRead, False)
+        os.set_blocking(self._wakeWrite, False)
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self.port = os.ttyname(self._slave)
+        if self.args.link:
+            try:
+                os.unlink(self.args.link)
+            except OSError:
+                pass
+            os.symlink(self.port, self.args.link)
+        self.logger.info("Simulated radio on {}".format(self.args.link or self.port))
+        return self.args.link or self.port
+
+    def closePort(self):
+        for fd in (self._master, self._slave, self._wakeRead, self._wakeWrite):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._master = self._slave = self._wakeRead = self._wakeWrite = None
+        if self.args.link:
+            try:
+                os.unlink(self.args.link)
+            except OSError:
+                pass
+
+    def _deviceIDs(self):
+        """ Device IDs AA, AB .. ZZ
+        """
+        for first in self._idChars:
+            for second in self._idChars:
+                yield first + second
+
+    def _setupDevices(self):
+        ids = self._deviceIDs()
+        now = monotonic()
+        for n in range(self.args.devices):
+            device = simulatedDevice(next(ids), self.args.devtype, 1.0 / self.args.rate if self.args.rate > 0 else 0)
+            self._devices.append(device)
+            if device.interval:
+                # spread the first readings out over one interval
+                self._schedule(now + random.uniform(0, device.interval), self._sendReading, device)
+        for n in range(self.args.configme):
+            device = simulatedDevice("??", self.args.devtype, 1.0 / self.args.rate if self.args.rate > 0 else 0, configme=True)
+            device.settings['CHDEVID'] = next(ids)
+            self._devices.append(device)
+            self._schedule(now + random.uniform(0, 2), self._enterConfigme, device)
+
+    def _schedule(self, when, function, *args):
+        self._timerSequence += 1
+        heapq.heappush(self._timers, (when, self._timerSequence, function, args))
+
+    def _send(self, message):
+        """ Queue a Language of Things message for the Message Bridge
+        """
+        message = (message + "-" * self._frameLength)[:self._frameLength]
+        with self._lock:
+            if len(self._output) + self._frameLength > self._maxOutput:
+                self.dropped += 1
+                return
+            self._output += message.encode()
+        self.sent += 1
+        if self.onSend:
+            self.onSend(message)
+        self.logger.debug("TX:{}".format(message))
+
+    def _sendAT(self, response):
+        with self._lock:
+            self._output += "{}\r".format(response).encode()
+
+    def burst(self, count, devID="ZZ"):
+        """ Queue count readings from devID straight away, safe to call from another thread
+        """
+        for n in range(count):
+            self._send("a{}TEMP{:05d}".format(devID, n % 100000)[:self._frameLength])
+        try:
+            os.write(self._wakeWrite, b'w')
+        except OSError:
+            pass
+
+    def _sendReading(self, device):
+        if not self._inATMode and not device.configme:
+            reading = device.nextReading()
+            for n in range(self.args.repeat):
+                self._send("a{}{}".format(device.devID, reading))
+        self._schedule(monotonic() + device.interval * random.uniform(0.9, 1.1), self._sendReading, device)
+
+    def _enterConfigme(self, device):
+        """ A device enters CONFIGME mode when no other device is in it
+        """
+        if self._configmeDevice:
+            self._schedule(monotonic() + 1, self._enterConfigme, device)
+            return
+        self.logger.info("Device {} entering CONFIGME mode".format(device.settings['CHDEVID']))
+        self._configmeDevice = device
+        self._configmeIdle = monotonic()
+        self._sendConfigme(device)
+
+    def _sendConfigme(self, device):
+        if self._configmeDevice is not device:
+            return
+        if monotonic() - self._configmeIdle > self.args.configme_timeout:
+            self._leaveConfigme(device)
+            return
+        if not self._inATMode:
+            self._send("a??CONFIGME")
+        self._schedule(monotonic() + self.args.configme_interval, self._sendConfigme, device)
+
+    def _leaveConfigme(self, device):
+        """ Back to normal running with the ID given by CHDEVID
+        """
+        self.logger.info("Device {} leaving CONFIGME mode".format(device.settings['CHDEVID']))
+        self._configmeDevice = None
+        device.configme = False
+        device.devID = device.settings['CHDEVID']
+        if device.interval:
+            self._schedule(monotonic() + device.interval, self._sendReading, device)
+
+    def _processConfigme(self, command):
+        """ Answer a ?? message sent to the device in CONFIGME mode
+        """
+        device = self._configmeDevice
+        if not device:
+            return
+        self._configmeIdle = monotonic()
+        self.dcrAnswered += 1
+        reply = None
+        if command.startswith("HELLO"):
+            reply = "HELLO"
+        elif command.startswith("CONFIGEND") or command.startswith("REBOOT"):
+            reply = command
+            self._schedule(monotonic() + self.args.reply_delay * 2, self._leaveConfigme, device)
+        elif len(command) >= 3 and command[:2] == "EN" and command[2] in "123456":
+            reply = "ENACK"
+        else:
+            for name in sorted(device.settings, key=len, reverse=True):
+                if command.startswith(name):
+                    value = command[len(name):]
+                    if value and name != 'DTY':
+                        device.settings[name] = value
+                    reply = name + device.settings[name]
+                    break
+            else:
+                # unknown commands are echoed like a real device
+                reply = command
+        self._schedule(monotonic() + self.args.reply_delay, self._send, "a??" + reply)
+
+    def _processMessage(self, message):
+        """ A Language of Things message from the Message Bridge
+        """
+        self.received += 1
+        self.logger.debug("RX:{}".format(message))
+        if self.onReceive:
+            self.onReceive(message)
+        devID = message[1:3]
+        command = message[3:].rstrip("-")
+        if devID == "??":
+            self._processConfigme(command)
+            return
+        for device in self._devices:
+            if device.devID == devID and not device.configme:
+                # devices answer commands by echoing them
+                self._schedule(monotonic() + self.args.reply_delay, self._send, message)
+                return
+
+    def _processAT(self, command):
+        """ Answer an AT command
+        """
+        self._ATLastCommand = monotonic()
+        self.logger.debug("AT:{}".format(command))
+        if not command.startswith("AT"):
+            self._sendAT("ERR")
+            return
+        command = command[2:]
+        if command == "":
+            self._sendAT("OK")
+        elif command in ("AC", "WR"):
+            self._sendAT("OK")
+        elif command == "DN":
+            self._sendAT("OK")
+            self._inATMode = False
+            self.logger.debug("Left AT mode")
+        elif command[:2] in self._radio:
+            if len(command) == 2:
+                self._sendAT(self._radio[command])
+                self._sendAT("OK")
+            elif command[:2] in ('VR', 'SF'):
+                self._sendAT("ERR")
+            else:
+                self._radio[command[:2]] = command[2:]
+                self._sendAT("OK")
+        else:
+            self._sendAT("ERR")
+
+    def _enterATMode(self):
+        if not self._inATMode:
+            self._inATMode = True
+            self._ATBuffer = ""
+            self._ATLastCommand = monotonic()
+            self.logger.debug("Entered AT mode")
+            self._sendAT("OK")
+
+    def _processInput(self, data):
+        for char in data.decode('ascii', 'replace'):
+            if self._inATMode:
+                if char == '\r':
+                    self._processAT(self._ATBuffer.strip())
+                    self._ATBuffer = ""
+                elif char != '+':
+                    self._ATBuffer += char
+                continue
+
+            if char == '+':
+                self._plusCount += 1
+                if self._plusCount == 3:
+                    self._plusCount = 0
+                    self._inBuffer = ""
+                    # answer after the guard time like a real radio
+                    self._schedule(monotonic() + self._ATGuardTime, self._enterATMode)
+                continue
+            self._plusCount = 0
+
+            if char == 'a':
+                self._inBuffer = "a"
+            elif self._inBuffer:
+                self._inBuffer += char
+                if len(self._inBuffer) == self._frameLength:
+                    self._processMessage(self._inBuffer)
+                    self._inBuffer = ""
+
+    def loop(self, stopEvent):
+        """ Run the radio until stopEvent is set
+        """
+        while not stopEvent.is_set():
+            now = monotonic()
+            while self._timers and self._timers[0][0] <= now:
+                (when, sequence, function, args) = heapq.heappop(self._timers)
+                function(*args)
+
+            if self._inATMode and now - self._ATLastCommand > self._ATTimeout:
+                self.logger.debug("AT mode timed out")
+                self._inATMode = False
+
+            timeout = 0.5
+            if self._timers:
+                timeout = max(0, min(timeout, self._timers[0][0] - monotonic()))
+
+            with self._lock:
+                writing = [self._master] if self._output else []
+            (readable, writable, errored) = select.select([self._master, self._wakeRead], writing, [], timeout)
+
+            if self._wakeRead in readable:
+                try:
+                    os.read(self._wakeRead, 4096)
+                except OSError:
+                    pass
+
+            if self._master in readable:
+                try:
+                    data = os.read(self._master, 4096)
+                except OSError as e:
+                    if e.errno not in (errno.EAGAIN, errno.EIO):
+                        raise
+                else:
+                    self._processInput(data)
+
+            if writable:
+                with self._lock:
+                    try:
+                        written = os.write(self._master, self._output)
+                    except OSError as e:
+                        if e.errno != errno.EAGAIN:
+                            raise
+                    else:
+                        del self._output[:written]
+
+    def start(self):
+        """ Run the radio in a background thread, returns the port path
+        """
+        port = self.openPort()
+        self._setupDevices()
+        self._stop.clear()
+        self._thread = threading.Thread(name='tRadio', target=self.loop, args=(self._stop,))
+        self._thread.daemon = True
+        self._thread.start()
+        return port
+
+    def stop(self):
+        """ Stop a radio started with start()
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.closePort()
+
+    def run(self):
+        """
+           This is the main entry point
+        """
+        self.openPort()
+        self._setupDevices()
+        if self.args.duration:
+            timer = threading.Timer(self.args.duration, self._stop.set)
+            timer.daemon = True
+            timer.start()
+        try:
+            self.loop(self._stop)
+        except KeyboardInterrupt:
+            self.logger.info("Keyboard Interrupt - Exiting")
+        self.closePort()
+        self.logger.info("Sent {} messages, received {}, dropped {}, answered {} CONFIGME messages".format(self.sent, self.received, self.dropped, self.dcrAnswered))
+
+# run code
+if __name__ == "__main__" :
+    app = radioSimulator(radioSimulator.parseArgs())
+    app.run()